@@ -5,12 +5,11 @@
 
 from __future__ import print_function
 
-import atexit
 import argparse
 import getpass
-from tools import tasks
+from tools import invfile, resilience, soapreplay
 from pyVmomi import vim
-from pyVim.connect import SmartConnectNoSSL, Disconnect
+from pyVim.connect import SmartConnectNoSSL
 
 
 def get_args():
@@ -48,6 +47,9 @@ def get_args():
     parser.add_argument('-unitnumber',
                         help='The unit number of the attached disk on its controller')
 
+    soapreplay.add_arguments(parser)
+    invfile.add_arguments(parser)
+
     args = parser.parse_args()
 
     if not args.password:
@@ -58,15 +60,7 @@ def get_args():
 
 
 def get_obj(content, vim_type, name):
-    obj = None
-
-    container = content.viewManager.CreateContainerView(content.rootFolder, vim_type, True)
-
-    for c in container.view:
-        if c.name == name:
-            obj = c
-            break
-    return obj
+    return invfile.get_obj(content, vim_type, name)
 
 
 def Attach_vmdk(si, content, vm_obj, vdid, ds, controllerKey, unitNumber):
@@ -80,18 +74,22 @@ def Attach_vmdk(si, content, vm_obj, vdid, ds, controllerKey, unitNumber):
 
     ##Attaching the disk with the vDiskId
     print("##Attaching the disk to  whose identifier is %s" % (vdid))
-    attach_disk_task = vm_obj.AttachDisk_Task(id_object,ds_obj, int(controllerKey) , int(unitNumber) )
-    tasks.wait_for_tasks(si,[attach_disk_task])
+    # without a controller key and unit number vCenter picks a free slot
+    attach_disk_task = vm_obj.AttachDisk_Task(id_object, ds_obj,
+                                              int(controllerKey) if controllerKey is not None else None,
+                                              int(unitNumber) if unitNumber is not None else None)
+    resilience.wait_for_tasks(si,[attach_disk_task])
     print("##Attached the disk")
 
 
 def main():
     args = get_args()
-    si = SmartConnectNoSSL(host=args.host,
-                           user=args.user,
-                           pwd=args.password,
-                           port=int(args.port))
-    atexit.register(Disconnect, si)
+    si = soapreplay.connect(args, lambda: SmartConnectNoSSL(host=args.host,
+                                                            user=args.user,
+                                                            pwd=args.password,
+                                                            port=int(args.port)))
+    resilience.install(si, args.user, args.password)
+    invfile.use(args.inventory, args.host, args.inventory_max_age)
 
     content = si.RetrieveContent()
     print("##Searching for VM %s" % (args.vmname))
@@ -103,7 +101,7 @@ def main():
             output = Attach_vmdk(si, content, vm_obj, args.vDiskId, args.ds, args.controllerkey , args.unitnumber)
 
     except Exception as e:
-        print(e)
+        print(resilience.fault_message(e))
 
 
 if __name__ == "__main__":
@@ -5,12 +5,11 @@
 
 from __future__ import print_function
 
-import atexit
 import argparse
 import getpass
-from tools import  tasks
+from tools import invfile, resilience, soapreplay
 from pyVmomi import vim
-from pyVim.connect import SmartConnectNoSSL, Disconnect
+from pyVim.connect import SmartConnectNoSSL
 
 
 def get_args():
@@ -38,6 +37,9 @@ def get_args():
     parser.add_argument('-d', '--disk-number', required=True,
                         help='Disk number to change mode.')
 
+    soapreplay.add_arguments(parser)
+    invfile.add_arguments(parser)
+
     args = parser.parse_args()
 
     if not args.password:
@@ -48,15 +50,7 @@ def get_args():
 
 
 def get_obj(content, vim_type, name):
-    obj = None
-
-    container = content.viewManager.CreateContainerView(content.rootFolder, vim_type, True)
-
-    for c in container.view:
-        if c.name == name:
-            obj = c
-            break
-    return obj
+    return invfile.get_obj(content, vim_type, name)
 
 
 def find_disk(content, vm_obj, disk_label ):
@@ -82,6 +76,15 @@ def find_disk(content, vm_obj, disk_label ):
     return  [vdisk_id, disk_backed_datastore]
 
 
+def detach_vdisk(si, vm_obj, vdid):
+
+    id_object = vim.vslm.ID()
+    id_object.id = vdid
+
+    detach_disk_task = vm_obj.DetachDisk_Task(id_object)
+    resilience.wait_for_tasks(si,[detach_disk_task])
+
+
 def Detach_vmdk(si, content, vm_obj, disk_number, disk_prefix_label='Hard disk '):
 
     disk_label = disk_prefix_label + str(disk_number)
@@ -100,13 +103,9 @@ def Detach_vmdk(si, content, vm_obj, disk_number, disk_prefix_label='Hard disk '
     list_vdiskid_ds = find_disk(content, vm_obj, disk_label)
 
     try:
-        id_object = vim.vslm.ID()
-        id_object.id = list_vdiskid_ds[0]
-
     ##Detaching the disk with the vDisId
         print("##Detaching the disk %s whose identifier is %s"%(disk_label, list_vdiskid_ds[1]))
-        detach_disk_task = vm_obj.DetachDisk_Task(id_object)
-        tasks.wait_for_tasks(si,[detach_disk_task])
+        detach_vdisk(si, vm_obj, list_vdiskid_ds[0])
         print("##Detached")
 
     except Exception as e:
@@ -115,11 +114,12 @@ def Detach_vmdk(si, content, vm_obj, disk_number, disk_prefix_label='Hard disk '
 
 def main():
     args = get_args()
-    si = SmartConnectNoSSL(host=args.host,
-                           user=args.user,
-                           pwd=args.password,
-                           port=int(args.port))
-    atexit.register(Disconnect, si)
+    si = soapreplay.connect(args, lambda: SmartConnectNoSSL(host=args.host,
+                                                            user=args.user,
+                                                            pwd=args.password,
+                                                            port=int(args.port)))
+    resilience.install(si, args.user, args.password)
+    invfile.use(args.inventory, args.host, args.inventory_max_age)
 
     content = si.RetrieveContent()
     print("##Searching for VM %s" % (args.vmname))
@@ -132,7 +132,7 @@ def main():
             print("##The Disk %s is detached from the virtual machine %s..." % (args.disk_number, args.vmname))
 
     except Exception as e:
-        print(e)
+        print(resilience.fault_message(e))
 
 if __name__ == "__main__":
     main()
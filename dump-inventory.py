@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to walk the inventory once and write the VM, datastore and FCD lookup tables to a
+#compact binary file. vdisk-sn-op, mk-fcd, attach_disk, detach_disk and fcd-inventory map the file
+#with -inventory (or $FCD_INVENTORY) and look names and vDiskIds up in it instead of searching vCenter.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import time
+from tools import cli, invfile, inventory, resilience, sessionpool, transport
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-output', default='fcd-inventory.bin',
+                        help='File to write, replaced atomically')
+    parser.add_argument('-no-fcds', dest='no_fcds', action='store_true',
+                        help='Only record the FCDs attached to VMs, skip listing the FCDs of every datastore')
+    parser.add_argument('-page-size', dest='page_size', type=int, default=1000,
+                        help='Objects per PropertyCollector page')
+    parser.add_argument('-sessions', type=int, default=4,
+                        help='Number of vCenter sessions the per datastore FCD listings are spread over')
+    transport.add_arguments(parser)
+
+    args = parser.parse_args()
+    return cli.prompt_for_password(args)
+
+
+def main():
+    args = get_args()
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    start = time.time()
+    fcds = None
+    if not args.no_fcds:
+        pool = sessionpool.SessionPool(args.host, args.user, args.password, args.port,
+                                       size=args.sessions, seed=si, on_connect=transport.tuner(args))
+        try:
+            fcds = inventory.list_fcds(si, inventory.collect_datastores(si, args.page_size),
+                                       workers=args.sessions, pool=pool)
+        finally:
+            pool.close()
+
+    names, vdisks, datastores = invfile.collect(si, args.page_size, fcds)
+    written = invfile.write(args.output, args.host, names, vdisks, datastores)
+    print(colored("##Wrote %s in %.1fs : %d names, %d FCDs, %d datastores, %d bytes" %
+                  (args.output, time.time() - start, written['names'], written['vdisks'],
+                   written['datastores'], written['bytes']), "green"))
+
+
+if __name__ == "__main__":
+    main()
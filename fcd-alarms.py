@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to list the alarms triggered on hosts, datastores and VMs in one retrieval, e.g. the
+#ones raised during an FCD snapshot window, to watch alarms as they trigger and clear, and to reset
+#the listed alarms to green in bulk.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import datetime
+import json
+from tools import alarm, cli, resilience, transport
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+ENTITY_TYPES = {'host': vim.HostSystem, 'datastore': vim.Datastore, 'vm': vim.VirtualMachine}
+COLORS = {'red': 'red', 'yellow': 'yellow', 'green': 'green', 'triggered': 'red', 'cleared': 'green'}
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-op', '--operation', required=True,
+                        choices=['list', 'watch', 'reset'],
+                        help='The operation that you want to perform')
+    parser.add_argument('-types', default='host,datastore,vm',
+                        help='Comma separated entity types out of %s' % ', '.join(sorted(ENTITY_TYPES)))
+    parser.add_argument('-status',
+                        help='Comma separated alarm states to keep, e.g. red,yellow')
+    parser.add_argument('-since', type=float,
+                        help='Only alarms triggered in the last that many minutes')
+    parser.add_argument('-workers', type=int, default=8,
+                        help='Alarm resets in flight')
+    parser.add_argument('-max-wait', dest='max_wait', type=int, default=60,
+                        help='Seconds watch waits for vCenter per update call')
+    parser.add_argument('-page-size', dest='page_size', type=int, default=1000,
+                        help='Objects per PropertyCollector page')
+    parser.add_argument('-json', action='store_true',
+                        help='Print one JSON record per line')
+    transport.add_arguments(parser)
+
+    args = parser.parse_args()
+    try:
+        args.types = [ENTITY_TYPES[name.strip()] for name in args.types.split(',') if name.strip()]
+    except KeyError as e:
+        parser.error("unknown entity type %s" % e)
+    args.status = [s.strip() for s in args.status.split(',')] if args.status else None
+    return cli.prompt_for_password(args)
+
+
+def print_record(record, as_json, change=None):
+    if change:
+        record = dict(record, change=change)
+    if as_json:
+        print(json.dumps(record, default=str))
+        return
+    text = "%-10s %-16s %-30s %-40s %s" % (record['status'], record['entityType'], record['entityName'],
+                                           record['alarmName'] or record['alarm'], record['time'])
+    if change:
+        text = "%-9s %s" % (change, text)
+    print(colored(text, COLORS.get(change or record['status'])))
+
+
+def main():
+    args = get_args()
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    # against the clock of vCenter, which stamped the alarms
+    since = si.CurrentTime() - datetime.timedelta(minutes=args.since) if args.since else None
+
+    if args.operation == 'watch':
+        try:
+            for change, record in alarm.watch_triggered_alarms(si, args.types, args.max_wait):
+                if record is None:
+                    continue
+                if args.status and record['status'] not in args.status:
+                    continue
+                print_record(record, args.json, change)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    alarms = alarm.harvest_triggered_alarms(si, args.types, args.page_size).filter(args.status, since)
+
+    if args.operation == 'list':
+        for record in sorted(alarms.records, key=lambda r: (r['entityType'], r['entityName'] or '', r['time'])):
+            print_record(record, args.json)
+        if not args.json:
+            print(colored("\n##%d triggered alarms on %d entities" % (len(alarms), len(alarms.by_entity)), "green"))
+        return
+
+    results = alarm.reset_alarms(si, [(record['entity'], record['alarm'], record['entityType'])
+                                      for record in alarms.records], workers=args.workers)
+    failed = [r for r in results if not r['ok']]
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        elif not result['ok']:
+            print(colored("###Could not reset %s on %s : %s" % (result['alarm_moref'], result['entity_moref'],
+                                                                result['error']), "red"))
+    if not args.json:
+        print(colored("##Reset %d of %d alarms" % (len(results) - len(failed), len(results)),
+                      "red" if failed else "green"))
+
+
+if __name__ == "__main__":
+    main()
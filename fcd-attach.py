@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to attach, detach or move many FCDs at once, e.g. to move every FCD of a failed VM to
+#a standby VM. The disks of one VM change with a single reconfigure, VMs are reconfigured in parallel
+#and the controller slots of attached disks are picked automatically.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import json
+from tools import audit, cli, concurrency, diskchange, inventory, pchelper, resilience, sessionpool, transport
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from pyVmomi import vim
+from termcolor import colored
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-op', '--operation', choices=['attach', 'detach', 'move'],
+                        help='attach the FCDs to -vm, detach them from -vm, or move them from -from to -vm')
+    parser.add_argument('-vm', '--vmname',
+                        help='VM the FCDs are attached to, or detached from with -op detach')
+    parser.add_argument('-from', dest='source',
+                        help='VM the FCDs are moved away from with -op move')
+    parser.add_argument('-vDiskIds',
+                        help='Comma separated vDiskIds, default all FCDs of the VM they are detached from')
+    parser.add_argument('-file',
+                        help='File of changes, one "attach,<vm>,<vDiskId>" or "detach,<vm>,<vDiskId>" per line')
+    parser.add_argument('-workers', type=int, default=8,
+                        help='Upper bound of VMs reconfigured in parallel')
+    parser.add_argument('-max-per-host', dest='max_per_host', type=int, default=4,
+                        help='Upper bound of VMs of one host reconfigured in parallel')
+    parser.add_argument('-sessions', type=int, default=4,
+                        help='Number of vCenter sessions the reconfigures are spread over')
+    parser.add_argument('-json', action='store_true',
+                        help='Print one JSON record per disk')
+    transport.add_arguments(parser)
+    audit.add_arguments(parser)
+
+    args = parser.parse_args()
+    if not args.file and not args.operation:
+        parser.error("give -op or -file")
+    if args.operation and not args.vmname:
+        parser.error("-op %s needs -vm" % args.operation)
+    if args.operation == 'move' and not args.source:
+        parser.error("-op move needs -from")
+    if args.operation == 'attach' and not args.vDiskIds:
+        parser.error("-op attach needs -vDiskIds")
+    return cli.prompt_for_password(args)
+
+
+def split(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def requested(args):
+    """ (op, VM name, vDiskId or None for all the FCDs of the VM) of every change asked for """
+
+    if args.file:
+        with open(args.file) as changes:
+            lines = [split(line) for line in changes if line.strip() and not line.startswith('#')]
+        bad = [line for line in lines if len(line) != 3 or line[0] not in ('attach', 'detach')]
+        if bad:
+            raise ValueError("Lines %s of %s are not op,vm,vDiskId" % (', '.join(','.join(b) for b in bad), args.file))
+        return [tuple(line) for line in lines]
+
+    vdisk_ids = split(args.vDiskIds) or [None]
+    if args.operation == 'attach':
+        return [('attach', args.vmname, vdisk_id) for vdisk_id in vdisk_ids]
+    if args.operation == 'detach':
+        return [('detach', args.vmname, vdisk_id) for vdisk_id in vdisk_ids]
+    return ([('detach', args.source, vdisk_id) for vdisk_id in vdisk_ids] +
+            [('attach', args.vmname, vdisk_id) for vdisk_id in vdisk_ids])
+
+
+def build_changes(index, si, wanted):
+    """ diskchange.run changes from the requested ones, VMs and datastores resolved through the index """
+
+    # VMs are told apart by moId, a name two VMs share, e.g. in two datacenters, is refused
+    moids = {}
+    for disks in index.vm_disks.values():
+        for disk in disks:
+            moids.setdefault(disk['vmName'], set()).add(disk['vm'])
+    vms = {}
+    for name in set(name for _, name, _ in wanted):
+        if len(moids.get(name, ())) > 1:
+            raise ValueError("VM name %s is used by %s, rename the VMs first" % (name, ', '.join(sorted(moids[name]))))
+        if name in moids:
+            vms[name] = vim.VirtualMachine(next(iter(moids[name])), si._stub)
+        else:
+            # VMs without any disk are not in the index
+            vms[name] = pchelper.get_obj_by_name(si.content, [vim.VirtualMachine], name)
+    missing = sorted(name for name, vm_obj in vms.items() if vm_obj is None)
+    if missing:
+        raise ValueError("VMs %s are not found" % ', '.join(missing))
+
+    def _fcds_of(name):
+        return [disk['vDiskId'] for disk in index.vm_disks.get(name, [])
+                if disk['vDiskId'] and disk['vm'] == vms[name]._moId]
+
+    # attaching all FCDs means all those the detaches take away
+    detached_all = [vdisk_id for op, name, one in wanted if op == 'detach' and one is None
+                    for vdisk_id in _fcds_of(name)]
+    changes = []
+    for op, name, vdisk_id in wanted:
+        if vdisk_id:
+            vdisk_ids = [vdisk_id]
+        else:
+            vdisk_ids = _fcds_of(name) if op == 'detach' else detached_all
+        for one in vdisk_ids:
+            if one not in index.fcds:
+                raise ValueError("FCD %s is not found on any accessible datastore" % one)
+            changes.append({'op': op, 'vm': vms[name], 'vmName': name, 'vDiskId': one,
+                            'datastore': index.datastores[index.fcds[one]]['obj']})
+    return changes
+
+
+def describe(change):
+    return {'op': change['op'], 'vm': change['vmName'], 'vDiskId': change['vDiskId'], 'ok': change.get('ok'),
+            'controllerKey': change.get('controllerKey'), 'unitNumber': change.get('unitNumber'),
+            'error': change.get('error')}
+
+
+def main():
+    args = get_args()
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+    audit.use(args.audit, args.host)
+
+    pool = sessionpool.SessionPool(args.host, args.user, args.password, args.port,
+                                   size=args.sessions, seed=si, on_connect=transport.tuner(args))
+    try:
+        index = inventory.FcdIndex.build(si, pool=pool)
+        try:
+            changes = build_changes(index, si, requested(args))
+        except (ValueError, IOError) as e:
+            print(colored("###%s" % e, "red"))
+            return
+        if not changes:
+            print(colored("##Nothing to change", "green"))
+            return
+
+        def _done(change):
+            record = describe(change)
+            if change['ok']:
+                audit.log('attachDisk' if change['op'] == 'attach' else 'detachDisk', task=change.get('task'),
+                          vDiskId=change['vDiskId'], vm=change['vmName'],
+                          datastore=index.datastore_name(change['datastore']._moId))
+            if args.json:
+                print(json.dumps(record))
+            elif change['ok']:
+                print(colored("###%(op)s %(vDiskId)s %(vm)s : done" % record, "green"))
+            else:
+                print(colored("###%(op)s %(vDiskId)s %(vm)s : %(error)s" % record, "red"))
+
+        controller = concurrency.ConcurrencyController(global_limit=args.workers, host_limit=args.max_per_host)
+        diskchange.run(pool, changes, workers=args.workers, on_done=_done, controller=controller)
+    finally:
+        pool.close()
+
+    if not args.json:
+        ok = len([change for change in changes if change['ok']])
+        print(colored("\n##%d of %d changes done with %d reconfigures" % (
+            ok, len(changes), len(set((change['op'], change['vm']._moId) for change in changes))),
+            "green" if ok == len(changes) else "red"))
+
+
+if __name__ == "__main__":
+    main()
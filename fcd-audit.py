@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to keep an audit trail of FCD snapshot, revert, promote, attach and detach operations.
+#harvest reads the new vCenter tasks and events since the last run into a local append only store,
+#query lists the stored operations of an FCD or a VM.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import argparse
+import datetime
+import getpass
+import json
+from tools import audit, resilience, transport
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Process args for the FCD audit trail')
+
+    parser.add_argument('-s', '--host',
+                        action='store',
+                        help='Remote host to connect to, needed for harvest and to pick its records in query')
+    parser.add_argument('-o', '--port',
+                        type=int,
+                        default=443,
+                        action='store',
+                        help='Port to connect on')
+    parser.add_argument('-u', '--user',
+                        action='store',
+                        help='User name to use when connecting to host')
+    parser.add_argument('-p', '--password',
+                        action='store',
+                        help='Password to use when connecting to host')
+
+    parser.add_argument('-op', '--operation', required=True,
+                        choices=['harvest', 'query'],
+                        help='The operation that you want to perform')
+    parser.add_argument('-store', required=True,
+                        help='Directory of the audit store')
+    parser.add_argument('-batch', type=int, default=audit.MAX_BATCH,
+                        help='Tasks and events read per page, at most %d' % audit.MAX_BATCH)
+    parser.add_argument('-vDiskId', '--virtualDiskId',
+                        help='Only the operations on this FCD')
+    parser.add_argument('-vm', '--vmname',
+                        help='Only the operations on this VM, name or moId')
+    parser.add_argument('-since', type=float,
+                        help='Only the operations of the last that many hours')
+    parser.add_argument('-match',
+                        help='Only the operations whose name matches this regular expression, e.g. snapshot')
+    parser.add_argument('-json', action='store_true',
+                        help='Print one JSON record per line')
+    transport.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.operation == 'harvest' and not (args.host and args.user):
+        parser.error("harvest needs host and user")
+    if args.operation == 'harvest' and not args.password:
+        args.password = getpass.getpass(
+            prompt='Enter password for host %s and user %s: ' %
+                   (args.host, args.user))
+    return args
+
+
+def print_record(record, as_json):
+    if as_json:
+        print(json.dumps(record, sort_keys=True))
+        return
+    details = " | ".join("%s : %s" % (key, record[key])
+                         for key in ('vm', 'vDiskId', 'snapshotId', 'datastore', 'user', 'task', 'error')
+                         if record.get(key))
+    print(colored("### %s %-7s %-60s %s" % (record['time'], record.get('state') or '', record['operation'], details),
+                  "red" if record.get('state') == 'error' else "green"))
+
+
+def main():
+    args = get_args()
+
+    if args.operation == 'query':
+        since = datetime.datetime.utcnow() - datetime.timedelta(hours=args.since) if args.since else None
+        found = [record for record in audit.query(args.store, args.virtualDiskId, args.vmname, since, args.match)
+                 if not args.host or record.get('host') == args.host]
+        for record in found:
+            print_record(record, args.json)
+        if not args.json:
+            print(colored("\n##%d operations" % len(found), "green"))
+        return
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    tasks = audit.harvest_tasks(si, args.store, args.host, args.batch)
+    events = audit.harvest_events(si, args.store, args.host, args.batch)
+    print(colored("##Added %d tasks and %d events to %s" % (tasks, events, audit.store_path(args.store)), "green"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to measure what the SOAP transport options save against a given vCenter. The same
+#read only FCD workload is run with and without gzip responses and with one or several kept alive
+#connections, and the calls, connections, bytes and time of every profile are compared. Run it from
+#where the scripts normally run, the savings grow with the round trip time to the vCenter.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from tools import cli, inventory, resilience, transport
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+# name, compressed responses, HTTP connections kept alive
+PROFILES = [
+    ('plain', False, 1),
+    ('gzip', True, 1),
+    ('keepalive', False, None),
+    ('gzip+keepalive', True, None),
+]
+
+CURRENT_TIME = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">'
+                '<soapenv:Body><CurrentTime xmlns="urn:vim25">'
+                '<_this type="ServiceInstance">ServiceInstance</_this>'
+                '</CurrentTime></soapenv:Body></soapenv:Envelope>')
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-rounds', type=int, default=3,
+                        help='Times the workload is repeated per profile')
+    parser.add_argument('-workers', type=int, default=8,
+                        help='Threads sharing the session, also the size of the kept alive pool')
+    parser.add_argument('-fcds', type=int, default=50,
+                        help='FCDs whose snapshot info is retrieved per round')
+    parser.add_argument('-raw', type=int, default=20,
+                        help='Raw SOAP requests sent per round, as the alarm helpers do')
+    parser.add_argument('-page-size', dest='page_size', type=int, default=500,
+                        help='Objects per PropertyCollector page')
+    parser.add_argument('-json', action='store_true',
+                        help='Print JSON instead of a table')
+
+    args = parser.parse_args()
+    return cli.prompt_for_password(args)
+
+
+def workload(si, args):
+    """ Read only calls the FCD scripts make the most, paged device lists, FCD listing and snapshot info """
+
+    index = inventory.FcdIndex.build(si, page_size=args.page_size, workers=args.workers)
+    manager = si.content.vStorageObjectManager
+
+    def _info(vdisk_id):
+        id_object = vim.vslm.ID()
+        id_object.id = vdisk_id
+        manager.RetrieveSnapshotInfo(id_object, index.datastores[index.fcds[vdisk_id]]['obj'])
+
+    with ThreadPoolExecutor(max_workers=args.workers) as threads:
+        list(threads.map(_info, sorted(index.fcds)[:args.fcds]))
+
+
+def raw_soap(stub, count, keepalive):
+    """ Seconds taken by count raw SOAP posts, one connection each or over the shared session """
+
+    started = time.time()
+    for _ in range(count):
+        if keepalive:
+            transport.post_soap(stub, CURRENT_TIME)
+        else:
+            requests.post(url='https://{0}/sdk'.format(stub.host), data=CURRENT_TIME, verify=False,
+                          headers={'Cookie': stub.cookie, 'SOAPAction': 'urn:vim25',
+                                   'Content-Type': 'text/xml; charset=utf-8'})
+    return time.time() - started
+
+
+def run_profiles(si, args):
+    stub = transport.soap_stub(si)
+    meter = transport.TrafficMeter(stub)
+    results = []
+    try:
+        for name, compress, pool_size in PROFILES:
+            transport.tune(si, compress=compress, pool_size=pool_size or args.workers)
+            # every profile starts without warm connections
+            stub.DropConnections()
+            transport.close_soap_session(stub)
+            meter.reset()
+            raw_seconds = 0.0
+            for _ in range(args.rounds):
+                workload(si, args)
+                raw_seconds += raw_soap(stub, args.raw, keepalive=pool_size is None)
+            result = meter.snapshot()
+            result['seconds'] -= raw_seconds
+            result.update({'profile': name, 'raw_seconds': raw_seconds})
+            results.append(result)
+    finally:
+        meter.remove()
+    return results
+
+
+def print_results(results):
+    base = results[0]
+    print(colored("%-16s %8s %12s %12s %12s %10s %10s %12s" % ('profile', 'calls', 'connections', 'sent KB',
+                                                               'received KB', 'seconds', 'ms/call', 'raw seconds'),
+                  "green"))
+    for result in results:
+        print("%-16s %8d %12d %12.1f %12.1f %10.2f %10.1f %12.2f" % (
+            result['profile'], result['calls'], result['connections'], result['sent'] / 1024.0,
+            result['received'] / 1024.0, result['seconds'],
+            1000.0 * result['seconds'] / max(result['calls'], 1), result['raw_seconds']))
+
+    best = results[-1]
+    print("\n##%s against %s : %.0f%% fewer bytes received, %.0f%% less time, %d fewer connections" % (
+        best['profile'], base['profile'],
+        100.0 * (1 - float(best['received']) / max(base['received'], 1)),
+        100.0 * (1 - best['seconds'] / max(base['seconds'], 1e-6)),
+        base['connections'] - best['connections']))
+
+
+def main():
+    args = get_args()
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+
+    results = run_profiles(si, args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
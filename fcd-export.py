@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to export only the blocks of an FCD that changed between two FCD snapshots
+#and to rebuild the full disk from a base export plus the incremental exports.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import argparse
+import getpass
+import importlib
+import os
+from tools import cbt, resilience
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+vdisk_sn_op = importlib.import_module('vdisk-sn-op')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Process args for the changed block export of FCD snapshots')
+
+    parser.add_argument('-s', '--host',
+                        action='store',
+                        help='Remote host to connect to, needed for export')
+    parser.add_argument('-o', '--port',
+                        type=int,
+                        default=443,
+                        action='store',
+                        help='Port to connect on')
+    parser.add_argument('-u', '--user',
+                        action='store',
+                        help='User name to use when connecting to host')
+    parser.add_argument('-p', '--password',
+                        action='store',
+                        help='Password to use when connecting to host')
+
+    parser.add_argument('-op', '--operation', required=True,
+                        choices=['export', 'rebuild'],
+                        help='Export the changed blocks of a snapshot or rebuild a full disk from the exports')
+    parser.add_argument('-vDiskId', '--virtualDiskId',
+                        help='vDiskId of FCD Disk')
+    parser.add_argument('-ds', '--dataStore',
+                        help='Datastore which backs the virtual storage object')
+    parser.add_argument('-snid',
+                        help='Snapshot id to export')
+    parser.add_argument('-base-snid', dest='base_snid',
+                        help='Older snapshot id the export is taken against. Without it every allocated block is exported')
+    parser.add_argument('-source',
+                        help='File or block device holding the contents of the snapshot -snid, e.g. the snapshot disk hot-added to a backup proxy')
+    parser.add_argument('-target',
+                        help='Directory the extents and manifest are written to')
+    parser.add_argument('-manifest',
+                        help='Manifest of the snapshot to rebuild')
+    parser.add_argument('-output',
+                        help='File the rebuilt disk image is written to')
+
+    args = parser.parse_args()
+
+    if args.operation == 'export':
+        missing = [name for name in ('host', 'user', 'virtualDiskId', 'dataStore', 'snid', 'source', 'target')
+                   if not getattr(args, name)]
+        if missing:
+            parser.error("export needs %s" % ', '.join(missing))
+        if not args.password:
+            args.password = getpass.getpass(
+                prompt='Enter password for host %s and user %s: ' %
+                       (args.host, args.user))
+    elif not args.manifest or not args.output:
+        parser.error("rebuild needs manifest and output")
+    return args
+
+
+def export_name(vdisk_id, snid):
+    return "%s-%s" % (vdisk_id, snid)
+
+
+def export_snapshot(content, vdisk_id, ds, snid, base_snid, source, target):
+
+    ds_obj = vdisk_sn_op.get_obj(content, [vim.Datastore], ds)
+    if not ds_obj:
+        raise RuntimeError("Datastore %s is not found" % ds)
+
+    parent = None
+    change_id = '*'
+    if base_snid:
+        parent = export_name(vdisk_id, base_snid) + cbt.MANIFEST_SUFFIX
+        if not os.path.exists(os.path.join(target, parent)):
+            raise RuntimeError("The export of the base snapshot %s is not in %s" % (base_snid, target))
+        change_id = cbt.snapshot_change_id(content, vdisk_id, ds_obj, base_snid)
+
+    capacity = cbt.disk_capacity(content, vdisk_id, ds_obj)
+    areas = cbt.query_changed_areas(content, vdisk_id, ds_obj, snid, change_id, capacity)
+    changed = sum(length for _, length in areas)
+    print("##%s extents with %s bytes changed out of %s (%.1f%%)" % (
+        len(areas), changed, capacity, 100.0 * changed / capacity if capacity else 0))
+
+    reader = cbt.FileExtentReader(source)
+    try:
+        meta = {'vDiskId': vdisk_id, 'datastore': ds, 'snapshotId': snid,
+                'baseSnapshotId': base_snid, 'changeId': change_id, 'capacity': capacity}
+        return cbt.export_extents(reader, areas, target, export_name(vdisk_id, snid), meta, parent)
+    finally:
+        reader.close()
+
+
+def main():
+    args = get_args()
+
+    if args.operation == 'rebuild':
+        written = cbt.rebuild_disk(args.manifest, args.output)
+        print(colored("##Rebuilt %s from %s, %s bytes applied" % (args.output, args.manifest, written), "green"))
+        return
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+
+    content = si.RetrieveContent()
+
+    try:
+        manifest = export_snapshot(content, args.virtualDiskId, args.dataStore, args.snid,
+                                   args.base_snid, args.source, args.target)
+        print(colored("##Exported snapshot %s of FCD %s, manifest : %s" % (args.snid, args.virtualDiskId, manifest), "green"))
+    except Exception as e:
+        print(colored("##Exception in exporting the snapshot : %s ", "red") % (resilience.fault_message(e)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to map every FCD to the VM it is attached to in one inventory pass, and to list
+#orphaned FCDs, disks not yet promoted to FCD and FCDs with deep snapshot chains.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import json
+from tools import cli, invfile, inventory, pchelper, resilience, sessionpool, transport
+from pyVmomi import vim, vmodl
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-op', '--operation', required=True,
+                        choices=['summary', 'orphans', 'candidates', 'deep', 'lookup'],
+                        help='The report that you want')
+    parser.add_argument('-vDiskId', '--virtualDiskId',
+                        help='vDiskId to look up the VM of')
+    parser.add_argument('-vm', '--vmname',
+                        help='VM to look up the FCDs of')
+    parser.add_argument('-depth', type=int, default=8,
+                        help='Snapshot chain depth from which an FCD is reported by -op deep')
+    parser.add_argument('-page-size', dest='page_size', type=int, default=500,
+                        help='Objects per PropertyCollector page')
+    parser.add_argument('-sessions', type=int, default=4,
+                        help='Number of vCenter sessions the per datastore and per FCD calls are spread over')
+    parser.add_argument('-json', action='store_true',
+                        help='Print JSON instead of text')
+    transport.add_arguments(parser)
+    invfile.add_arguments(parser)
+
+    args = parser.parse_args()
+    return cli.prompt_for_password(args)
+
+
+def report(index, args, si, pool):
+    if args.operation == 'summary':
+        return {'datastores': len(index.datastores),
+                'fcds': len(index.fcds),
+                'attached': len(index.attachments),
+                'orphans': len(index.orphans()),
+                'unpromoted': len(index.unpromoted),
+                'missing': len(index.missing())}
+
+    if args.operation == 'orphans':
+        return [{'vDiskId': vdisk_id, 'datastore': index.datastore_name(index.fcds[vdisk_id])}
+                for vdisk_id in index.orphans()]
+
+    if args.operation == 'candidates':
+        return [{'vm': d['vmName'], 'label': d['label'], 'datastore': index.datastore_name(d['datastore']),
+                 'fileName': d['fileName']} for d in index.unpromoted]
+
+    if args.operation == 'deep':
+        deep = index.deep_chains(args.depth, si, pool=pool)
+        return [{'vDiskId': vdisk_id, 'depth': depth,
+                 'vm': (index.vm_of(vdisk_id) or {}).get('vmName'),
+                 'datastore': index.datastore_name(index.fcds.get(vdisk_id))}
+                for vdisk_id, depth in sorted(deep.items(), key=lambda item: -item[1])]
+
+    if args.virtualDiskId:
+        disk = index.vm_of(args.virtualDiskId)
+        return {'vDiskId': args.virtualDiskId,
+                'datastore': index.datastore_name(index.fcds.get(args.virtualDiskId)),
+                'vm': disk['vmName'] if disk else None,
+                'label': disk['label'] if disk else None}
+    return [{'vDiskId': d['vDiskId'], 'label': d['label'], 'datastore': index.datastore_name(d['datastore'])}
+            for d in index.vm_disks.get(args.vmname, [])]
+
+
+def build_report(si, args):
+    pool = sessionpool.SessionPool(args.host, args.user, args.password, args.port,
+                                   size=args.sessions, seed=si, on_connect=transport.tuner(args))
+    try:
+        index = inventory.FcdIndex.build(si, page_size=args.page_size, pool=pool)
+        return report(index, args, si, pool)
+    finally:
+        pool.close()
+
+
+def lookup_in_file(si, inventory_file, vdisk_id):
+    """
+    -op lookup of a vDiskId answered from the inventory file, None when the
+    file does not know the FCD, or vCenter no longer agrees with it.
+    """
+    entry = inventory_file.vdisk(vdisk_id)
+    if not entry:
+        return None
+    datastore = inventory_file.datastore(entry['datastore'])
+    result = {'vDiskId': vdisk_id, 'datastore': datastore[0] if datastore else None, 'vm': None, 'label': None}
+    if not entry['vm']:
+        # the FCD may have been attached since the file was written
+        try:
+            found = inventory.associations(si.content.vStorageObjectManager,
+                                           [(vdisk_id, vim.Datastore(entry['datastore'], si._stub))])
+        except vmodl.MethodFault:
+            return None
+        return result if found.get(vdisk_id) == [] else None
+    try:
+        props = pchelper.get_object_properties(si, vim.VirtualMachine(entry['vm'], si._stub),
+                                               ['name', 'config.hardware.device'])
+    except vmodl.fault.ManagedObjectNotFound:
+        return None
+    # the VM must still have the disk, otherwise the file is out of date
+    for dev in props.get('config.hardware.device') or []:
+        if isinstance(dev, vim.vm.device.VirtualDisk) and dev.vDiskId and dev.vDiskId.id == vdisk_id:
+            result.update(vm=props.get('name'), label=dev.deviceInfo.label)
+            return result
+    return None
+
+
+def main():
+    args = get_args()
+    if args.operation == 'lookup' and not (args.virtualDiskId or args.vmname):
+        print("Please provide vDisk Id or VM name")
+        return
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    result = None
+    if args.operation == 'lookup' and args.virtualDiskId:
+        inventory_file = invfile.use(args.inventory, args.host, args.inventory_max_age)
+        if inventory_file:
+            result = lookup_in_file(si, inventory_file, args.virtualDiskId)
+    if result is None:
+        result = build_report(si, args)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif isinstance(result, dict):
+        for key, val in result.items():
+            print("### %-12s : %s" % (key, val))
+    else:
+        print(colored("##%s entries" % len(result), "green"))
+        for entry in result:
+            print("### " + " | ".join("%s : %s" % (key, val) for key, val in entry.items()))
+
+
+if __name__ == "__main__":
+    main()
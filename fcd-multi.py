@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to view, create, delete and apply retention to FCD snapshots across several vCenters
+#at once, -s takes a comma separated list of vCenters. The output of all vCenters is merged into one
+#stream tagged with the source vCenter.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from tools import cli, concurrency, fanout, inventory, resilience, sessionpool, transport
+from pyVmomi import vim
+from termcolor import colored
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-op', '--operation', required=True,
+                        choices=['view', 'create', 'delete', 'retention'],
+                        help='The operation that you want to perform on every vCenter')
+    parser.add_argument('-vm', '--vmname',
+                        help='Regular expression of the VM names whose FCDs are worked on. '
+                             'Without it view covers all FCDs, the other operations need it or -all')
+    parser.add_argument('-all', action='store_true',
+                        help='Work on all FCDs, unattached ones included')
+    parser.add_argument('-description',
+                        help='Description of the snapshots to create or delete, '
+                             'for retention only snapshots starting with it are counted')
+    parser.add_argument('-keep', type=int,
+                        help='Number of newest snapshots retention keeps per FCD')
+    parser.add_argument('-workers', type=int, default=8,
+                        help='FCDs worked on in parallel per vCenter')
+    parser.add_argument('-sessions', type=int, default=4,
+                        help='Number of sessions per vCenter the FCDs are spread over')
+    parser.add_argument('-max-per-datastore', dest='max_per_datastore', type=int, default=4,
+                        help='Upper bound of snapshot tasks in flight on one datastore')
+    parser.add_argument('-timeout', type=int, default=0,
+                        help='Seconds after which vCenters still running are reported as timed out, 0 waits forever')
+    parser.add_argument('-json', action='store_true',
+                        help='Print one JSON record per line')
+    transport.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.operation != 'view' and not (args.vmname or args.all):
+        parser.error("%s needs -vm or -all" % args.operation)
+    if args.operation in ('create', 'delete') and not args.description:
+        parser.error("%s needs -description" % args.operation)
+    if args.operation == 'retention' and args.keep is None:
+        parser.error("retention needs -keep")
+    return cli.prompt_for_password(args)
+
+
+def select_fcds(index, args):
+    """ vDiskIds worked on: attached to a matching VM, or every FCD with -all or a bare view """
+
+    if args.all or (args.operation == 'view' and not args.vmname):
+        return sorted(index.fcds)
+    pattern = re.compile(args.vmname)
+    return sorted(vdisk_id for vdisk_id, disk in index.attachments.items() if pattern.search(disk['vmName'] or ''))
+
+
+def fcd_snapshots(content, index, vdisk_id):
+    """ Snapshots of the FCD, oldest first """
+
+    id_object = vim.vslm.ID()
+    id_object.id = vdisk_id
+    ds_obj = index.datastores[index.fcds[vdisk_id]]['obj']
+    snapshot = content.vStorageObjectManager.RetrieveSnapshotInfo(id_object, ds_obj)
+    return sorted(snapshot.snapshots or [], key=lambda sn: sn.createTime)
+
+
+def run_snapshot_task(si, index, controller, vdisk_id, method, *extra):
+    id_object = vim.vslm.ID()
+    id_object.id = vdisk_id
+    ds_obj = index.datastores[index.fcds[vdisk_id]]['obj']
+    with controller.slot(datastore=ds_obj._moId):
+        task = method(id_object, ds_obj, *extra)
+        resilience.wait_for_tasks(si, [task])
+    return task
+
+
+def build_work(args):
+    """ The function run against every vCenter """
+
+    def _work(host, si, emit):
+        pool = sessionpool.SessionPool(host, args.user, args.password, args.port,
+                                       size=args.sessions, seed=si, on_connect=transport.tuner(args))
+        index = inventory.FcdIndex.build(si, pool=pool)
+        controller = concurrency.ConcurrencyController(global_limit=args.workers,
+                                                       datastore_limit=args.max_per_datastore)
+
+        def _describe(vdisk_id):
+            disk = index.vm_of(vdisk_id) or {}
+            return {'vDiskId': vdisk_id, 'vm': disk.get('vmName'), 'label': disk.get('label'),
+                    'datastore': index.datastore_name(index.fcds[vdisk_id])}
+
+        def _one(vdisk_id):
+            with pool.checkout() as session:
+                _run(vdisk_id, session.si, session.content)
+
+        def _run(vdisk_id, si, content):
+            manager = content.vStorageObjectManager
+            record = _describe(vdisk_id)
+            try:
+                if args.operation == 'view':
+                    snapshots = fcd_snapshots(content, index, vdisk_id)
+                    record.update({'kind': 'fcd', 'snapshots': len(snapshots),
+                                   'latest': str(snapshots[-1].createTime) if snapshots else None})
+                    emit(record)
+
+                elif args.operation == 'create':
+                    task = run_snapshot_task(si, index, controller, vdisk_id,
+                                             manager.VStorageObjectCreateSnapshot_Task, args.description)
+                    record.update({'kind': 'created', 'snapshotId': task.info.result.id})
+                    emit(record)
+
+                else:
+                    snapshots = fcd_snapshots(content, index, vdisk_id)
+                    if args.operation == 'delete':
+                        doomed = [sn for sn in snapshots if sn.description == args.description]
+                    else:
+                        counted = [sn for sn in snapshots
+                                   if not args.description or (sn.description or '').startswith(args.description)]
+                        doomed = counted[:max(0, len(counted) - args.keep)]
+                    # oldest first, the chain of one FCD is changed one snapshot at a time
+                    for sn in doomed:
+                        run_snapshot_task(si, index, controller, vdisk_id, manager.DeleteSnapshot_Task, sn.id)
+                        deleted = dict(record)
+                        deleted.update({'kind': 'deleted', 'snapshotId': sn.id.id, 'createTime': str(sn.createTime)})
+                        emit(deleted)
+            except Exception as e:
+                record.update({'kind': 'failed', 'error': resilience.fault_message(e)})
+                emit(record)
+
+        try:
+            with ThreadPoolExecutor(max_workers=args.workers) as threads:
+                list(threads.map(_one, select_fcds(index, args)))
+        finally:
+            # the seed session is closed by fanout.disconnect_all
+            pool.close()
+
+    return _work
+
+
+def print_record(record, as_json):
+    if as_json:
+        print(json.dumps(record, default=str))
+        return
+    colors = {'failed': 'red', fanout.ERROR: 'red', fanout.TIMEOUT: 'red', fanout.DONE: 'green'}
+    details = " | ".join("%s : %s" % (key, val) for key, val in sorted(record.items())
+                         if key not in ('vcenter', 'kind'))
+    print(colored("[%s] %-8s %s" % (record['vcenter'], record['kind'], details), colors.get(record.get('kind'), None)))
+
+
+def main():
+    args = get_args()
+    hosts = [host.strip() for host in args.host.split(',') if host.strip()]
+
+    sessions, errors = fanout.connect_all(hosts, args.user, args.password, args.port,
+                                          timeout=args.timeout or 60, on_connect=transport.tuner(args))
+    for host, error in sorted(errors.items()):
+        print_record({'vcenter': host, 'kind': fanout.ERROR, 'error': 'could not connect : %s' % error}, args.json)
+
+    try:
+        for record in fanout.fan_out(sessions, build_work(args), timeout=args.timeout or None):
+            print_record(record, args.json)
+    finally:
+        fanout.disconnect_all(sessions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to run a plan of FCD operations (promote, snapshot, delete, revert, attach, detach)
+#with independent steps in parallel and conflicting steps on the same VM or FCD one after the other.
+#All steps are validated up front, steps that would fail and the steps depending on them are skipped.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import importlib
+import json
+import threading
+from tools import cli, concurrency, placement, plan, preflight, resilience, scheduler, sessionpool, transport
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+import attach_disk, detach_disk
+from termcolor import colored
+
+# the script names are not valid module names, so they are loaded by file name
+vdisk_sn_op = importlib.import_module('vdisk-sn-op')
+mk_fcd = importlib.import_module('mk-fcd')
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-plan', required=True,
+                        help='JSON or YAML file with the steps to run')
+    parser.add_argument('-retries', type=int, default=2,
+                        help='Number of retries for steps failing with a transient fault')
+    parser.add_argument('-max-global', dest='max_global', type=int, default=16,
+                        help='Upper bound of operations in flight against vCenter')
+    parser.add_argument('-max-per-datastore', dest='max_per_datastore', type=int, default=4,
+                        help='Upper bound of operations in flight on one datastore')
+    parser.add_argument('-max-per-host', dest='max_per_host', type=int, default=8,
+                        help='Upper bound of operations in flight on one host')
+    parser.add_argument('-latency-target', dest='latency_target', type=float, required=False,
+                        help='Task latency in seconds above which the limits shrink. '
+                             'Without it the limits shrink when tasks take twice the best latency seen')
+    parser.add_argument('-sessions', type=int, default=4,
+                        help='Number of vCenter sessions the steps are spread over')
+    parser.add_argument('-report', required=False,
+                        help='File the JSON result report is written to')
+    parser.add_argument('-check', action='store_true',
+                        help='Only run the preflight validation and print every problem found')
+    parser.add_argument('-no-preflight', dest='no_preflight', action='store_true',
+                        help='Run the steps without validating them first')
+    transport.add_arguments(parser)
+    placement.add_arguments(parser)
+
+    args = parser.parse_args()
+    return cli.prompt_for_password(args)
+
+
+class PlanExecutor(object):
+    """
+    Maps plan steps onto the operation functions of the FCD scripts. Every
+    step, and every lookup made for the scheduler, runs on a session of its
+    own from the pool.
+    """
+
+    def __init__(self, vc_name, pool, vm_records=None, checked=False):
+        """
+        :param vm_records: preflight.fetch_vms result of the VMs of the plan,
+                           the VMs and the FCDs of their disks are taken from
+                           it instead of being looked up step by step
+        :param checked: the steps passed preflight.check, snapshots are
+                        taken without checking space and count again
+        """
+        self.vc_name = vc_name
+        self.pool = pool
+        self.checked = checked
+        self._lock = threading.Lock()
+        self._vms = {}
+        # (VM name, disk number) -> vDiskId, read once before the plan runs
+        self._fcds = {}
+        for name, record in (vm_records or {}).items():
+            self._vms[name] = record['obj']
+            for label, dev in record['disks'].items():
+                if dev.vDiskId:
+                    self._fcds[(name, label[len('Hard disk '):])] = dev.vDiskId.id
+
+    def get_vm(self, name):
+        with self._lock:
+            vm_obj = self._vms.get(name)
+        if vm_obj is None:
+            # no lock held while waiting for a session, other steps hold sessions and look up VMs
+            with self.pool.checkout() as session:
+                vm_obj = vdisk_sn_op.get_obj(session.content, [vim.VirtualMachine], name)
+            with self._lock:
+                self._vms[name] = vm_obj
+        if not vm_obj:
+            raise RuntimeError("VM %s is not found" % name)
+        return vm_obj
+
+    def placement(self, step):
+        """
+        Returns the datastore and host a step puts load on, for the concurrency controller.
+        """
+        vm_obj = self.get_vm(step['vm'])
+        datastore = step.get('ds')
+        with self.pool.checkout() as session:
+            vm_obj = sessionpool.rebind(vm_obj, session.si)
+            if not datastore and step.get('disk'):
+                disk_label = 'Hard disk ' + str(step['disk'])
+                for dev in vm_obj.config.hardware.device:
+                    if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
+                        datastore = dev.backing.datastore.name
+            host = vm_obj.runtime.host
+            return {'datastore': datastore, 'host': host.name if host else None}
+
+    def resources(self, step):
+        """
+        plan.resource_keys of the step, plus the FCD of a step naming only a
+        disk number, so a detach by disk number and an attach of the same FCD
+        elsewhere never run at the same time. A plain lookup, the scheduler
+        calls it on every dispatch. A disk promoted by the plan itself has
+        no FCD yet when the disks are read, the VM key serializes its steps.
+        """
+        keys = plan.resource_keys(step)
+        if step.get('disk') and not step.get('vDiskId'):
+            vdisk_id = self._fcds.get((step['vm'], str(step['disk'])))
+            if vdisk_id:
+                keys.add('fcd:%s' % vdisk_id)
+        return keys
+
+    def __call__(self, step):
+        vm_obj = self.get_vm(step['vm'])
+        with self.pool.checkout() as session:
+            return self.run(step, session.si, session.content, sessionpool.rebind(vm_obj, session.si))
+
+    def run(self, step, si, content, vm_obj):
+        op = step['op']
+
+        if op == 'promote':
+            if not mk_fcd.mkfcd(self.vc_name, si, step['datacenter'],
+                                content, vm_obj, step['disk']):
+                raise RuntimeError("Hard disk %s of %s is not promoted to FCD" % (step['disk'], step['vm']))
+            return None
+
+        if op == 'snapshot':
+            return vdisk_sn_op.create_disk_snapshot(si, content, vm_obj, step['disk'], step['description'],
+                                                    checked=self.checked)
+
+        if op == 'delete':
+            vdisk_sn_op.delete_disk_snapshot(si, content, vm_obj, step['disk'], step['snid'])
+            return step['snid']
+
+        if op == 'revert':
+            vdisk_sn_op.revert_disk_snapshot(si, content, vm_obj, step['disk'], step['snid'])
+            return step['snid']
+
+        if op == 'attach':
+            attach_disk.Attach_vmdk(si, content, vm_obj, step['vDiskId'], step['ds'],
+                                    step['controllerKey'], step['unitNumber'])
+            return step['vDiskId']
+
+        if op == 'detach':
+            vdisk_id = detach_disk.find_disk(content, vm_obj, 'Hard disk ' + str(step['disk']))[0]
+            detach_disk.detach_vdisk(si, vm_obj, vdisk_id)
+            return vdisk_id
+
+        raise ValueError("Unknown operation %s" % op)
+
+
+def print_report(report):
+    colors = {scheduler.SUCCEEDED: 'green', scheduler.FAILED: 'red', scheduler.SKIPPED: 'yellow'}
+    print("\n<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Plan report >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n")
+    for record in report:
+        line = "### %-30s %-10s %-10s attempts : %s | duration : %ss" % (
+            record['id'], record['op'], record['status'], record['attempts'], record['duration'])
+        if record['error']:
+            line += " | error : %s" % record['error']
+        elif record['result']:
+            line += " | result : %s" % record['result']
+        print(colored(line, colors[record['status']]))
+
+
+def print_issues(steps, issues):
+    print("\n<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Preflight >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n")
+    for step in steps:
+        for problem in issues.get(step['id'], []):
+            print(colored("### %-30s %-10s %s" % (step['id'], step['op'], problem), "red"))
+    print(colored("\n##%d of %d steps can run" % (len(steps) - len(issues), len(steps)),
+                  "green" if not issues else "red"))
+
+
+def main():
+    args = get_args()
+    fcd_plan = plan.load_plan(args.plan)
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    placement.configure(si, args, args.host)
+
+    # one batched read of the VMs of the plan, for the preflight and the scheduler
+    vm_records = preflight.fetch_vms(si, set(step['vm'] for step in fcd_plan['steps'] if step.get('vm')))
+
+    blocked = {}
+    if not args.no_preflight:
+        issues = preflight.check(si, fcd_plan['steps'], placement.policy(args), records=vm_records)
+        if issues or args.check:
+            print_issues(fcd_plan['steps'], issues)
+        if args.check:
+            return
+        blocked = dict((step_id, "preflight : %s" % '; '.join(problems)) for step_id, problems in issues.items())
+
+    pool = sessionpool.SessionPool(args.host, args.user, args.password, args.port,
+                                   size=args.sessions, seed=si, on_connect=transport.tuner(args))
+    executor = PlanExecutor(args.host, pool, vm_records, checked=not args.no_preflight)
+    controller = concurrency.ConcurrencyController(global_limit=args.max_global,
+                                                   datastore_limit=args.max_per_datastore,
+                                                   host_limit=args.max_per_host,
+                                                   latency_target=args.latency_target)
+
+    try:
+        report = scheduler.run_steps(fcd_plan['steps'], executor,
+                                     max_workers=args.max_global, retries=args.retries,
+                                     controller=controller, placement=executor.placement, blocked=blocked,
+                                     resources=executor.resources)
+    finally:
+        pool.close()
+    print_report(report)
+    print("\n##Concurrency limits at the end of the run : %s" % ', '.join(controller.stats()))
+
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print("\n##The report is written to %s" % args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to create many new FCDs from one FCD snapshot, e.g. to build test environments from a
+#known good disk. The disks are spread over the datastores by the placement advisor, created
+#concurrently under a limit per datastore and optionally attached to a VM, all with one reconfigure.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import json
+import time
+from tools import cli, concurrency, diskchange, invfile, placement, provision, resilience, sessionpool, transport
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-vDiskId', '--virtualDiskId', required=True,
+                        help='vDiskId of the FCD whose snapshot is copied')
+    parser.add_argument('-ds', '--dataStore', required=True,
+                        help='Datastore which backs the FCD')
+    parser.add_argument('-snid', required=True,
+                        help='Snapshot id the new disks are created from')
+    parser.add_argument('-count', type=int, required=True,
+                        help='Number of disks to create')
+    parser.add_argument('-name', default='fcd-clone',
+                        help='Name prefix of the new disks, a running number is appended')
+    parser.add_argument('-targets',
+                        help='Comma separated datastores the disks are spread over, default all accessible ones')
+    parser.add_argument('-vm', '--vmname',
+                        help='VM every new disk is attached to')
+    parser.add_argument('-provisioning', choices=['thin', 'lazyZeroedThick', 'eagerZeroedThick'],
+                        help='Provisioning type of the disks cloned to other datastores, default that of the source FCD')
+    parser.add_argument('-workers', type=int, default=16,
+                        help='Disks created in parallel')
+    parser.add_argument('-sessions', type=int, default=4,
+                        help='Number of vCenter sessions the creations are spread over')
+    parser.add_argument('-max-per-datastore', dest='max_per_datastore', type=int, default=4,
+                        help='Upper bound of creations in flight on one datastore')
+    parser.add_argument('-json', action='store_true',
+                        help='Print one JSON record per disk')
+    transport.add_arguments(parser)
+    invfile.add_arguments(parser)
+    placement.add_arguments(parser)
+
+    args = parser.parse_args()
+    if args.count < 1:
+        parser.error("-count must be at least 1")
+    return cli.prompt_for_password(args)
+
+
+def attach_all(pool, vm_obj, results, datastores, workers):
+    """ Attaches the created disks to the VM with one reconfigure, sets 'attached' and 'attachError' of the records """
+
+    changes = [{'op': 'attach', 'vm': vm_obj, 'vDiskId': record['vDiskId'], 'record': record,
+                'datastore': datastores[record['datastore']]['obj']} for record in results if record['ok']]
+    diskchange.run(pool, changes, workers=workers)
+    for change in changes:
+        change['record']['attached'] = change['ok']
+        if not change['ok']:
+            change['record']['attachError'] = change['error']
+
+
+def main():
+    args = get_args()
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+    invfile.use(args.inventory, args.host, args.inventory_max_age)
+    content = si.RetrieveContent()
+
+    pool = sessionpool.SessionPool(args.host, args.user, args.password, args.port,
+                                   size=args.sessions, seed=si, on_connect=transport.tuner(args))
+    try:
+        advisor = placement.PlacementAdvisor.build(si, placement.policy(args), pool, args.placement_cache,
+                                                   args.placement_max_age, args.host)
+        datastores = advisor.datastores
+        by_name = dict((ds['name'], moid) for moid, ds in datastores.items())
+        if args.dataStore not in by_name:
+            print(colored("###Datastore %s is not found" % args.dataStore, "red"))
+            return
+        source_moid = by_name[args.dataStore]
+
+        targets = None
+        if args.targets:
+            names = [name.strip() for name in args.targets.split(',') if name.strip()]
+            missing = [name for name in names if name not in by_name]
+            if missing:
+                print(colored("###Datastores %s are not found" % ', '.join(missing), "red"))
+                return
+            targets = [by_name[name] for name in names]
+
+        vm_obj = None
+        if args.vmname:
+            vm_obj = invfile.get_obj(content, [vim.VirtualMachine], args.vmname)
+            if not vm_obj:
+                print(colored("###VM %s is not found" % args.vmname, "red"))
+                return
+
+        size, provisioning_type = provision.source_disk(content, args.virtualDiskId, datastores[source_moid]['obj'])
+        try:
+            placements = advisor.place(args.count, size, candidates=targets)
+        except placement.PlacementRejected as e:
+            print(colored("###%s" % e, "red"))
+            return
+        names = ['%s-%04d' % (args.name, number) for number in range(1, args.count + 1)]
+
+        controller = concurrency.ConcurrencyController(global_limit=args.workers,
+                                                       datastore_limit=args.max_per_datastore)
+        start = time.time()
+        results = provision.provision(pool, controller, datastores, args.virtualDiskId, source_moid, args.snid,
+                                      placements, names, workers=args.workers,
+                                      provisioning_type=args.provisioning or provisioning_type)
+        if vm_obj:
+            attach_all(pool, vm_obj, results, datastores, args.workers)
+    finally:
+        pool.close()
+
+    for record in results:
+        record['datastore'] = datastores[record['datastore']]['name']
+        if args.json:
+            print(json.dumps(record))
+        elif not record['ok'] or record.get('attached') is False:
+            print(colored("###%s on %s : %s" % (record['name'], record['datastore'],
+                                                record['error'] or record.get('attachError')), "red"))
+        else:
+            print(colored("###%s on %s : %s (%s)" % (record['name'], record['datastore'], record['vDiskId'],
+                                                     record['method']), "green"))
+    if not args.json:
+        created = len([r for r in results if r['ok']])
+        print(colored("\n##Created %d of %d disks in %.0fs" % (created, len(results), time.time() - start),
+                      "green" if created == len(results) else "red"))
+        for warning in sorted(set(r['warning'] for r in results if r.get('warning'))):
+            print(colored("##%s" % warning, "red"))
+        print("##Limits : %s" % ", ".join(controller.stats()))
+
+
+if __name__ == "__main__":
+    main()
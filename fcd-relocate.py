@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to move many FCDs to other datastores at once, e.g. to rebalance storage. Moves run
+#concurrently under limits per source and per destination datastore, progress and ETA come from the
+#task progress and an interrupted run picks up where it stopped when started again with its journal.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tools import cli, concurrency, inventory, placement, provision, relocate, resilience, sessionpool, transport
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-vDiskIds',
+                        help='Comma separated vDiskIds of the FCDs to move')
+    parser.add_argument('-from', dest='sources',
+                        help='Comma separated datastores all of whose FCDs are moved')
+    parser.add_argument('-vm', '--vmname',
+                        help='Regular expression of the VM names whose FCDs are moved')
+    parser.add_argument('-targets', required=True,
+                        help='Comma separated datastores the FCDs are moved to, spread by the placement advisor')
+    parser.add_argument('-journal', default='fcd-relocate.journal',
+                        help='File recording the moves, run again with the same file to resume')
+    parser.add_argument('-max-per-source', dest='max_per_source', type=int, default=2,
+                        help='Moves in flight reading from one datastore')
+    parser.add_argument('-max-per-target', dest='max_per_target', type=int, default=2,
+                        help='Moves in flight writing to one datastore')
+    parser.add_argument('-workers', type=int, default=8,
+                        help='Moves in flight in total')
+    parser.add_argument('-sessions', type=int, default=4,
+                        help='Number of vCenter sessions the moves are spread over')
+    parser.add_argument('-interval', type=int, default=15,
+                        help='Seconds between two progress lines')
+    parser.add_argument('-dry-run', dest='dry_run', action='store_true',
+                        help='Only print which FCD goes where')
+    parser.add_argument('-json', action='store_true',
+                        help='Print one JSON record per move')
+    transport.add_arguments(parser)
+    placement.add_arguments(parser)
+
+    args = parser.parse_args()
+    if not (args.vDiskIds or args.sources or args.vmname):
+        parser.error("tell which FCDs to move with -vDiskIds, -from or -vm")
+    return cli.prompt_for_password(args)
+
+
+def names_to_moids(index, names):
+    by_name = dict((ds['name'], moid) for moid, ds in index.datastores.items())
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise ValueError("Datastores %s are not found" % ', '.join(missing))
+    return [by_name[name] for name in names]
+
+
+def split(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def select_fcds(index, args):
+    """ vDiskIds to move, from all the selectors given """
+
+    selected = set(split(args.vDiskIds))
+    if args.sources:
+        sources = set(names_to_moids(index, split(args.sources)))
+        selected.update(vdisk_id for vdisk_id, moid in index.fcds.items() if moid in sources)
+    if args.vmname:
+        pattern = re.compile(args.vmname)
+        selected.update(vdisk_id for vdisk_id, disk in index.attachments.items()
+                        if pattern.search(disk['vmName'] or ''))
+    unknown = selected - set(index.fcds)
+    if unknown:
+        raise ValueError("FCDs %s are not found on any accessible datastore" % ', '.join(sorted(unknown)))
+    return sorted(selected)
+
+
+def build_moves(index, pool, vdisk_ids, journal, workers):
+    """ One move per FCD, finished moves of the journal left out and running ones kept on their target """
+
+    previous = journal.load()
+    moves = []
+    for vdisk_id in vdisk_ids:
+        last = previous.get(vdisk_id)
+        if last and last['state'] == 'done':
+            continue
+        if last and last['state'] == 'started' and index.fcds[vdisk_id] == last['target']:
+            # the interrupted run saw the start, vCenter finished it
+            journal.write(vDiskId=vdisk_id, state='done', task=last.get('task'), error=None,
+                          source=last['source'], target=last['target'])
+            continue
+        disk = index.vm_of(vdisk_id)
+        move = {'vDiskId': vdisk_id, 'source': index.fcds[vdisk_id],
+                'size': disk['capacity'] if disk else None,
+                'vm': disk['vm'] if disk else None, 'vmName': disk['vmName'] if disk else None,
+                'deviceKey': disk['key'] if disk else None}
+        if last and last['state'] == 'started':
+            move.update(source=last['source'], target=last['target'])
+        moves.append(move)
+
+    def _size(move):
+        with pool.checkout() as session:
+            ds_obj = sessionpool.rebind(index.datastores[move['source']]['obj'], session.si)
+            move['size'] = provision.capacity_bytes(session.content, move['vDiskId'], ds_obj)
+
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        list(threads.map(_size, [move for move in moves if move['size'] is None]))
+    return moves
+
+
+def describe(index, move):
+    record = {'vDiskId': move['vDiskId'], 'vm': move.get('vmName'), 'sizeMB': move['size'] // (1024 * 1024),
+              'from': index.datastore_name(move['source']), 'to': index.datastore_name(move['target'])}
+    if 'ok' in move:
+        record.update(ok=move['ok'], error=move['error'])
+    return record
+
+
+def print_progress(progress):
+    state = progress.snapshot()
+    eta = "%dm%02ds" % divmod(int(state['eta']), 60) if state['eta'] is not None else "unknown"
+    print(colored("##%d done, %d failed, %d running : %.1f of %.1f GB, %.0f MB/s, ETA %s" % (
+        state['done'], state['failed'], state['running'], state['moved'] / 2 ** 30, state['total'] / 2 ** 30,
+        state['rate'] / 2 ** 20, eta), "green"))
+
+
+def main():
+    args = get_args()
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    pool = sessionpool.SessionPool(args.host, args.user, args.password, args.port,
+                                   size=args.sessions, seed=si, on_connect=transport.tuner(args))
+    try:
+        index = inventory.FcdIndex.build(si, pool=pool)
+        journal = relocate.Journal(args.journal)
+        try:
+            targets = names_to_moids(index, split(args.targets))
+            moves = build_moves(index, pool, select_fcds(index, args), journal, args.workers)
+            moves = [move for move in moves if move['source'] not in targets or move.get('target')]
+            advisor = placement.PlacementAdvisor.from_index(index, placement.policy(args))
+            if args.placement_cache:
+                advisor.save(args.placement_cache, args.host)
+            relocate.assign_targets(moves, advisor, targets)
+        except ValueError as e:
+            print(colored("###%s" % e, "red"))
+            return
+
+        if args.dry_run or not moves:
+            for move in moves:
+                print(json.dumps(describe(index, move)) if args.json else
+                      "### %(vDiskId)s %(sizeMB)s MB : %(from)s -> %(to)s" % describe(index, move))
+            if not moves:
+                print(colored("##Nothing to move", "green"))
+            return
+
+        progress = relocate.Progress(sum(move['size'] for move in moves))
+        stop = threading.Event()
+
+        def _report():
+            while not stop.wait(args.interval):
+                with pool.checkout() as session:
+                    progress.poll(session.si)
+                if not args.json:
+                    print_progress(progress)
+
+        def _done(move):
+            record = describe(index, move)
+            if args.json:
+                print(json.dumps(record))
+            elif move['ok']:
+                print(colored("###Moved %(vDiskId)s %(sizeMB)s MB : %(from)s -> %(to)s" % record, "green"))
+            else:
+                print(colored("###Could not move %(vDiskId)s %(from)s -> %(to)s : %(error)s" % record, "red"))
+
+        reporter = threading.Thread(target=_report)
+        reporter.daemon = True
+        reporter.start()
+        controller = concurrency.ConcurrencyController(global_limit=args.workers,
+                                                       datastore_limit=args.max_per_target)
+        try:
+            relocate.run(pool, moves, index.datastores, journal, progress, args.max_per_source,
+                         args.max_per_target, args.workers, on_done=_done, controller=controller)
+        finally:
+            stop.set()
+        if not args.json:
+            print_progress(progress)
+            print("##Limits : %s" % ", ".join(controller.stats()))
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to load test the FCD operations at scale. It can start the govmomi simulator (vcsim)
+#with an inventory of the given size and fill it with FCDs, then runs a mix of create, view, delete,
+#revert and promote operations at a fixed concurrency for a given duration. At the end it reports the
+#throughput and p50/p95/p99 latency per operation, the memory growth of the process and the property
+#filters and container views the sessions leaked on the server.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import importlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tools import cli, inventory, resilience, sessionpool, soak, transport
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+vdisk_sn_op = importlib.import_module('vdisk-sn-op')
+mk_fcd = importlib.import_module('mk-fcd')
+
+DEFAULT_MIX = 'view=50,create=20,delete=15,revert=10,promote=5'
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-duration', type=int, default=300,
+                        help='Seconds the workload runs')
+    parser.add_argument('-concurrency', type=int, default=16,
+                        help='Operations in flight')
+    parser.add_argument('-sessions', type=int, default=8,
+                        help='Number of vCenter sessions the operations are spread over')
+    parser.add_argument('-mix', default=DEFAULT_MIX,
+                        help='Relative weights of the operations, default %s' % DEFAULT_MIX)
+    parser.add_argument('-fcds', type=int, default=0,
+                        help='FCDs to create before the run, spread over all datastores')
+    parser.add_argument('-attach-ratio', dest='attach_ratio', type=float, default=0.5,
+                        help='Share of the created FCDs attached to VMs')
+    parser.add_argument('-interval', type=int, default=30,
+                        help='Seconds between progress lines')
+    parser.add_argument('-seed', type=int, default=0,
+                        help='Seed of the operation and target choices')
+    parser.add_argument('-report',
+                        help='File the JSON report is written to')
+    parser.add_argument('-vcsim',
+                        help='Path of a vcsim binary to start on -o port of 127.0.0.1 instead of '
+                             'connecting to -s, e.g. -vcsim vcsim -u user -p pass')
+    parser.add_argument('-vcsim-dc', dest='vcsim_dc', type=int, default=1,
+                        help='vcsim datacenters')
+    parser.add_argument('-vcsim-cluster', dest='vcsim_cluster', type=int, default=10,
+                        help='vcsim clusters per datacenter')
+    parser.add_argument('-vcsim-host', dest='vcsim_host', type=int, default=20,
+                        help='vcsim hosts per cluster')
+    parser.add_argument('-vcsim-vm', dest='vcsim_vm', type=int, default=100,
+                        help='vcsim VMs per host, the defaults give 20000 VMs')
+    parser.add_argument('-vcsim-ds', dest='vcsim_ds', type=int, default=20,
+                        help='vcsim datastores')
+    transport.add_arguments(parser)
+
+    args = parser.parse_args()
+    try:
+        args.weights = dict((op, int(weight)) for op, weight in
+                            (item.split('=') for item in args.mix.split(',')))
+    except ValueError:
+        parser.error("-mix takes op=weight pairs like %s" % DEFAULT_MIX)
+    unknown = set(args.weights) - set(Workload.OPERATIONS)
+    if unknown:
+        parser.error("unknown operations in -mix: %s" % ', '.join(sorted(unknown)))
+    return cli.prompt_for_password(args)
+
+
+def datacenter_of(entity):
+    while entity is not None and not isinstance(entity, vim.Datacenter):
+        entity = entity.parent
+    return entity
+
+
+class Workload(object):
+    """
+    Shared state of the run: which FCDs exist, which are busy, the snapshots
+    the run created and the VM disks still to promote.
+    """
+
+    OPERATIONS = ('view', 'create', 'delete', 'revert', 'promote')
+
+    def __init__(self, vc_name, index):
+        self.vc_name = vc_name
+        self.index = index
+        self.fcds = sorted(index.fcds)
+        self.vm_names = sorted(index.vm_disks)
+        self.snapshots = {}
+        self.candidates = list(index.unpromoted)
+        self._busy = set()
+        self._lock = threading.Lock()
+        # notified whenever a target may have become free or new
+        self._changed = threading.Condition(self._lock)
+
+    def _claim(self, rand, choices):
+        """ Picks a target no other operation works on and marks it busy """
+
+        if not choices:
+            return None
+        with self._lock:
+            # few targets are busy at a time, sampling spares a scan of all FCDs
+            choice = next((c for c in (rand.choice(choices) for _ in range(16)) if c not in self._busy), None)
+            if choice is None:
+                free = [c for c in choices if c not in self._busy]
+                choice = rand.choice(free) if free else None
+            if choice is not None:
+                self._busy.add(choice)
+            return choice
+
+    def _release(self, vdisk_id):
+        with self._changed:
+            self._busy.discard(vdisk_id)
+            self._changed.notify_all()
+
+    def wait_for_target(self, timeout):
+        """ Blocks until another operation released or added a target, at most timeout seconds """
+
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def _ds(self, vdisk_id):
+        return self.index.datastores[self.index.fcds[vdisk_id]]['obj']
+
+    def _id(self, vdisk_id):
+        id_object = vim.vslm.ID()
+        id_object.id = vdisk_id
+        return id_object
+
+    def run(self, op, rand, session):
+        """
+        Runs one operation, returns False when it had no target.
+        """
+        if op == 'promote':
+            return self.promote(session)
+        if op == 'view':
+            return self.view(rand, session)
+
+        if op == 'create':
+            vdisk_id = self._claim(rand, self.fcds)
+        else:
+            with self._lock:
+                choices = [v for v, sns in self.snapshots.items()
+                           if sns and (op == 'delete' or self.index.vm_of(v) is None)]
+            vdisk_id = self._claim(rand, choices)
+        if vdisk_id is None:
+            return False
+        try:
+            getattr(self, op)(vdisk_id, session)
+        finally:
+            self._release(vdisk_id)
+        return True
+
+    def view(self, rand, session):
+        # the lookup by name every script starts with
+        if self.vm_names:
+            vdisk_sn_op.get_obj(session.content, [vim.VirtualMachine], rand.choice(self.vm_names))
+        if self.fcds:
+            vdisk_id = rand.choice(self.fcds)
+            session.content.vStorageObjectManager.RetrieveSnapshotInfo(self._id(vdisk_id), self._ds(vdisk_id))
+        return True
+
+    def create(self, vdisk_id, session):
+        task = session.content.vStorageObjectManager.VStorageObjectCreateSnapshot_Task(
+            self._id(vdisk_id), self._ds(vdisk_id), 'soak')
+        resilience.wait_for_tasks(session.si, [task])
+        with self._lock:
+            self.snapshots.setdefault(vdisk_id, []).append(task.info.result.id)
+
+    def delete(self, vdisk_id, session):
+        with self._lock:
+            snapshot_id = self.snapshots[vdisk_id].pop(0)
+        task = session.content.vStorageObjectManager.DeleteSnapshot_Task(
+            self._id(vdisk_id), self._ds(vdisk_id), vim.vslm.ID(id=snapshot_id))
+        resilience.wait_for_tasks(session.si, [task])
+
+    def revert(self, vdisk_id, session):
+        manager = session.content.vStorageObjectManager
+        with self._lock:
+            snapshot_id = self.snapshots[vdisk_id][-1]
+        task = manager.RevertVStorageObject_Task(self._id(vdisk_id), self._ds(vdisk_id),
+                                                 vim.vslm.ID(id=snapshot_id))
+        resilience.wait_for_tasks(session.si, [task])
+        # keep only the snapshots the revert left in the chain
+        left = set(sn.id.id for sn in manager.RetrieveSnapshotInfo(self._id(vdisk_id), self._ds(vdisk_id)).snapshots or [])
+        with self._lock:
+            self.snapshots[vdisk_id] = [sn for sn in self.snapshots[vdisk_id] if sn in left]
+
+    def promote(self, session):
+        with self._lock:
+            if not self.candidates:
+                return False
+            disk = self.candidates.pop()
+        ds_obj = vim.Datastore(disk['datastore'], session.si._stub)
+        path = mk_fcd.build_paramters(session.si, self.index.datastore_name(disk['datastore']), disk['vmName'],
+                                      disk['fileName'], self.vc_name, datacenter_of(ds_obj).name)
+        vdisk_id = session.content.vStorageObjectManager.RegisterDisk(path).config.id.id
+        with self._changed:
+            self.fcds.append(vdisk_id)
+            self.index.fcds[vdisk_id] = disk['datastore']
+            # still attached to its VM, so never a revert target
+            self.index.attachments[vdisk_id] = dict(disk, vDiskId=vdisk_id)
+            self._changed.notify_all()
+        return True
+
+
+def census(pool):
+    return dict((id(session), soak.leak_census(session.content)) for session in pool.sessions())
+
+
+def leaks(before, after):
+    found = {'filters': 0, 'views': 0}
+    for key, counts in after.items():
+        for kind in found:
+            found[kind] += counts[kind] - before.get(key, {}).get(kind, 0)
+    return found
+
+
+def print_report(report):
+    print(colored("\n%-10s %8s %7s %9s %9s %9s %9s %9s" % ('op', 'count', 'errors', 'ops/s',
+                                                         'p50 ms', 'p95 ms', 'p99 ms', 'max ms'), "green"))
+    for op, stats in report['operations'].items():
+        print("%-10s %8d %7d %9.2f %9.1f %9.1f %9.1f %9.1f" % (
+            op, stats['count'], stats['errors'], stats['throughput'], stats['p50'] * 1000,
+            stats['p95'] * 1000, stats['p99'] * 1000, stats['max'] * 1000))
+        if stats['lastError']:
+            print(colored("###last %s error : %s" % (op, stats['lastError']), "red"))
+
+    memory = report['memory']
+    print("\n##Memory : %.1f MB at start, %.1f MB at end, %.1f MB peak, %+.1f MB per hour" % (
+        memory['start'] / 1048576.0, memory['end'] / 1048576.0, memory['peak'] / 1048576.0,
+        memory['growthPerHour'] / 1048576.0))
+    leaked = report['leaked']
+    color = "red" if leaked['filters'] > 0 or leaked['views'] > 0 else "green"
+    print(colored("##Leaked on the server : %d property filters, %d views" % (leaked['filters'], leaked['views']),
+                  color))
+
+
+def main():
+    args = get_args()
+
+    if args.vcsim:
+        simulator = soak.start_vcsim(args.vcsim, args.port, args.vcsim_dc, args.vcsim_cluster,
+                                     args.vcsim_host, args.vcsim_vm, args.vcsim_ds)
+        atexit.register(simulator.terminate)
+        args.host = '127.0.0.1'
+        print("##Started vcsim with %d VMs" % (args.vcsim_dc * args.vcsim_cluster * args.vcsim_host * args.vcsim_vm))
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    pool = sessionpool.SessionPool(args.host, args.user, args.password, args.port,
+                                   size=args.sessions, seed=si, on_connect=transport.tuner(args))
+    atexit.register(pool.close)
+
+    if args.fcds:
+        datastores = inventory.collect_datastores(si)
+        ds_objs = [ds['obj'] for ds in datastores.values() if ds['accessible'] is not False]
+        started = time.time()
+        fcds = soak.populate_fcds(pool, ds_objs, args.fcds, workers=args.concurrency)
+        print("##Created %d FCDs in %.1fs" % (len(fcds), time.time() - started))
+        if args.attach_ratio > 0:
+            vms = [vim.VirtualMachine(moid, si._stub)
+                   for moid in sorted(set(disk['vm'] for disk in inventory.collect_vm_disks(si)))]
+            attached = soak.attach_fcds(pool, vms, fcds, dict((moid, ds['obj']) for moid, ds in datastores.items()),
+                                        args.attach_ratio, workers=args.concurrency)
+            print("##Attached %d FCDs" % len(attached))
+
+    started = time.time()
+    index = inventory.FcdIndex.build(si, pool=pool)
+    print("##Indexed %d datastores, %d VMs, %d FCDs in %.1fs" % (
+        len(index.datastores), len(index.vm_disks), len(index.fcds), time.time() - started))
+
+    workload = Workload(args.host, index)
+    stats = soak.OpStats()
+    memory = soak.MemoryTrend()
+    memory.sample()
+    before = census(pool)
+    deadline = time.time() + args.duration
+
+    def _worker(number):
+        rand = random.Random('%s-%s' % (args.seed, number))
+        while time.time() < deadline:
+            op = soak.weighted_choice(rand, args.weights)
+            began = time.time()
+            try:
+                with pool.checkout() as session:
+                    ran = workload.run(op, rand, session)
+            except Exception as e:
+                stats.record(op, time.time() - began, e)
+                continue
+            if ran:
+                stats.record(op, time.time() - began)
+            else:
+                # nothing to work on until another operation frees or adds a target
+                workload.wait_for_target(max(0, min(1.0, deadline - time.time())))
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as threads:
+        futures = [threads.submit(_worker, number) for number in range(args.concurrency)]
+        while time.time() < deadline:
+            time.sleep(max(0, min(args.interval, deadline - time.time())))
+            rss = memory.sample()
+            print("##%5ds  %8d ops  %7.1f ops/s  %6.1f MB  %s" % (
+                time.time() - stats.started, stats.total(), stats.total() / (time.time() - stats.started),
+                rss / 1048576.0, ', '.join('%s %s' % (k, v) for k, v in sorted(leaks(before, census(pool)).items()))))
+        for future in futures:
+            future.result()
+    memory.sample()
+
+    report = {'operations': stats.report(),
+              'memory': memory.summary(),
+              'leaked': leaks(before, census(pool)),
+              'inventory': {'datastores': len(index.datastores), 'vms': len(index.vm_disks),
+                            'fcds': len(workload.fcds)},
+              'concurrency': args.concurrency,
+              'duration': args.duration}
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to keep exported FCD snapshots in a local deduplicating store, keyed by the FCD
+#snapshot ids vCenter reports with RetrieveSnapshotInfo.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import argparse
+import getpass
+import importlib
+import sys
+from tools import chunkstore, resilience
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+vdisk_sn_op = importlib.import_module('vdisk-sn-op')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Process args for the FCD snapshot store')
+
+    parser.add_argument('-s', '--host',
+                        action='store',
+                        help='Remote host to connect to, needed for ingest and view')
+    parser.add_argument('-o', '--port',
+                        type=int,
+                        default=443,
+                        action='store',
+                        help='Port to connect on')
+    parser.add_argument('-u', '--user',
+                        action='store',
+                        help='User name to use when connecting to host')
+    parser.add_argument('-p', '--password',
+                        action='store',
+                        help='Password to use when connecting to host')
+
+    parser.add_argument('-op', '--operation', required=True,
+                        choices=['ingest', 'view', 'restore', 'remove', 'stats'],
+                        help='The operation that you want to perform')
+    parser.add_argument('-store', required=True,
+                        help='Directory of the snapshot store')
+    parser.add_argument('-vDiskId', '--virtualDiskId',
+                        help='vDiskId of FCD Disk')
+    parser.add_argument('-ds', '--dataStore',
+                        help='Datastore which backs the virtual storage object')
+    parser.add_argument('-snid',
+                        help='Snapshot id to ingest, restore or remove')
+    parser.add_argument('-image',
+                        help='Exported disk image to ingest, e.g. from fcd-transfer.py or fcd-export.py -op rebuild')
+    parser.add_argument('-output',
+                        help='File the restored image is written to, - for stdout')
+    parser.add_argument('-workers', type=int,
+                        help='Number of processes chunking and hashing, defaults to the number of cores')
+
+    args = parser.parse_args()
+
+    needed = {'ingest': ('host', 'user', 'virtualDiskId', 'dataStore', 'snid', 'image'),
+              'view': ('host', 'user', 'virtualDiskId', 'dataStore'),
+              'restore': ('virtualDiskId', 'snid', 'output'),
+              'remove': ('virtualDiskId', 'snid'),
+              'stats': ()}[args.operation]
+    missing = [name for name in needed if not getattr(args, name)]
+    if missing:
+        parser.error("%s needs %s" % (args.operation, ', '.join(missing)))
+
+    if args.host and not args.password:
+        args.password = getpass.getpass(
+            prompt='Enter password for host %s and user %s: ' %
+                   (args.host, args.user))
+    return args
+
+
+def fcd_snapshots(content, vdisk_id, ds):
+    """ The FCD snapshots as listed by RetrieveSnapshotInfo, keyed by snapshot id """
+
+    ds_obj = vdisk_sn_op.get_obj(content, [vim.Datastore], ds)
+    vDiskId_object = vim.vslm.ID()
+    vDiskId_object.id = vdisk_id
+
+    snapshot = content.vStorageObjectManager.RetrieveSnapshotInfo(vDiskId_object, ds_obj)
+    return dict((sn.id.id, sn) for sn in snapshot.snapshots)
+
+
+def ingest_snapshot(content, store, vdisk_id, ds, snid, image, workers):
+
+    snapshots = fcd_snapshots(content, vdisk_id, ds)
+    if snid not in snapshots:
+        raise RuntimeError("FCD %s has no snapshot %s" % (vdisk_id, snid))
+
+    sn = snapshots[snid]
+    meta = {'datastore': ds, 'description': sn.description, 'createTime': str(sn.createTime)}
+    manifest = chunkstore.ingest(store, image, vdisk_id, snid, meta, workers)
+    print(colored("##Stored snapshot %s of FCD %s : %s bytes in %s chunks, %s bytes new", "green") % (
+        snid, vdisk_id, manifest['size'], len(manifest['chunks']), manifest['stored']))
+
+
+def view_store(content, store, vdisk_id, ds):
+
+    stored = set(chunkstore.list_snapshots(store, vdisk_id))
+    snapshots = fcd_snapshots(content, vdisk_id, ds)
+
+    print("\n##The snapshots of FCD disk with id %s are :" % vdisk_id)
+    count = 1
+    for snid, sn in snapshots.items():
+        state = "stored" if snid in stored else "not stored"
+        print(colored("\t\t#%s -> description : %s, creation Time : %s , snapshot identifier : %s , %s ",
+                      "green" if snid in stored else "yellow") % (count, sn.description, sn.createTime, snid, state))
+        count = count + 1
+    for snid in sorted(stored - set(snapshots)):
+        print(colored("\t\t#  -> snapshot identifier : %s is only in the store, it was deleted in vCenter", "yellow") % snid)
+
+
+def main():
+    args = get_args()
+
+    try:
+        if args.operation == 'restore':
+            if args.output == '-':
+                out = getattr(sys.stdout, 'buffer', sys.stdout)
+                chunkstore.restore(args.store, args.virtualDiskId, args.snid, out)
+            else:
+                with open(args.output, 'wb') as out:
+                    written = chunkstore.restore(args.store, args.virtualDiskId, args.snid, out)
+                print(colored("##Restored %s bytes to %s" % (written, args.output), "green"))
+            return
+
+        if args.operation == 'remove':
+            deleted = chunkstore.remove_snapshot(args.store, args.virtualDiskId, args.snid)
+            print(colored("##Removed snapshot %s, %s chunks freed" % (args.snid, deleted), "green"))
+            return
+
+        if args.operation == 'stats':
+            stats = chunkstore.stats(args.store)
+            print("##Logical %(logical)s bytes, stored %(stored)s bytes in %(chunks)s chunks" % stats)
+            return
+
+        si = SmartConnectNoSSL(host=args.host,
+                               user=args.user,
+                               pwd=args.password,
+                               port=int(args.port))
+        atexit.register(Disconnect, si)
+        resilience.install(si, args.user, args.password)
+
+        content = si.RetrieveContent()
+
+        if args.operation == 'ingest':
+            ingest_snapshot(content, args.store, args.virtualDiskId, args.dataStore, args.snid,
+                            args.image, args.workers)
+        else:
+            view_store(content, args.store, args.virtualDiskId, args.dataStore)
+
+    except Exception as e:
+        print(colored("##Exception in the snapshot store : %s ", "red") % (resilience.fault_message(e)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to export the backing files of an FCD over the datastore HTTP endpoint with parallel
+#ranged downloads, and to import them back as a new FCD.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import importlib
+import os
+from tools import cli, dstransfer, resilience
+from pyVmomi import vim
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+vdisk_sn_op = importlib.import_module('vdisk-sn-op')
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-op', '--operation', required=True,
+                        choices=['export', 'import'],
+                        help='Download the files of an FCD or upload and register them as a new FCD')
+    parser.add_argument('-dcname', '--datacenter', required=True,
+                        help='DataCenter Name')
+    parser.add_argument('-ds', '--dataStore', required=True,
+                        help='Datastore which backs (export) or will back (import) the virtual storage object')
+    parser.add_argument('-vDiskId', '--virtualDiskId',
+                        help='vDiskId of the FCD to export')
+    parser.add_argument('-dir', '--directory', required=True,
+                        help='Local directory the files are written to (export) or read from (import)')
+    parser.add_argument('-vmdk',
+                        help='Descriptor file in the local directory to import')
+    parser.add_argument('-folder', default='fcd-import',
+                        help='Datastore folder the imported files are uploaded to')
+    parser.add_argument('-name',
+                        help='Name of the imported FCD, defaults to the descriptor name')
+    parser.add_argument('-workers', type=int, default=8,
+                        help='Number of parallel connections')
+    parser.add_argument('-chunk-mb', dest='chunk_mb', type=int, default=64,
+                        help='Size of the ranged requests in MB')
+
+    args = parser.parse_args()
+    if args.operation == 'export' and not args.virtualDiskId:
+        parser.error("export needs vDiskId")
+    if args.operation == 'import' and not args.vmdk:
+        parser.error("import needs vmdk")
+    return cli.prompt_for_password(args)
+
+
+def backing_files(descriptor_path):
+    """
+    A flat FCD is a descriptor plus a -flat extent holding the data.
+    """
+    base, ext = os.path.splitext(descriptor_path)
+    return [descriptor_path, base + '-flat' + ext]
+
+
+def export_fcd(si, content, host, dc_name, ds, vdisk_id, directory, workers, chunk_size):
+
+    ds_obj = vdisk_sn_op.get_obj(content, [vim.Datastore], ds)
+    id_object = vim.vslm.ID()
+    id_object.id = vdisk_id
+    vstorage = content.vStorageObjectManager.RetrieveVStorageObject(id_object, ds_obj)
+
+    ds_name, descriptor = dstransfer.split_datastore_path(vstorage.config.backing.filePath)
+    session = dstransfer.build_session(si, pool_size=workers)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for path in backing_files(descriptor):
+        target = os.path.join(directory, os.path.basename(path))
+        url = dstransfer.datastore_url(host, dc_name, ds_name, path)
+        print("##Downloading %s to %s" % (path, target))
+        sha256 = dstransfer.download(session, url, target, chunk_size=chunk_size, workers=workers)
+        with open(target + '.sha256', 'w') as digest_file:
+            digest_file.write(sha256 + '\n')
+        print(colored("##Downloaded %s, sha256 %s" % (target, sha256), "green"))
+
+
+def import_fcd(si, content, host, dc_name, ds, directory, vmdk, folder, name, workers):
+
+    dc_obj = vdisk_sn_op.get_obj(content, [vim.Datacenter], dc_name)
+    jobs = []
+    for path in backing_files(vmdk):
+        source = os.path.join(directory, path)
+        jobs.append((source, dstransfer.datastore_url(host, dc_name, ds, folder + '/' + path)))
+
+    # a corrupt export is refused before anything is written to the datastore
+    expected = {}
+    for source, _ in jobs:
+        expected_file = source + '.sha256'
+        if os.path.exists(expected_file):
+            with open(expected_file) as digest_file:
+                expected[source] = digest_file.read().strip()
+            if dstransfer.file_sha256(source) != expected[source]:
+                raise IOError("%s does not match its exported checksum" % source)
+
+    content.fileManager.MakeDirectory("[%s] %s" % (ds, folder), dc_obj, True)
+    session = dstransfer.build_session(si, pool_size=workers)
+    print("##Uploading %s" % ', '.join(source for source, _ in jobs))
+    digests = dstransfer.upload_files(session, jobs, workers=workers)
+    changed = [source for (source, _), sha256 in zip(jobs, digests) if expected.get(source, sha256) != sha256]
+    if changed:
+        # the files changed while they were read, the uploaded copies are not registered
+        for path in backing_files(vmdk):
+            task = content.fileManager.DeleteDatastoreFile_Task("[%s] %s/%s" % (ds, folder, path), dc_obj)
+            resilience.wait_for_tasks(si, [task])
+        raise IOError("%s changed during the upload, the uploaded files are removed" % ', '.join(changed))
+
+    vstorage = content.vStorageObjectManager.RegisterDisk(jobs[0][1], name or os.path.splitext(vmdk)[0])
+    print(colored("##Imported as FCD %s" % vstorage.config.id.id, "green"))
+
+
+def main():
+    args = get_args()
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+
+    content = si.RetrieveContent()
+
+    try:
+        if args.operation == 'export':
+            export_fcd(si, content, args.host, args.datacenter, args.dataStore, args.virtualDiskId,
+                       args.directory, args.workers, args.chunk_mb * 1024 * 1024)
+        else:
+            import_fcd(si, content, args.host, args.datacenter, args.dataStore, args.directory,
+                       args.vmdk, args.folder, args.name, args.workers)
+    except Exception as e:
+        print(colored("##Exception in the transfer : %s ", "red") % (resilience.fault_message(e)))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,11 @@
 
 from __future__ import print_function
 
-import atexit
 import argparse
 import getpass
-from tools import cli, tasks
+from tools import audit, cli, dstransfer, invfile, placement, resilience, soapreplay
 from pyVmomi import vim
-from pyVim.connect import SmartConnectNoSSL, Disconnect
+from pyVim.connect import SmartConnectNoSSL
 from termcolor import colored
 
 
@@ -51,6 +50,11 @@ def get_args():
     parser.add_argument('-d', '--diskNumber', required=True,
                         help='Disk number to promote to FCD. Can be comma separated values like -d 1,2,3')
 
+    soapreplay.add_arguments(parser)
+    invfile.add_arguments(parser)
+    audit.add_arguments(parser)
+    placement.add_arguments(parser)
+
     args = parser.parse_args()
 
     if not args.password:
@@ -61,15 +65,7 @@ def get_args():
 
 
 def get_obj(content, vim_type, name):
-    obj = None
-
-    container = content.viewManager.CreateContainerView(content.rootFolder, vim_type, True)
-
-    for c in container.view:
-        if c.name == name:
-            obj = c
-            break
-    return obj
+    return invfile.get_obj(content, vim_type, name)
 
 
 def build_paramters(si, ds, vm, vmdk_file, vc_name, dc_name):
@@ -77,7 +73,7 @@ def build_paramters(si, ds, vm, vmdk_file, vc_name, dc_name):
 
     l = vmdk_file.split("/")
 
-    path_parameter = "https://" + vc_name + "/folder/" + vm + "/" + l[len(l) - 1] + "?dcPath=" + dc_name + "&dsName=" + ds
+    path_parameter = dstransfer.datastore_url(vc_name, dc_name, ds, vm + "/" + l[len(l) - 1])
     # print("###Path Parameter : %s" % path_parameter)
 
     return path_parameter
@@ -103,17 +99,13 @@ def mkfcd(vc_name, si, dc_name, content, vm_obj, disk_number, disk_prefix_label=
     # checkigng the disk details
     if hasattr(virtual_disk_device.backing, 'fileName'):
         datastore = virtual_disk_device.backing.datastore
-        if datastore:
-            summary = {'capacity': datastore.summary.capacity,
-                       'freeSpace': datastore.summary.freeSpace,
-                       'file system': datastore.summary.type,
-                       'url': datastore.summary.url}
-            for key, val in summary.items():
-                # print(u"            {0}: {1}".format(key, val))
-                if key == 'url':
-                    path_to_disk = val
-
-        path_to_disk += virtual_disk_device.backing.fileName
+
+        # one more FCD on the datastore, refused when it is past the placement thresholds
+        try:
+            placement.check(si, datastore, new_fcd=True)
+        except placement.PlacementRejected as e:
+            print(colored("##Not promoting %s : %s" % (disk_label, e), "red"))
+            return False
 
         # print("###DC name in mkfcd fun is %s " % dc_name)
         parameter_for_fcd_disk = build_paramters(si, datastore.name, vm_obj.name, virtual_disk_device.backing.fileName, vc_name, dc_name)
@@ -123,6 +115,8 @@ def mkfcd(vc_name, si, dc_name, content, vm_obj, disk_number, disk_prefix_label=
         vstorage = content.vStorageObjectManager.RegisterDisk(parameter_for_fcd_disk)
 
         print("##The id is %s" % (vstorage.config.id.id))
+        audit.log('registerDisk', vDiskId=vstorage.config.id.id, datastore=datastore.name, vm=vm_obj,
+                  label=disk_label)
 
         # print("##The data store MOID is %s" % vstorage.config.backing.datastore)
 
@@ -133,7 +127,7 @@ def mkfcd(vc_name, si, dc_name, content, vm_obj, disk_number, disk_prefix_label=
         spec = vim.vm.ConfigSpec()
         spec.annotation = previous_annotation + "Disk"+str(disk_number) + ":" + str(vstorage.config.id.id) + "\n"
         task = vm_obj.ReconfigVM_Task(spec)
-        tasks.wait_for_tasks(si, [task])
+        resilience.wait_for_tasks(si, [task])
         print("##Added the id annotation to VM")
 
     return True
@@ -141,11 +135,14 @@ def mkfcd(vc_name, si, dc_name, content, vm_obj, disk_number, disk_prefix_label=
 
 def main():
     args = get_args()
-    si = SmartConnectNoSSL(host=args.host,
-                           user=args.user,
-                           pwd=args.password,
-                           port=int(args.port))
-    atexit.register(Disconnect, si)
+    si = soapreplay.connect(args, lambda: SmartConnectNoSSL(host=args.host,
+                                                            user=args.user,
+                                                            pwd=args.password,
+                                                            port=int(args.port)))
+    resilience.install(si, args.user, args.password)
+    invfile.use(args.inventory, args.host, args.inventory_max_age)
+    audit.use(args.audit, args.host)
+    placement.configure(si, args, args.host)
 
     content = si.RetrieveContent()
     print("###Searching for VM %s" % args.vmname)
@@ -164,7 +161,7 @@ def main():
                 else:
                     print(colored("###vDisk %s is not promoted to FCD", "red") % n)
             except Exception as e:
-                print(colored("###Exception in making disk as FCD %s ", "red") % e.msg)
+                print(colored("###Exception in making disk as FCD %s ", "red") % resilience.fault_message(e))
             print()
     else:
         print("###VM {} is not found".format(args.vmname))
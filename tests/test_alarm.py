@@ -0,0 +1,134 @@
+from datetime import datetime
+
+import pytest
+from pyVmomi import vim, vmodl
+
+from tools import alarm
+
+ObjectUpdate = vmodl.query.PropertyCollector.ObjectUpdate
+Change = vmodl.query.PropertyCollector.Change
+
+HOST = vim.HostSystem('host-21')
+
+
+def _state(alarm_moref, status='red', acknowledged=False):
+    return vim.alarm.AlarmState(key='%s.host-21' % alarm_moref, entity=HOST, alarm=vim.alarm.Alarm(alarm_moref),
+                                overallStatus=status, time=datetime(2026, 10, 19, 10, 0),
+                                acknowledged=acknowledged)
+
+
+def _states(*states):
+    return vim.alarm.AlarmState.Array(list(states))
+
+
+def _update(kind, *changes):
+    return ObjectUpdate(kind=kind, obj=HOST, changeSet=[Change(name=name, op=op, val=val) for name, op, val in changes])
+
+
+def _summary(changes):
+    return [(change, record['alarm'], record['status']) for change, record in changes]
+
+
+def test_whole_array():
+    states = alarm._TriggeredStates()
+    changes = states.apply(_update('enter', ('name', 'assign', 'esx1'),
+                                   ('triggeredAlarmState', 'assign', _states(_state('alarm-7'), _state('alarm-8')))))
+    assert sorted(_summary(changes)) == [('triggered', 'alarm-7', 'red'), ('triggered', 'alarm-8', 'red')]
+    assert changes[0][1]['entityName'] == 'esx1'
+
+    changes = states.apply(_update('modify', ('triggeredAlarmState', 'assign', _states(_state('alarm-7', 'yellow')))))
+    assert sorted(_summary(changes)) == [('changed', 'alarm-7', 'yellow'), ('cleared', 'alarm-8', 'red')]
+
+    assert _summary(states.apply(_update('modify', ('triggeredAlarmState', 'assign', _states())))) == [
+        ('cleared', 'alarm-7', 'yellow')]
+    assert states.current == {}
+
+
+def test_array_elements():
+    states = alarm._TriggeredStates()
+    states.apply(_update('enter', ('name', 'assign', 'esx1'), ('triggeredAlarmState', 'assign', _states(_state('alarm-7')))))
+
+    added = states.apply(_update('modify', ('triggeredAlarmState["alarm-8.host-21"]', 'add', _state('alarm-8'))))
+    assert _summary(added) == [('triggered', 'alarm-8', 'red')]
+
+    acknowledged = states.apply(_update('modify', ('triggeredAlarmState["alarm-7.host-21"]', 'assign',
+                                                   _state('alarm-7', acknowledged=True))))
+    assert _summary(acknowledged) == [('changed', 'alarm-7', 'red')]
+    assert acknowledged[0][1]['acknowledged'] is True
+
+    removed = states.apply(_update('modify', ('triggeredAlarmState["alarm-7.host-21"]', 'remove', None)))
+    assert _summary(removed) == [('cleared', 'alarm-7', 'red')]
+    assert list(states.current['host-21']) == ['alarm-8.host-21']
+
+
+def test_name_only_and_leave():
+    states = alarm._TriggeredStates()
+    states.apply(_update('enter', ('triggeredAlarmState', 'assign', _states(_state('alarm-7')))))
+    assert states.apply(_update('modify', ('name', 'assign', 'esx1-renamed'))) == []
+    assert _summary(states.apply(_update('leave'))) == [('cleared', 'alarm-7', 'red')]
+
+
+class _Stub(object):
+    host = 'vc.example.com'
+    cookie = 'vmware_soap_session="52a1b2c3"'
+
+
+class _Response(object):
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+
+
+def test_build_payload():
+    payload = alarm._build_payload(entity_moref='host-<21>', entity_type='HostSystem',
+                                   alarm_moref='alarm-7&8', status='yellow')
+    assert '<entity xsi:type="ManagedObjectReference" type="HostSystem">host-&lt;21&gt;</entity>' in payload
+    assert '<alarm type="Alarm">alarm-7&amp;8</alarm>' in payload
+    assert '<status>yellow</status>' in payload
+    assert 'green' in alarm._build_payload(entity_moref='host-21', entity_type='HostSystem', alarm_moref='alarm-7')
+    with pytest.raises(ValueError):
+        alarm._build_payload(entity_moref='host-21', entity_type='HostSystem')
+
+
+def test_reset_alarms_errors(monkeypatch):
+    def _post_soap(stub, payload, timeout=None):
+        if 'alarm-1<' in payload:
+            return _Response(200)
+        if 'alarm-2<' in payload:
+            return _Response(500, '<soapenv:Fault><faultstring>The object has already been deleted</faultstring>'
+                                  '</soapenv:Fault>')
+        if 'alarm-3<' in payload:
+            return _Response(503)
+        raise IOError('connection reset')
+
+    stub = _Stub()
+    monkeypatch.setattr(alarm.transport, 'soap_stub', lambda si: stub)
+    monkeypatch.setattr(alarm.transport, 'post_soap', _post_soap)
+    try:
+        results = alarm.reset_alarms(object(), [(HOST, 'alarm-%d' % n) for n in range(1, 5)] +
+                                     [('datastore-9', 'alarm-5')], workers=3)
+    finally:
+        alarm.transport.close_soap_session(stub)
+
+    assert [(r['alarm_moref'], r['ok'], r['error']) for r in results] == [
+        ('alarm-1', True, None),
+        ('alarm-2', False, 'The object has already been deleted'),
+        ('alarm-3', False, 'HTTP Status: 503'),
+        ('alarm-4', False, 'connection reset'),
+        ('alarm-5', False, 'entity_moref, entity_type, and alarm_moref must be set'),
+    ]
+    assert results[0]['entity_type'] == 'HostSystem'
+
+
+def test_session_pool_only_grows():
+    stub = _Stub()
+    try:
+        session = alarm.transport.soap_session(stub, pool_size=2)
+        adapter = session.get_adapter('https://vc.example.com/sdk')
+        assert alarm.transport.soap_session(stub, pool_size=16) is session
+        grown = session.get_adapter('https://vc.example.com/sdk')
+        assert grown is not adapter and grown._pool_maxsize == 16
+        alarm.transport.soap_session(stub, pool_size=4)
+        assert session.get_adapter('https://vc.example.com/sdk') is grown
+    finally:
+        alarm.transport.close_soap_session(stub)
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from tools import audit
+
+RECORDS = [
+    {'source': 'task', 'task': 'task-1', 'operation': 'vim.VStorageObjectManager.createSnapshot',
+     'vm': None, 'time': '2026-03-01T10:00:00Z'},
+    {'source': 'log', 'task': 'task-1', 'operation': 'createSnapshot', 'vDiskId': 'fcd-1',
+     'time': '2026-03-01T10:00:01Z'},
+    {'source': 'task', 'task': 'task-2', 'operation': 'VirtualMachine.attachDisk', 'vDiskId': 'fcd-2',
+     'vm': 'web01', 'vmMoId': 'vm-12', 'time': '2026-03-02T09:00:00Z'},
+    {'source': 'log', 'operation': 'promote', 'vDiskId': 'fcd-1', 'vm': 'db01', 'vmMoId': 'vm-7',
+     'time': '2026-02-28T08:00:00.123456Z'},
+]
+
+
+def _store(tmp_path):
+    root = str(tmp_path)
+    audit.append(root, RECORDS[:2], checkpoint={'host': 'vc1', 'tasks': '2026-03-01T10:00:00Z'})
+    audit.append(root, RECORDS[2:])
+    return root
+
+
+def test_query_all_oldest_first(tmp_path):
+    root = _store(tmp_path)
+    assert [r['operation'] for r in audit.query(root)] == [
+        'promote', 'vim.VStorageObjectManager.createSnapshot', 'createSnapshot', 'VirtualMachine.attachDisk']
+    assert audit.load_checkpoint(root, 'vc1') == {'host': 'vc1', 'tasks': '2026-03-01T10:00:00Z'}
+
+
+def test_query_by_vdisk_follows_task(tmp_path):
+    root = _store(tmp_path)
+    # the harvested task has no vDiskId, the logged record of the same task has
+    found = audit.query(root, vdisk_id='fcd-1')
+    assert [(r['source'], r['operation']) for r in found] == [
+        ('log', 'promote'), ('task', 'vim.VStorageObjectManager.createSnapshot'), ('log', 'createSnapshot')]
+
+
+def test_query_by_vm_name_or_moid(tmp_path):
+    root = _store(tmp_path)
+    assert [r['vDiskId'] for r in audit.query(root, vm='web01')] == ['fcd-2']
+    assert [r['vDiskId'] for r in audit.query(root, vm='vm-7')] == ['fcd-1']
+
+
+def test_query_since_and_operation(tmp_path):
+    root = _store(tmp_path)
+    since = datetime(2026, 3, 1, 10, 0, 1)
+    assert [r['operation'] for r in audit.query(root, since=since)] == ['createSnapshot', 'VirtualMachine.attachDisk']
+    assert [r['task'] for r in audit.query(root, operation='snapshot')] == ['task-1', 'task-1']
+    assert audit.query(root, operation='attach', vdisk_id='fcd-1') == []
+
+
+def test_query_skips_partial_line(tmp_path):
+    root = _store(tmp_path)
+    with open(audit.store_path(root), 'a') as store:
+        store.write('{"operation": "cut')
+    assert len(audit.query(root)) == len(RECORDS)
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from tools import cbt
+
+MB = 1024 * 1024
+
+
+class _Obj(object):
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class _Manager(object):
+    """ QueryChangedDiskAreas answering from {start offset: (page length, [(start, length)])} """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.offsets = []
+
+    def QueryChangedDiskAreas(self, vdisk_id, ds_obj, snapshot_id, offset, change_id):
+        self.offsets.append(offset)
+        length, areas = self.pages[offset]
+        return _Obj(startOffset=offset, length=length,
+                    changedArea=[_Obj(start=start, length=size) for start, size in areas] or None)
+
+
+def _query(pages, capacity):
+    manager = _Manager(pages)
+    areas = cbt.query_changed_areas(_Obj(vStorageObjectManager=manager), 'fcd-1', None, 'sn-2', '52 aa/5', capacity)
+    return areas, manager.offsets
+
+
+def test_changed_areas_over_pages():
+    pages = {
+        0: (4 * MB, [(0, MB), (MB, MB), (3 * MB, MB)]),
+        # adjacent to the last area of the previous page
+        4 * MB: (4 * MB, [(4 * MB, MB), (6 * MB, 512)]),
+        8 * MB: (2 * MB, [(9 * MB, 4096)]),
+    }
+    areas, offsets = _query(pages, 10 * MB)
+    assert offsets == [0, 4 * MB, 8 * MB]
+    assert areas == [(0, 2 * MB), (3 * MB, 2 * MB), (6 * MB, 512), (9 * MB, 4096)]
+
+
+def test_no_changes():
+    areas, offsets = _query({0: (10 * MB, [])}, 10 * MB)
+    assert (areas, offsets) == ([], [0])
+
+
+def test_empty_page_stops():
+    areas, offsets = _query({0: (4 * MB, [(0, 4096)]), 4 * MB: (0, [])}, 10 * MB)
+    assert (areas, offsets) == ([(0, 4096)], [0, 4 * MB])
+
+
+def test_file_extent_reader(tmp_path):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(bytes(bytearray(range(256))) * 16)
+    reader = cbt.FileExtentReader(str(image))
+    try:
+        assert reader.read(256 + 10, 4) == bytes(bytearray([10, 11, 12, 13]))
+        with pytest.raises(IOError):
+            reader.read(4000, 200)
+    finally:
+        reader.close()
+
+
+def test_export_and_rebuild_chain(tmp_path, monkeypatch):
+    monkeypatch.setattr(cbt, 'READ_SIZE', 1000)
+    capacity = 64 * 1024
+    base = os.urandom(capacity)
+    changed = bytearray(base)
+    changed[5000:9000] = os.urandom(4000)
+
+    base_image, changed_image = tmp_path / 'base.img', tmp_path / 'changed.img'
+    base_image.write_bytes(base)
+    changed_image.write_bytes(bytes(changed))
+    target = str(tmp_path / 'exports')
+    meta = {'vDiskId': 'fcd-1', 'capacity': capacity}
+
+    reader = cbt.FileExtentReader(str(base_image))
+    full = cbt.export_extents(reader, [(0, capacity)], target, 'full', meta)
+    reader.close()
+    reader = cbt.FileExtentReader(str(changed_image))
+    incremental = cbt.export_extents(reader, [(5000, 4000)], target, 'incr', meta,
+                                     parent=os.path.basename(full))
+    reader.close()
+
+    assert cbt.manifest_chain(incremental) == [full, incremental]
+    assert cbt.load_manifest(incremental)['bytes'] == 4000
+    rebuilt = str(tmp_path / 'rebuilt.img')
+    assert cbt.rebuild_disk(incremental, rebuilt) == capacity + 4000
+    with open(rebuilt, 'rb') as rebuilt_file:
+        assert rebuilt_file.read() == bytes(changed)
@@ -0,0 +1,79 @@
+import io
+import os
+import random
+
+import pytest
+
+from tools import chunkstore
+
+
+def _image(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.fixture
+def data():
+    rand = random.Random(7)
+    return bytes(bytearray(rand.getrandbits(8) for _ in range(3 * 1024 * 1024 + 100)))
+
+
+def test_chunk_sizes(tmp_path, data):
+    chunks, stored = chunkstore.chunk_segment(str(tmp_path / 'store'), _image(tmp_path / 'a.img', data),
+                                              0, len(data))
+    assert sum(length for _, length in chunks) == len(data) == stored
+    # every chunk but the last lies between the bounds
+    assert all(chunkstore.MIN_CHUNK <= length <= chunkstore.MAX_CHUNK for _, length in chunks[:-1])
+
+
+def test_ingest_and_restore(tmp_path, data):
+    root = str(tmp_path / 'store')
+    manifest = chunkstore.ingest(root, _image(tmp_path / 'a.img', data), 'fcd-1', 'sn-1',
+                                 meta={'description': 'nightly'}, workers=2)
+    assert manifest['size'] == len(data)
+    assert manifest['description'] == 'nightly'
+    assert chunkstore.list_snapshots(root, 'fcd-1') == ['sn-1']
+
+    out = io.BytesIO()
+    assert chunkstore.restore(root, 'fcd-1', 'sn-1', out) == len(data)
+    assert out.getvalue() == data
+
+
+def test_unchanged_data_is_stored_once(tmp_path, data):
+    root = str(tmp_path / 'store')
+    chunkstore.ingest(root, _image(tmp_path / 'a.img', data), 'fcd-1', 'sn-1', workers=1)
+    # one changed block in the middle
+    changed = data[:len(data) // 2] + b'\0' * 4096 + data[len(data) // 2 + 4096:]
+    second = chunkstore.ingest(root, _image(tmp_path / 'b.img', changed), 'fcd-1', 'sn-2', workers=1)
+
+    assert 0 < second['stored'] < len(data) // 2
+    stats = chunkstore.stats(root)
+    assert stats['logical'] == 2 * len(data)
+    assert stats['stored'] < 2 * len(data)
+
+    out = io.BytesIO()
+    chunkstore.restore(root, 'fcd-1', 'sn-2', out)
+    assert out.getvalue() == changed
+
+
+def test_remove_snapshot_keeps_shared_chunks(tmp_path, data):
+    root = str(tmp_path / 'store')
+    chunkstore.ingest(root, _image(tmp_path / 'a.img', data), 'fcd-1', 'sn-1', workers=1)
+    chunkstore.ingest(root, _image(tmp_path / 'b.img', data[:len(data) // 2] + os.urandom(1024 * 1024)),
+                      'fcd-1', 'sn-2', workers=1)
+
+    assert chunkstore.remove_snapshot(root, 'fcd-1', 'sn-2') > 0
+    assert chunkstore.list_snapshots(root, 'fcd-1') == ['sn-1']
+    out = io.BytesIO()
+    chunkstore.restore(root, 'fcd-1', 'sn-1', out)
+    assert out.getvalue() == data
+
+
+def test_restore_detects_damage(tmp_path, data):
+    root = str(tmp_path / 'store')
+    manifest = chunkstore.ingest(root, _image(tmp_path / 'a.img', data), 'fcd-1', 'sn-1', workers=1)
+    sha256, _ = manifest['chunks'][0]
+    with open(chunkstore._object_path(root, sha256), 'r+b') as object_file:
+        object_file.write(b'\xff\xff')
+    with pytest.raises(IOError):
+        chunkstore.restore(root, 'fcd-1', 'sn-1', io.BytesIO())
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+from pyVmomi import vim
+
+from tools import concurrency
+
+
+def test_additive_increase_up_to_max():
+    limit = concurrency.AIMDLimit('global', 4, initial=2)
+    for _ in range(2):
+        limit.on_success(1.0)
+    assert limit.limit == pytest.approx(2.0 + 1.0 / 2 + 1.0 / 2.5)
+    for _ in range(100):
+        limit.on_success(1.0)
+    assert limit.limit == 4
+
+
+def test_latency_above_baseline_halves():
+    limit = concurrency.AIMDLimit('global', 16, initial=8)
+    limit.on_success(1.0)
+    limit.on_success(2.5)
+    assert limit.limit == pytest.approx((8 + 1.0 / 8) / 2)
+    # within the latency just seen, a second slow completion does not cut again
+    cut = limit.limit
+    limit.on_success(2.5)
+    assert limit.limit == cut
+
+
+def test_baseline_per_operation():
+    limit = concurrency.AIMDLimit('global', 16, initial=8)
+    limit.on_success(0.5, 'snapshot')
+    # a revert is slower than a snapshot create, not congested
+    limit.on_success(5.0, 'revert')
+    assert limit.limit > 8
+    assert limit.baselines == {'snapshot': 0.5, 'revert': 5.0}
+    grown = limit.limit
+    limit.on_success(11.0, 'revert')
+    assert limit.limit == pytest.approx(grown / 2)
+
+
+def test_latency_target():
+    limit = concurrency.AIMDLimit('global', 16, initial=8, latency_target=3.0)
+    limit.on_success(2.9)
+    assert limit.limit > 8
+    limit.on_success(3.1)
+    assert limit.limit < 8
+
+
+def test_never_below_min():
+    limit = concurrency.AIMDLimit('global', 4, initial=1)
+    limit.on_congestion()
+    assert limit.limit == 1
+
+
+def test_slot_limits_per_datastore():
+    controller = concurrency.ConcurrencyController(global_limit=8, datastore_limit=2, host_limit=8)
+    inside, most = [0], [0]
+    lock = threading.Lock()
+
+    def _work():
+        with controller.slot(datastore='ds-1', host='host-1'):
+            with lock:
+                inside[0] += 1
+                most[0] = max(most[0], inside[0])
+            time.sleep(0.02)
+            with lock:
+                inside[0] -= 1
+
+    threads = [threading.Thread(target=_work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the datastore limit starts at half its maximum and never grows past it
+    assert most[0] <= 2
+    assert controller.limits['datastore:ds-1'].in_flight == 0
+
+
+def test_slot_source_and_target_share_a_limit():
+    controller = concurrency.ConcurrencyController(datastore_limit=4)
+    with controller.slot(datastore='ds-1', source='ds-1'):
+        assert controller.limits['datastore:ds-1'].in_flight == 1
+
+
+def test_busy_fault_cuts_the_limit():
+    controller = concurrency.ConcurrencyController(global_limit=16)
+    with pytest.raises(vim.fault.TaskInProgress):
+        with controller.slot():
+            raise vim.fault.TaskInProgress(msg='busy')
+    assert controller.global_limit.limit == 4
+    assert controller.global_limit.in_flight == 0
+
+
+def test_slot_or_null():
+    with concurrency.slot_or_null(None, datastore='ds-1'):
+        pass
+    controller = concurrency.ConcurrencyController()
+    with concurrency.slot_or_null(controller, datastore='ds-1', operation='relocate'):
+        assert controller.limits['datastore:ds-1'].in_flight == 1
+    assert 'relocate' in controller.limits['datastore:ds-1'].baselines
@@ -0,0 +1,71 @@
+import pytest
+from pyVmomi import vim
+
+from tools import diskchange
+
+
+def _disk(key, controller_key, unit, vdisk_id=None):
+    return vim.vm.device.VirtualDisk(key=key, controllerKey=controller_key, unitNumber=unit,
+                                     vDiskId=vim.vslm.ID(id=vdisk_id) if vdisk_id else None)
+
+
+def _scsi(key):
+    return vim.vm.device.VirtualLsiLogicSASController(key=key, busNumber=key - 1000, scsiCtlrUnitNumber=7)
+
+
+def test_free_slots_skip_used_units_and_the_controller_unit():
+    devices = [_scsi(1000), _disk(2000, 1000, 0), _disk(2001, 1000, 1)]
+    slots = diskchange.free_slots(devices)
+    assert slots[0] == (1000, 2)
+    assert (1000, 7) not in slots
+    assert len(slots) == 16 - 1 - 2
+
+
+def test_free_slots_prefer_scsi_then_nvme():
+    devices = [vim.vm.device.VirtualNVMEController(key=31000), _scsi(1001), _scsi(1000)]
+    slots = diskchange.free_slots(devices)
+    assert slots[0] == (1000, 0)
+    assert slots[15] == (1001, 0)
+    assert slots[30] == (31000, 0)
+    assert len(slots) == 15 + 15 + 15
+
+
+def test_free_slots_without_controllers():
+    assert diskchange.free_slots([_disk(2000, 200, 0)]) == []
+
+
+def _attach(vdisk_id, **fields):
+    return dict({'vDiskId': vdisk_id, 'fileName': '[ds1] fcd/%s.vmdk' % vdisk_id, 'capacityInMB': 1024,
+                 'datastore': None}, **fields)
+
+
+def test_attach_spec_places_disks_on_free_slots():
+    devices = [_scsi(1000), _disk(2000, 1000, 0)]
+    changes = [_attach('fcd-1'), _attach('fcd-2', controllerKey=1000, unitNumber=1), _attach('fcd-3')]
+    spec = diskchange.attach_spec(devices, changes)
+
+    # a slot given to one change is not handed to another
+    assert [(c['controllerKey'], c['unitNumber']) for c in changes] == [(1000, 2), (1000, 1), (1000, 3)]
+    disks = [device_change.device for device_change in spec.deviceChange]
+    assert [disk.key for disk in disks] == [-1, -2, -3]
+    assert disks[0].backing.fileName == '[ds1] fcd/fcd-1.vmdk'
+    assert disks[0].capacityInKB == 1024 * 1024
+    assert all(device_change.operation == 'add' for device_change in spec.deviceChange)
+
+
+def test_attach_spec_too_few_slots():
+    devices = [_scsi(1000)] + [_disk(2000 + unit, 1000, unit) for unit in range(16) if unit != 7]
+    with pytest.raises(ValueError):
+        diskchange.attach_spec(devices, [_attach('fcd-1')])
+
+
+def test_detach_spec_fails_disks_not_attached():
+    devices = [_scsi(1000), _disk(2000, 1000, 3, 'fcd-1')]
+    changes = [{'vDiskId': 'fcd-1'}, {'vDiskId': 'fcd-2'}]
+    spec = diskchange.detach_spec(devices, changes)
+
+    assert [device_change.device.key for device_change in spec.deviceChange] == [2000]
+    assert (changes[0]['controllerKey'], changes[0]['unitNumber']) == (1000, 3)
+    assert 'ok' not in changes[0]
+    assert changes[1]['ok'] is False
+    assert diskchange.detach_spec(devices, [{'vDiskId': 'fcd-2'}]) is None
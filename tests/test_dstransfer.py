@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from tools import dstransfer
+
+DATA = os.urandom(300 * 1024 + 17)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ A datastore browser stand-in: HEAD, ranged GET and PUT of in memory files """
+
+    files = {}
+    # headers of every PUT, in order
+    puts = []
+    # GET requests answered, and the Range start from which GETs fail
+    gets = []
+    fail_from = None
+
+    def log_message(self, *args):
+        pass
+
+    def _path(self):
+        return self.path.split('?', 1)[0]
+
+    def do_HEAD(self):
+        data = self.files.get(self._path())
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', '"%s"' % hashlib.sha256(data).hexdigest()[:16])
+        self.end_headers()
+
+    def do_GET(self):
+        data = self.files.get(self._path())
+        if data is None:
+            self.send_error(404)
+            return
+        start, end = 0, len(data) - 1
+        if 'Range' in self.headers:
+            start, end = [int(part) for part in self.headers['Range'].split('=', 1)[1].split('-')]
+            if self.fail_from is not None and start >= self.fail_from:
+                self.send_error(503)
+                return
+            self.gets.append(start)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+    def do_PUT(self):
+        self.puts.append(dict(self.headers))
+        self.files[self._path()] = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+@pytest.fixture
+def server():
+    _Handler.files = {'/folder/fcd/disk-flat.vmdk': DATA}
+    _Handler.puts, _Handler.gets, _Handler.fail_from = [], [], None
+    httpd = HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield '127.0.0.1:%d' % httpd.server_address[1]
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _url(host, path):
+    return dstransfer.datastore_url(host, 'dc1', 'ds1', path, scheme='http')
+
+
+def test_download_in_chunks(server, tmp_path):
+    target = str(tmp_path / 'disk-flat.vmdk')
+    session = dstransfer.build_session(pool_size=4)
+
+    sha256 = dstransfer.download(session, _url(server, 'fcd/disk-flat.vmdk'), target, chunk_size=64 * 1024,
+                                 workers=4, expected_sha256=hashlib.sha256(DATA).hexdigest())
+
+    with open(target, 'rb') as target_file:
+        assert target_file.read() == DATA
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    assert not os.path.exists(target + dstransfer.STATE_SUFFIX)
+
+
+def test_download_checksum_mismatch(server, tmp_path):
+    session = dstransfer.build_session()
+    with pytest.raises(IOError):
+        dstransfer.download(session, _url(server, 'fcd/disk-flat.vmdk'), str(tmp_path / 'disk-flat.vmdk'),
+                            chunk_size=64 * 1024, expected_sha256='0' * 64)
+
+
+def test_upload_files(server, tmp_path):
+    jobs = []
+    for number in range(3):
+        source = tmp_path / ('disk%d.vmdk' % number)
+        source.write_bytes(DATA[number:])
+        jobs.append((str(source), _url(server, 'import/disk%d.vmdk' % number)))
+
+    digests = dstransfer.upload_files(dstransfer.build_session(), jobs, workers=3)
+
+    for number, sha256 in enumerate(digests):
+        assert _Handler.files['/folder/import/disk%d.vmdk' % number] == DATA[number:]
+        assert sha256 == hashlib.sha256(DATA[number:]).hexdigest()
+        assert sha256 == dstransfer.file_sha256(jobs[number][0])
+
+
+def test_upload_is_not_chunked(server, tmp_path):
+    source = tmp_path / 'disk.vmdk'
+    source.write_bytes(DATA)
+    url = _url(server, 'import/disk.vmdk')
+    session = dstransfer.build_session()
+
+    prepared = session.prepare_request(requests.Request('PUT', url, data=dstransfer._HashingReader(str(source))))
+    assert prepared.headers['Content-Length'] == str(len(DATA))
+    assert 'Transfer-Encoding' not in prepared.headers
+
+    dstransfer.upload(session, url, str(source))
+    assert _Handler.puts[0]['Content-Length'] == str(len(DATA))
+    assert 'Transfer-Encoding' not in _Handler.puts[0]
+
+
+def test_download_resumes(server, tmp_path):
+    target = str(tmp_path / 'disk-flat.vmdk')
+    url = _url(server, 'fcd/disk-flat.vmdk')
+    chunk_size = 64 * 1024
+    _Handler.fail_from = 3 * chunk_size
+    with pytest.raises(requests.HTTPError):
+        dstransfer.download(dstransfer.build_session(), url, target, chunk_size=chunk_size, workers=1)
+    assert os.path.exists(target + dstransfer.STATE_SUFFIX)
+
+    _Handler.fail_from, _Handler.gets = None, []
+    sha256 = dstransfer.download(dstransfer.build_session(), url, target, chunk_size=chunk_size, workers=1)
+
+    # only the chunks the first run did not get are fetched again
+    assert sorted(_Handler.gets) == list(range(3 * chunk_size, len(DATA), chunk_size))
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    with open(target, 'rb') as target_file:
+        assert target_file.read() == DATA
+
+
+def test_download_starts_over_on_changed_file(server, tmp_path):
+    target = str(tmp_path / 'disk-flat.vmdk')
+    url = _url(server, 'fcd/disk-flat.vmdk')
+    chunk_size = 64 * 1024
+    _Handler.fail_from = 3 * chunk_size
+    with pytest.raises(requests.HTTPError):
+        dstransfer.download(dstransfer.build_session(), url, target, chunk_size=chunk_size, workers=1)
+
+    # another file of the same size, its ETag differs
+    changed = bytes(bytearray(255 - b for b in bytearray(DATA)))
+    _Handler.files['/folder/fcd/disk-flat.vmdk'] = changed
+    _Handler.fail_from, _Handler.gets = None, []
+    sha256 = dstransfer.download(dstransfer.build_session(), url, target, chunk_size=chunk_size, workers=1)
+
+    assert sorted(_Handler.gets) == list(range(0, len(DATA), chunk_size))
+    assert sha256 == hashlib.sha256(changed).hexdigest()
+
+
+def test_state_of_another_url_is_ignored(tmp_path):
+    path = str(tmp_path / 'disk.transfer.json')
+    state = dstransfer._TransferState(path, 'http://a/folder/x', 10, 4, '"e1"')
+    state.mark_done(0, 'ab')
+
+    assert dstransfer._TransferState(path, 'http://a/folder/x', 10, 4, '"e1"').done(0)
+    assert not dstransfer._TransferState(path, 'http://a/folder/y', 10, 4, '"e1"').done(0)
+    assert not dstransfer._TransferState(path, 'http://a/folder/x', 10, 4, '"e2"').done(0)
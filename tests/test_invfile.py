@@ -0,0 +1,73 @@
+import os
+import time
+
+import pytest
+
+from tools import invfile
+
+NAMES = [('VirtualMachine', 'vm-b', 'vm-2'), ('VirtualMachine', 'vm-a', 'vm-1'), ('Datastore', 'ds1', 'datastore-1'),
+         ('Datacenter', 'dc1', 'datacenter-1'), ('VirtualMachine', u'vm-é', 'vm-3')]
+VDISKS = {'fcd-2': ('datastore-1', '', -1, -1), 'fcd-1': ('datastore-1', 'vm-1', 1000, 2)}
+DATASTORES = {'datastore-1': ('ds1', 'ds:///vmfs/volumes/1/')}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'inventory.bin')
+    invfile.write(path, 'vc1', NAMES, VDISKS, DATASTORES)
+    return path
+
+
+def test_lookups(path):
+    inventory_file = invfile.InventoryFile(path)
+    try:
+        assert inventory_file.host == 'vc1'
+        assert inventory_file.moid('VirtualMachine', 'vm-a') == 'vm-1'
+        assert inventory_file.moid('VirtualMachine', 'vm-b') == 'vm-2'
+        assert inventory_file.moid('VirtualMachine', u'vm-é') == 'vm-3'
+        assert inventory_file.moid('Datastore', 'ds1') == 'datastore-1'
+        assert inventory_file.moid('Datastore', 'vm-a') is None
+        assert inventory_file.moid('VirtualMachine', 'missing') is None
+        assert inventory_file.moid('Folder', 'vm-a') is None
+
+        assert inventory_file.vdisk('fcd-1') == {'datastore': 'datastore-1', 'vm': 'vm-1',
+                                                 'controllerKey': 1000, 'unitNumber': 2}
+        assert inventory_file.vdisk('fcd-2') == {'datastore': 'datastore-1', 'vm': None,
+                                                 'controllerKey': None, 'unitNumber': None}
+        assert inventory_file.vdisk('fcd-3') is None
+        assert inventory_file.datastore('datastore-1') == ('ds1', 'ds:///vmfs/volumes/1/')
+        assert inventory_file.datastore('datastore-2') is None
+    finally:
+        inventory_file.close()
+
+
+def test_check(path):
+    inventory_file = invfile.InventoryFile(path)
+    try:
+        inventory_file.check('vc1')
+        with pytest.raises(invfile.StaleInventory):
+            inventory_file.check('vc2')
+        inventory_file.created = time.time() - 2 * invfile.DEFAULT_MAX_AGE
+        with pytest.raises(invfile.StaleInventory):
+            inventory_file.check('vc1')
+    finally:
+        inventory_file.close()
+
+
+def test_not_an_inventory_file(tmp_path):
+    path = str(tmp_path / 'other.bin')
+    with open(path, 'wb') as other:
+        other.write(os.urandom(256))
+    with pytest.raises(invfile.StaleInventory):
+        invfile.InventoryFile(path)
+
+
+def test_use(path):
+    try:
+        assert invfile.use(path, 'vc1') is invfile.active()
+        assert invfile.active().vdisk('fcd-1')['vm'] == 'vm-1'
+        assert invfile.use(path, 'vc2') is None
+        assert invfile.active() is None
+        assert invfile.use(path + '.missing', 'vc1') is None
+    finally:
+        invfile.use(None, None)
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from tools import placement
+
+GB = 1024 ** 3
+
+
+class _Datastore(object):
+    def __init__(self, moid):
+        self._moId = moid
+
+
+def _advisor(max_fcds=0, max_chain=32):
+    return placement.PlacementAdvisor({
+        'ds-1': {'obj': _Datastore('ds-1'), 'name': 'ds1', 'capacity': 100 * GB, 'freeSpace': 50 * GB,
+                 'accessible': True, 'fcds': 0},
+        'ds-2': {'obj': _Datastore('ds-2'), 'name': 'ds2', 'capacity': 100 * GB, 'freeSpace': 80 * GB,
+                 'accessible': True, 'fcds': 0},
+    }, placement.Policy(max_used=0.9, max_fcds=max_fcds, max_chain=max_chain))
+
+
+def test_reserve_if_fits_is_atomic():
+    advisor = _advisor()
+    # ds-1 has 40 GB of headroom, 40 threads race for 4 GB each
+    results = []
+    barrier = threading.Barrier(40)
+
+    def _reserve():
+        barrier.wait()
+        results.append(advisor.reserve_if_fits('ds-1', 4 * GB, new_fcd=False))
+
+    threads = [threading.Thread(target=_reserve) for _ in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(None) == 10
+    assert advisor.planned_bytes['ds-1'] == 40 * GB
+
+
+def test_choose_spreads_and_counts_fcds():
+    advisor = _advisor(max_fcds=2)
+    assert advisor.place(4, GB) == ['ds-2', 'ds-2', 'ds-1', 'ds-1']
+    with pytest.raises(placement.PlacementRejected):
+        advisor.choose(GB)
+
+
+def test_check_chain_and_space():
+    advisor = _advisor(max_chain=3)
+    placement.use(advisor)
+    try:
+        placement.check(None, _Datastore('ds-1'), size=GB, chain_depth=2)
+        assert advisor.planned_bytes['ds-1'] == GB
+        with pytest.raises(placement.PlacementRejected):
+            placement.check(None, _Datastore('ds-1'), chain_depth=3)
+        with pytest.raises(placement.PlacementRejected):
+            placement.check(None, _Datastore('ds-1'), size=40 * GB)
+    finally:
+        placement.use(None)
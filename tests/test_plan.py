@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from tools import plan
+
+
+def _plan(*steps):
+    return {'steps': list(steps)}
+
+
+SNAPSHOT = {'id': 'snap', 'op': 'snapshot', 'vm': 'web01', 'disk': 2, 'description': 'before upgrade'}
+REVERT = {'id': 'revert', 'op': 'revert', 'vm': 'web01', 'disk': 2, 'snid': '${snap}'}
+
+
+def test_load_plan(tmp_path):
+    path = tmp_path / 'plan.json'
+    path.write_text(json.dumps(_plan(SNAPSHOT, REVERT)))
+    assert [step['id'] for step in plan.load_plan(str(path))['steps']] == ['snap', 'revert']
+
+
+@pytest.mark.parametrize('bad', [
+    {},
+    _plan(dict(SNAPSHOT, id='')),
+    _plan(SNAPSHOT, SNAPSHOT),
+    _plan(dict(SNAPSHOT, op='format')),
+    _plan(dict(SNAPSHOT, description='')),
+    _plan(dict(SNAPSHOT, after=['missing'])),
+    _plan(dict(SNAPSHOT, after=['revert']), REVERT),
+])
+def test_validate_plan_refuses(bad):
+    with pytest.raises(ValueError):
+        plan.validate_plan(bad)
+
+
+def test_dependencies_include_references():
+    step = dict(REVERT, after=['promote', 'snap'], description='after ${check}')
+    assert plan.dependencies(step) == ['promote', 'snap', 'check']
+
+
+def test_resource_keys():
+    assert plan.resource_keys(SNAPSHOT) == {'vm:web01'}
+    attach = {'id': 'a', 'op': 'attach', 'vm': 'db01', 'vDiskId': 'fcd-1'}
+    assert plan.resource_keys(attach) == {'vm:db01', 'fcd:fcd-1'}
+
+
+def test_resolve():
+    resolved = plan.resolve(REVERT, {'snap': 'sn-1'})
+    assert resolved['snid'] == 'sn-1'
+    assert resolved['disk'] == 2
+    assert REVERT['snid'] == '${snap}'
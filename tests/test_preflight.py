@@ -0,0 +1,154 @@
+import pytest
+
+from tools import preflight
+
+
+@pytest.mark.parametrize('config_version, expected', [
+    ('vmx-13', 13),
+    ('vmx-19', 19),
+    (None, None),
+    ('', None),
+    ('vmx-', None),
+    ('garbage', None),
+])
+def test_hw_version(config_version, expected):
+    assert preflight.hw_version(config_version) == expected
+
+
+def test_snapshot_ops_need_version_13():
+    assert preflight.hw_version('vmx-11') < preflight.MIN_HW_VERSION <= preflight.hw_version('vmx-13')
+
+
+class _Obj(object):
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+def _id(value):
+    return _Obj(id=value)
+
+
+def _disk(number, vdisk_id=None, datastore='ds-1'):
+    return _Obj(deviceInfo=_Obj(label='Hard disk %s' % number), vDiskId=_id(vdisk_id) if vdisk_id else None,
+                backing=_Obj(datastore=_Obj(_moId=datastore)))
+
+
+class _Manager(object):
+    """ vStorageObjectManager answering from {vDiskId: [snapshot ids]} and {datastore moId: [vDiskIds]} """
+
+    def __init__(self, snapshots, fcds):
+        self.snapshots = snapshots
+        self.fcds = fcds
+        self.calls = []
+
+    def RetrieveSnapshotInfo(self, vdisk_id, ds_obj):
+        self.calls.append(vdisk_id.id)
+        if vdisk_id.id not in self.snapshots:
+            raise RuntimeError("the FCD is gone")
+        return _Obj(snapshots=[_Obj(id=_id(snid)) for snid in self.snapshots[vdisk_id.id]])
+
+    def ListVStorageObject(self, ds_obj):
+        return [_id(vdisk_id) for vdisk_id in self.fcds.get(ds_obj._moId, [])]
+
+
+GB = 1024 ** 3
+POLICY = preflight.placement.Policy(max_used=0.9, max_fcds=0, max_chain=3)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    vms = {
+        'vm1': {'obj': _Obj(_moId='vm-1'), 'version': 'vmx-14',
+                'disks': {'Hard disk 1': _disk(1, 'fcd-1'), 'Hard disk 2': _disk(2),
+                          'Hard disk 3': _disk(3, 'fcd-3', datastore='ds-9'),
+                          'Hard disk 4': _disk(4, 'fcd-gone')}},
+        'old': {'obj': _Obj(_moId='vm-2'), 'version': 'vmx-11', 'disks': {'Hard disk 1': _disk(1, 'fcd-5')}},
+        'full': {'obj': _Obj(_moId='vm-3'), 'version': 'vmx-14', 'disks': {'Hard disk 1': _disk(1, 'fcd-6', 'ds-2')}},
+    }
+    datastores = {
+        'ds-1': {'obj': _Obj(_moId='ds-1'), 'name': 'ds1', 'capacity': 100 * GB, 'freeSpace': 50 * GB,
+                 'accessible': True},
+        'ds-2': {'obj': _Obj(_moId='ds-2'), 'name': 'ds2', 'capacity': 100 * GB, 'freeSpace': 5 * GB,
+                 'accessible': True},
+        'ds-3': {'obj': _Obj(_moId='ds-3'), 'name': 'ds3', 'capacity': 100 * GB, 'freeSpace': 50 * GB,
+                 'accessible': False},
+    }
+    monkeypatch.setattr(preflight, 'fetch_vms',
+                        lambda si, names, page_size=500, resolved=None: dict((n, vms[n]) for n in names if n in vms))
+    monkeypatch.setattr(preflight.inventory, 'collect_datastores', lambda si: datastores)
+    return _Manager({'fcd-1': ['sn-1', 'sn-2'], 'fcd-5': [], 'fcd-6': []}, {'ds-1': ['fcd-1', 'fcd-7']})
+
+
+def _check(manager, steps):
+    si = _Obj(content=_Obj(vStorageObjectManager=manager))
+    return preflight.check(si, steps, POLICY)
+
+
+def test_every_problem_at_once(manager):
+    steps = [
+        {'id': 'no-vm', 'op': 'snapshot', 'vm': 'nope', 'disk': 1},
+        {'id': 'no-disk', 'op': 'delete', 'vm': 'vm1', 'disk': 9, 'snid': 'sn-1'},
+        {'id': 'not-fcd', 'op': 'revert', 'vm': 'vm1', 'disk': 2, 'snid': 'sn-1'},
+        {'id': 'old-hw', 'op': 'snapshot', 'vm': 'old', 'disk': 1},
+        {'id': 'no-snid', 'op': 'delete', 'vm': 'vm1', 'disk': 1, 'snid': 'sn-9'},
+        {'id': 'full', 'op': 'snapshot', 'vm': 'full', 'disk': 1},
+        {'id': 'fcd', 'op': 'promote', 'vm': 'vm1', 'disk': 1},
+        {'id': 'ok', 'op': 'delete', 'vm': 'vm1', 'disk': 1, 'snid': 'sn-2'},
+    ]
+    issues = _check(manager, steps)
+    assert sorted(issues) == ['fcd', 'full', 'no-disk', 'no-snid', 'no-vm', 'not-fcd', 'old-hw']
+    assert issues['no-vm'] == ["VM nope is not found"]
+    assert issues['old-hw'] == ["VM old has hardware version 11, FCD snapshots need 13 or later"]
+    assert issues['no-snid'] == ["FCD fcd-1 has no snapshot sn-9"]
+    assert issues['full'] == ["datastore ds2 would be more than 90% full"]
+    assert issues['fcd'] == ["Hard disk 1 of vm1 is already the FCD fcd-1"]
+
+
+def test_disk_promoted_by_the_plan(manager):
+    steps = [{'id': 'promote', 'op': 'promote', 'vm': 'vm1', 'disk': 2},
+             {'id': 'snap', 'op': 'snapshot', 'vm': 'vm1', 'disk': 2, 'depends_on': ['promote']},
+             {'id': 'revert', 'op': 'revert', 'vm': 'vm1', 'disk': 2, 'snid': '${snap}'}]
+    assert _check(manager, steps) == {}
+    assert manager.calls == []
+
+
+def test_reference_snid_is_not_looked_up(manager):
+    steps = [{'id': 'snap', 'op': 'snapshot', 'vm': 'vm1', 'disk': 1},
+             {'id': 'delete', 'op': 'delete', 'vm': 'vm1', 'disk': 1, 'snid': '${snap}'}]
+    assert _check(manager, steps) == {}
+    assert manager.calls == ['fcd-1']
+
+
+def test_snapshots_added_by_the_plan_count(manager):
+    # fcd-1 has 2 snapshots, the limit is 3
+    steps = [{'id': 'snap%d' % n, 'op': 'snapshot', 'vm': 'vm1', 'disk': 1} for n in range(3)]
+    issues = _check(manager, steps)
+    assert sorted(issues) == ['snap1', 'snap2']
+    assert issues['snap1'] == ["Hard disk 1 of vm1 would have more than 3 snapshots"]
+    # one read for the three steps
+    assert manager.calls == ['fcd-1']
+
+
+def test_snapshots_added_to_a_disk_promoted_by_the_plan(manager):
+    steps = [{'id': 'promote', 'op': 'promote', 'vm': 'vm1', 'disk': 2}] + \
+            [{'id': 'snap%d' % n, 'op': 'snapshot', 'vm': 'vm1', 'disk': 2} for n in range(4)]
+    assert sorted(_check(manager, steps)) == ['snap3']
+
+
+def test_datastores(manager):
+    steps = [
+        {'id': 'gone-ds', 'op': 'snapshot', 'vm': 'vm1', 'disk': 3},
+        {'id': 'gone-fcd', 'op': 'delete', 'vm': 'vm1', 'disk': 4, 'snid': 'sn-1'},
+        {'id': 'no-ds', 'op': 'attach', 'vm': 'vm1', 'vDiskId': 'fcd-7', 'ds': 'nope'},
+        {'id': 'offline', 'op': 'attach', 'vm': 'vm1', 'vDiskId': 'fcd-7', 'ds': 'ds3'},
+        {'id': 'elsewhere', 'op': 'attach', 'vm': 'vm1', 'vDiskId': 'fcd-8', 'ds': 'ds1'},
+        {'id': 'attach', 'op': 'attach', 'vm': 'vm1', 'vDiskId': 'fcd-7', 'ds': 'ds1'},
+    ]
+    issues = _check(manager, steps)
+    assert issues == {
+        'gone-ds': ["the datastore of Hard disk 3 of vm1 is not found"],
+        'gone-fcd': ["the snapshots of FCD fcd-gone could not be read : the FCD is gone"],
+        'no-ds': ["datastore nope is not found"],
+        'offline': ["datastore ds3 is not accessible"],
+        'elsewhere': ["FCD fcd-8 is not on datastore ds1"],
+    }
@@ -0,0 +1,57 @@
+from tools import relocate
+
+MB = 1024 * 1024
+
+
+def _move(vdisk_id, source, target, size_mb):
+    return {'vDiskId': vdisk_id, 'source': source, 'target': target, 'size': size_mb * MB}
+
+
+def test_limits_per_source_and_target():
+    moves = [_move('fcd-%d' % n, 'ds-a', 'ds-b', 10) for n in range(3)] + [_move('fcd-9', 'ds-c', 'ds-d', 10)]
+    dispatcher = relocate.Dispatcher(moves, source_limit=2, target_limit=2)
+
+    started = [dispatcher.next() for _ in range(3)]
+    assert [move['source'] for move in started].count('ds-a') == 2
+    assert 'fcd-9' in [move['vDiskId'] for move in started]
+    # ds-a and ds-b are full, the last move waits
+    assert dispatcher.next() is None
+    assert len(dispatcher.pending) == 1
+
+    waiting = dispatcher.pending[0]
+    dispatcher.finished(started[0], 1.0, True)
+    assert dispatcher.next() is waiting
+    assert not dispatcher.pending
+
+
+def test_largest_first_then_least_loaded():
+    moves = [_move('small', 'ds-a', 'ds-b', 10), _move('large', 'ds-a', 'ds-b', 100),
+             _move('other', 'ds-c', 'ds-d', 50)]
+    dispatcher = relocate.Dispatcher(moves, source_limit=4, target_limit=4)
+
+    # nothing in flight, so the tie goes to the largest disk
+    assert dispatcher.next()['vDiskId'] == 'large'
+    # ds-a and ds-b have 100 MB in flight, the idle pair goes first
+    assert dispatcher.next()['vDiskId'] == 'other'
+    assert dispatcher.next()['vDiskId'] == 'small'
+
+
+def test_finished_updates_rates_and_bytes():
+    move = _move('fcd-1', 'ds-a', 'ds-b', 100)
+    dispatcher = relocate.Dispatcher([move])
+    assert dispatcher.next() is move
+    assert dispatcher.bytes_in_flight == {'ds-a': 100 * MB, 'ds-b': 100 * MB}
+
+    dispatcher.finished(move, 10.0, True)
+    assert dispatcher.in_flight == {('source', 'ds-a'): 0, ('target', 'ds-b'): 0}
+    assert dispatcher.bytes_in_flight == {'ds-a': 0, 'ds-b': 0}
+    assert dispatcher.rates == {'ds-a': 10 * MB, 'ds-b': 10 * MB}
+
+
+def test_failed_moves_do_not_count_as_throughput():
+    move = _move('fcd-1', 'ds-a', 'ds-b', 100)
+    dispatcher = relocate.Dispatcher([move])
+    dispatcher.next()
+    dispatcher.finished(move, 1.0, False)
+    assert dispatcher.rates == {}
+    assert dispatcher._rate('ds-a') == relocate.DEFAULT_RATE
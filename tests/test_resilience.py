@@ -0,0 +1,182 @@
+import socket
+
+import pytest
+from pyVmomi import vim, vmodl
+
+from tools import resilience
+
+
+class _Clock(object):
+    """ Stands in for time.time and time.sleep """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(resilience.time, 'time', clock.time)
+    monkeypatch.setattr(resilience.time, 'sleep', clock.sleep)
+    return clock
+
+
+class _Calls(object):
+    """ A call raising the given outcomes in turn, returning 'done' after them """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        if self.outcomes:
+            raise self.outcomes.pop(0)
+        return 'done'
+
+
+def test_backoff_bounds(monkeypatch):
+    monkeypatch.setattr(resilience.random, 'uniform', lambda low, high: high)
+    assert list(resilience.backoff_delays(6, base_delay=1.0, max_delay=10.0)) == [1, 2, 4, 8, 10, 10]
+    monkeypatch.undo()
+    for delay, cap in zip(resilience.backoff_delays(5, 0.5, 3.0), [0.5, 1, 2, 3, 3]):
+        assert 0 <= delay <= cap
+
+
+def test_is_retryable():
+    assert resilience.is_retryable(vim.fault.TaskInProgress(msg='busy'))
+    assert resilience.is_retryable(vim.fault.NotAuthenticated(msg='gone'))
+    assert resilience.is_retryable(socket.error('reset'))
+    assert resilience.is_retryable(resilience.CircuitOpenError(10))
+    assert not resilience.is_retryable(vim.fault.NotFound(msg='nope'))
+    assert not resilience.is_retryable(vmodl.fault.SystemError(msg='broken', reason='broken'))
+    assert not resilience.is_retryable(ValueError())
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = resilience.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.on_failure()
+    breaker.before_call()
+    breaker.on_failure()
+
+    with pytest.raises(resilience.CircuitOpenError) as opened:
+        breaker.before_call()
+    assert opened.value.retry_in == 60
+
+    clock.now += 61
+    # one trial call goes through, the others still fail fast
+    breaker.before_call()
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.before_call()
+    # a failed trial opens it again right away
+    breaker.on_failure()
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 61
+    breaker.before_call()
+    breaker.on_success()
+    breaker.before_call()
+    assert breaker.failures == 0 and breaker.opened_at is None
+
+
+def test_success_resets_failures(clock):
+    breaker = resilience.CircuitBreaker(failure_threshold=2)
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+    breaker.before_call()
+
+
+def test_connection_errors_retried_for_safe_calls_only(clock):
+    policy = resilience.RetryPolicy(retries=3)
+    calls = _Calls(socket.error('reset'), socket.error('reset'))
+    assert policy.call(calls) == 'done'
+    assert calls.count == 3
+    assert len(clock.slept) == 2
+
+    calls = _Calls(socket.error('reset'))
+    with pytest.raises(socket.error):
+        policy.call(calls, safe=False)
+    assert calls.count == 1
+
+
+def test_retries_run_out(clock):
+    policy = resilience.RetryPolicy(retries=2, breaker=resilience.CircuitBreaker(failure_threshold=10))
+    calls = _Calls(*[socket.error('reset')] * 5)
+    with pytest.raises(socket.error):
+        policy.call(calls)
+    assert calls.count == 3
+
+
+def test_busy_and_other_faults_are_raised_at_once(clock):
+    policy = resilience.RetryPolicy()
+    for fault in (vim.fault.TaskInProgress(msg='busy'), vim.fault.NotFound(msg='nope')):
+        calls = _Calls(fault)
+        with pytest.raises(type(fault)):
+            policy.call(calls)
+        assert calls.count == 1
+    assert clock.slept == []
+    assert policy.breaker.failures == 0
+
+
+def test_unhealthy_faults_open_the_circuit(clock):
+    policy = resilience.RetryPolicy(breaker=resilience.CircuitBreaker(failure_threshold=2))
+    for _ in range(2):
+        with pytest.raises(vmodl.fault.SystemError):
+            policy.call(_Calls(vmodl.fault.SystemError(msg='broken', reason='broken')))
+    calls = _Calls()
+    with pytest.raises(resilience.CircuitOpenError):
+        policy.call(calls)
+    assert calls.count == 0
+
+
+def test_relogin_on_lost_session(clock):
+    logins = []
+    policy = resilience.RetryPolicy(login=lambda: logins.append(1))
+    calls = _Calls(vim.fault.NotAuthenticated(msg='gone'))
+    assert policy.call(calls) == 'done'
+    assert (calls.count, len(logins)) == (2, 1)
+
+    # a thread noticing the loss after another logged in does not log in again
+    policy._relogin(0)
+    assert len(logins) == 1
+
+    with pytest.raises(vim.fault.NotAuthenticated):
+        resilience.RetryPolicy().call(_Calls(vim.fault.NotAuthenticated(msg='gone')))
+
+
+class _Info(object):
+    def __init__(self, name):
+        self.wsdlName = name
+
+
+def test_install_routes_calls_by_method(clock):
+    outcomes = []
+
+    class _Stub(object):
+        def InvokeMethod(self, mo, info, args):
+            if outcomes:
+                raise outcomes.pop(0)
+            return info.wsdlName
+
+    class _Si(object):
+        _stub = _Stub()
+
+    policy = resilience.install(_Si(), 'user', 'secret')
+    outcomes.append(socket.error('reset'))
+    assert _Si._stub.InvokeMethod(None, _Info('RetrieveContents'), []) == 'RetrieveContents'
+    outcomes.append(socket.error('reset'))
+    with pytest.raises(socket.error):
+        _Si._stub.InvokeMethod(None, _Info('CreateSnapshot_Task'), [])
+    assert policy.login is not None
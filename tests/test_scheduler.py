@@ -0,0 +1,99 @@
+import threading
+import time
+
+from tools import scheduler
+
+
+def _step(step_id, vm, **fields):
+    return dict({'id': step_id, 'op': 'snapshot', 'vm': vm, 'disk': 1, 'description': step_id}, **fields)
+
+
+def _statuses(report):
+    return dict((record['id'], record['status']) for record in report)
+
+
+def test_results_flow_into_dependent_steps():
+    steps = [_step('snap', 'vm1'), _step('revert', 'vm1', op='revert', snid='${snap}')]
+    seen = []
+
+    def _execute(step):
+        seen.append(step)
+        return 'sn-%s' % step['id']
+
+    report = scheduler.run_steps(steps, _execute)
+    assert _statuses(report) == {'snap': scheduler.SUCCEEDED, 'revert': scheduler.SUCCEEDED}
+    assert seen[1]['snid'] == 'sn-snap'
+    assert report[0]['result'] == 'sn-snap'
+
+
+def test_dependents_of_failed_and_blocked_steps_are_skipped():
+    steps = [_step('a', 'vm1'), _step('b', 'vm2', after=['a']), _step('c', 'vm3'), _step('d', 'vm4', after=['c'])]
+
+    def _execute(step):
+        if step['id'] == 'a':
+            raise RuntimeError('no space')
+
+    report = scheduler.run_steps(steps, _execute, blocked={'c': 'preflight : VM vm3 is not found'})
+    assert _statuses(report) == {'a': scheduler.FAILED, 'b': scheduler.SKIPPED,
+                                 'c': scheduler.SKIPPED, 'd': scheduler.SKIPPED}
+    assert report[0]['error'] == 'no space'
+    assert report[2]['error'] == 'preflight : VM vm3 is not found'
+
+
+def test_transient_faults_are_retried():
+    attempts = []
+
+    def _execute(step):
+        attempts.append(step['id'])
+        if len(attempts) < 3:
+            raise IOError('connection reset')
+        return 'ok'
+
+    report = scheduler.run_steps([_step('a', 'vm1')], _execute, retries=2, retry_delay=0,
+                                 is_transient=lambda e: isinstance(e, IOError))
+    assert report[0]['status'] == scheduler.SUCCEEDED
+    assert report[0]['attempts'] == 3
+
+
+def test_steps_sharing_a_resource_never_overlap():
+    steps = [_step('a%d' % n, 'vm1') for n in range(3)] + [_step('b%d' % n, 'vm2') for n in range(3)]
+    lock = threading.Lock()
+    running = set()
+    overlaps = []
+    parallel = []
+
+    def _execute(step):
+        with lock:
+            if step['vm'] in running:
+                overlaps.append(step['id'])
+            running.add(step['vm'])
+            parallel.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.discard(step['vm'])
+
+    report = scheduler.run_steps(steps, _execute, max_workers=4)
+    assert set(_statuses(report).values()) == {scheduler.SUCCEEDED}
+    assert not overlaps
+    # the two VMs are worked on side by side
+    assert max(parallel) == 2
+
+
+def test_custom_resources():
+    steps = [_step('a', 'vm1'), _step('b', 'vm2')]
+    lock = threading.Lock()
+    running = []
+    overlaps = []
+
+    def _execute(step):
+        with lock:
+            if running:
+                overlaps.append(step['id'])
+            running.append(step['id'])
+        time.sleep(0.02)
+        with lock:
+            running.remove(step['id'])
+
+    # both steps touch the same FCD, e.g. a detach by disk number and an attach
+    scheduler.run_steps(steps, _execute, max_workers=2, resources=lambda step: {'fcd:fcd-1'})
+    assert not overlaps
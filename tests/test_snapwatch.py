@@ -0,0 +1,122 @@
+from datetime import datetime
+
+from pyVmomi import vim, vmodl
+
+from tools import snapwatch
+
+
+class _Obj(object):
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+def _node(moid, name, children=(), description=''):
+    return _Obj(snapshot=vim.vm.Snapshot(moid), name=name, description=description,
+                createTime=datetime(2026, 10, 19), childSnapshotList=list(children))
+
+
+def _tree(current, *roots):
+    return _Obj(rootSnapshotList=list(roots), currentSnapshot=vim.vm.Snapshot(current) if current else None)
+
+
+def _disk(key, file_name, vdisk_id=None):
+    backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo(fileName=file_name, diskMode='persistent',
+                                                           datastore=vim.Datastore('ds-1'))
+    return vim.vm.device.VirtualDisk(key=key, deviceInfo=vim.Description(label='Hard disk %d' % (key - 1999),
+                                                                         summary=''),
+                                     vDiskId=vim.vslm.ID(id=vdisk_id) if vdisk_id else None, backing=backing)
+
+
+def _changes(events):
+    return sorted((event['change'], event.get('name') or event.get('label')) for event in events)
+
+
+def test_vm_snapshot_changes():
+    state = snapwatch._VmState('vm1')
+    events = []
+    state.update_snapshots(_tree('snapshot-2', _node('snapshot-1', 'base', [_node('snapshot-2', 'patch')])), events)
+    assert _changes(events) == [('created', 'base'), ('created', 'patch'), ('current', 'patch')]
+    assert dict((e['name'], e['depth']) for e in events if e['change'] == 'created') == {'base': 0, 'patch': 1}
+
+    events = []
+    # patch removed, base renamed, reverted to base
+    state.update_snapshots(_tree('snapshot-1', _node('snapshot-1', 'golden')), events)
+    assert _changes(events) == [('current', 'golden'), ('removed', 'patch'), ('renamed', 'golden')]
+
+    events = []
+    state.update_snapshots(None, events)
+    assert _changes(events) == [('removed', 'golden')]
+
+
+def test_disk_changes():
+    state = snapwatch._VmState('vm1')
+    events = []
+    state.update_disks([_disk(2000, '[ds1] vm1/vm1.vmdk'), _disk(2001, '[ds1] vm1/vm1_1.vmdk')], events)
+    assert _changes(events) == [('added', 'Hard disk 1'), ('added', 'Hard disk 2')]
+    assert 'datastore' not in events[0]
+
+    events = []
+    state.update_disks([_disk(2000, '[ds1] vm1/vm1-000001.vmdk'), _disk(2001, '[ds1] vm1/vm1_1.vmdk', 'fcd-2')],
+                       events)
+    assert _changes(events) == [('backing', 'Hard disk 1'), ('promoted', 'Hard disk 2')]
+    assert list(state.fcds()) == ['fcd-2']
+
+    events = []
+    state.update_disks([_disk(2000, '[ds1] vm1/vm1-000001.vmdk')], events)
+    assert _changes(events) == [('removed', 'Hard disk 2')]
+    assert state.fcds() == {}
+
+
+class _Manager(object):
+    def __init__(self, answer):
+        self.answer = answer
+
+    def RetrieveSnapshotInfo(self, id_object, ds_obj):
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return _Obj(snapshots=[_Obj(id=vim.vslm.ID(id=snid), description=snid, createTime=None)
+                               for snid in self.answer])
+
+
+def test_fcd_changes():
+    disk = {'label': 'Hard disk 2', 'datastore': vim.Datastore('ds-1')}
+    snapshots, events = snapwatch._fcd_changes(_Manager(['sn-1', 'sn-2']), 'fcd-2', 'vm1', disk, {})
+    assert sorted(snapshots) == ['sn-1', 'sn-2']
+    assert sorted((e['change'], e['id']) for e in events) == [('created', 'sn-1'), ('created', 'sn-2')]
+
+    snapshots, events = snapwatch._fcd_changes(_Manager(['sn-2', 'sn-3']), 'fcd-2', 'vm1', disk, snapshots)
+    assert sorted((e['change'], e['id']) for e in events) == [('created', 'sn-3'), ('removed', 'sn-1')]
+
+    assert snapwatch._fcd_changes(_Manager(vim.fault.NotFound(msg='gone')), 'fcd-2', 'vm1', disk, {}) == (None, [])
+    snapshots, events = snapwatch._fcd_changes(_Manager(vmodl.fault.SystemError(msg='busy', reason='busy')),
+                                               'fcd-2', 'vm1', disk, {})
+    assert snapshots is None
+    assert [(e['change'], e['vDiskId']) for e in events] == [('error', 'fcd-2')]
+
+
+def test_task_targets():
+    described = {'info.description': _Obj(arg=[_Obj(key='vDiskId', value='fcd-2'), _Obj(key='n', value=3)]),
+                 'info.entity': vim.Datastore('ds-1')}
+    assert snapwatch._task_targets(described) == set([('fcd', 'fcd-2'), ('datastore', 'ds-1')])
+    assert snapwatch._task_targets({'info.entityName': 'ds1'}) == set([('datastore-name', 'ds1')])
+    assert snapwatch._task_targets({}) == set(['all'])
+
+    refresh = set([('datastore-name', 'ds1')])
+    assert snapwatch._refreshed(refresh, 'fcd-9', 'ds-1', {'ds-1': 'ds1'})
+    assert not snapwatch._refreshed(refresh, 'fcd-9', 'ds-2', {'ds-1': 'ds1', 'ds-2': 'ds2'})
+    assert snapwatch._refreshed(set([('fcd', 'fcd-9')]), 'fcd-9', 'ds-2', {})
+
+
+def test_fcd_task_refreshes_its_targets():
+    task = vim.Task('task-1')
+    tasks, events, refresh = {}, [], set()
+    update = _Obj(kind='modify', changeSet=[
+        _Obj(name='info.descriptionId', val='vslm.vcenter.VStorageObjectManager.createSnapshot'),
+        _Obj(name='info.state', val='success'), _Obj(name='info.entity', val=vim.Datastore('ds-1'))])
+    snapwatch._task_changes(task, update, tasks, False, events, refresh)
+    assert [(e['kind'], e['change']) for e in events] == [('fcd-task', 'success')]
+    assert refresh == set([('datastore', 'ds-1')])
+
+    # reported once
+    snapwatch._task_changes(task, _Obj(kind='modify', changeSet=[]), tasks, False, events, refresh)
+    assert len(events) == 1
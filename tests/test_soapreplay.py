@@ -0,0 +1,111 @@
+import json
+from io import BytesIO
+
+import pytest
+from pyVmomi import vim, SoapStubAdapter
+
+from tools import soapreplay
+
+ENVELOPE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<soapenv:Envelope xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" '
+            'xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+            'xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<soapenv:Body>%s</soapenv:Body></soapenv:Envelope>')
+
+
+def _current_time(value):
+    return ENVELOPE % ('<CurrentTimeResponse xmlns="urn:vim25"><returnval>%s</returnval></CurrentTimeResponse>'
+                       % value)
+
+
+class _Response(object):
+    status = 200
+    reason = 'OK'
+
+    def __init__(self, body):
+        self._body = BytesIO(body.encode('utf-8'))
+
+    def getheader(self, name, default=None):
+        return 'text/xml; charset=utf-8' if name.lower() == 'content-type' else default
+
+    def read(self, *args):
+        return self._body.read(*args)
+
+
+class _Connection(object):
+    """ An HTTPS connection answering from a list of responses """
+    sock = None
+
+    def __init__(self, answers):
+        self._answers = answers
+
+    def request(self, method, url, body=None, headers=None, **kwargs):
+        pass
+
+    def getresponse(self):
+        return _Response(self._answers.pop(0))
+
+    def close(self):
+        pass
+
+
+def _record(tmp_path, answers, calls=2):
+    stub = SoapStubAdapter(host='vc1.example.com', version='vim.version.version13')
+    stub.GetConnection = lambda: _Connection(answers)
+    recorder = soapreplay.Recorder(stub)
+    si = vim.ServiceInstance('ServiceInstance', stub)
+    recorded = [si.CurrentTime() for _ in range(calls)]
+    path = str(tmp_path / 'fixture.json')
+    assert recorder.save(path) == calls
+    return path, recorded
+
+
+def test_record_save_replay(tmp_path):
+    path, recorded = _record(tmp_path, [_current_time('2026-10-19T10:00:00Z'),
+                                        _current_time('2026-10-19T10:00:05Z')])
+    with open(path) as fixture_file:
+        fixture = json.load(fixture_file)
+    assert [exchange['method'] for exchange in fixture['exchanges']] == ['CurrentTime', 'CurrentTime']
+
+    si = soapreplay.replay(path, host='vc1.example.com')
+    # identical requests are answered in recorded order, the last answer repeats
+    assert [si.CurrentTime() for _ in range(3)] == recorded + recorded[-1:]
+
+
+def test_unknown_request_misses(tmp_path):
+    path, _ = _record(tmp_path, [_current_time('2026-10-19T10:00:00Z')], calls=1)
+    si = soapreplay.replay(path)
+    with pytest.raises(soapreplay.ReplayMiss):
+        si.RetrieveContent()
+
+
+def test_fixture_answers_in_order():
+    fixture = soapreplay.Fixture({'version': soapreplay.FIXTURE_VERSION, 'vimVersion': 'vim.version.version13',
+                                  'exchanges': [{'request': '<a> <b/></a>', 'status': 200, 'response': 'one'},
+                                                {'request': '<a><b/></a>', 'status': 500, 'response': 'two'}]})
+    assert fixture.answer('<a><b/></a>') == (200, 'one')
+    assert fixture.answer('<a>\n  <b/></a>') == (500, 'two')
+    assert fixture.answer('<a><b/></a>') == (500, 'two')
+    with pytest.raises(soapreplay.ReplayMiss):
+        fixture.answer('<c/>')
+
+
+def test_sanitize():
+    text = ('<userName>root</userName><password>secret</password>'
+            '<key>52a1b2c3-d4e5-f607-1829-3a4b5c6d7e8f</key>'
+            '<ipAddress>10.20.30.40</ipAddress><url>https://VC1.example.com/sdk</url>'
+            'vmware_soap_session="52a1b2c3"')
+    clean = soapreplay.sanitize(text, 'vc1.example.com:443')
+    assert '<userName>user</userName>' in clean
+    assert '<password>********</password>' in clean
+    assert '<key>00000000-0000-0000-0000-000000000000</key>' in clean
+    assert '<ipAddress>192.0.2.1</ipAddress>' in clean
+    assert 'vmware_soap_session="0000000000000000"' in clean
+    assert 'https://%s/sdk' % soapreplay.REPLAY_HOST in clean
+    assert not [value for value in ('root', 'secret', '10.20.30.40', '52a1b2c3') if value in clean]
+
+
+def test_sanitize_keeps_versions():
+    text = ('<apiVersion>7.0.3.0</apiVersion><version>7.0.3</version>'
+            '<Envelope xmlns="urn:vim25/7.0.3.0"/><build>19234570</build><ip>192.168.1.300</ip>')
+    assert soapreplay.sanitize(text) == text
@@ -9,11 +9,30 @@ http://www.apache.org/licenses/LICENSE-2.0.html
 from __future__ import print_function
 
 import logging
-from xml.etree.ElementTree import Element
-from xml.etree.ElementTree import SubElement
-from xml.etree.ElementTree import tostring
+import re
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 
-import requests
+from pyVmomi import vim, vmodl
+
+from tools import pchelper, transport
+
+# entities whose triggered alarms are harvested by default
+ALARM_ENTITY_TYPES = (vim.HostSystem, vim.Datastore, vim.VirtualMachine)
+
+_SET_ALARM_STATUS = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soap:Envelope xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body><SetAlarmStatus xmlns="urn:vim25">'
+    '<_this xsi:type="ManagedObjectReference" type="AlarmManager">AlarmManager</_this>'
+    '<alarm type="Alarm">{alarm_moref}</alarm>'
+    '<entity xsi:type="ManagedObjectReference" type="{entity_type}">{entity_moref}</entity>'
+    '<status>{status}</status>'
+    '</SetAlarmStatus></soap:Body></soap:Envelope>')
+
+_FAULT_STRING = re.compile(r'<faultstring>(.*?)</faultstring>', re.S)
 
 
 def reset_alarm(**kwargs):
@@ -68,31 +87,12 @@ def _build_payload(**kwargs):
         raise ValueError("entity_moref, entity_type, and alarm_moref "
                          "must be set")
 
-    attribs = {
-        'xmlns:xsd': 'http://www.w3.org/2001/XMLSchema',
-        'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance',
-        'xmlns:soap': 'http://schemas.xmlsoap.org/soap/envelope/'
-    }
-    root = Element('soap:Envelope', attribs)
-    body = SubElement(root, 'soap:Body')
-    alarm_status = SubElement(body, 'SetAlarmStatus', {'xmlns': 'urn:vim25'})
-    this = SubElement(alarm_status, '_this', {
-        'xsi:type': 'ManagedObjectReference',
-        'type': 'AlarmManager'
-    })
-    this.text = 'AlarmManager'
-    alarm = SubElement(alarm_status, 'alarm', {'type': 'Alarm'})
-    alarm.text = alarm_moref
-    entity = SubElement(alarm_status, 'entity', {
-        'xsi:type': 'ManagedObjectReference',
-        'type': entity_type
-    })
-    entity.text = entity_moref
-    status = SubElement(alarm_status, 'status')
-    status.text = 'green'
-    # I hate hard coding this but I have no idea how to do it any other way
-    # pull requests welcome :)
-    return '<?xml version="1.0" encoding="UTF-8"?>{0}'.format(tostring(root))
+    # The envelope only differs in these values, so it is rendered from a
+    # template instead of being built with ElementTree for every alarm.
+    return _SET_ALARM_STATUS.format(entity_moref=escape(entity_moref),
+                                    entity_type=escape(entity_type),
+                                    alarm_moref=escape(alarm_moref),
+                                    status=escape(kwargs.get("status", "green")))
 
 
 def _send_request(payload=None, session=None):
@@ -105,18 +105,11 @@ def _send_request(payload=None, session=None):
     :return:
     """
     stub = session
-    host_port = stub.host
-    # Ive seen some code in pyvmomi where it seems like we check for http vs
-    # https but since the default is https do people really run it on http?
-    url = 'https://{0}/sdk'.format(host_port)
-    logging.debug("Sending {0} to {1}".format(payload, url))
-    # I opted to ignore invalid ssl here because that happens in pyvmomi.
-    # Once pyvmomi validates ssl it wont take much to make it happen here.
-    res = requests.post(url=url, data=payload, headers={
-        'Cookie': stub.cookie,
-        'SOAPAction': 'urn:vim25',
-        'Content-Type': 'application/xml'
-    }, verify=False)
+    logging.debug("Sending {0} to {1}".format(payload, stub.host))
+    # The requests session of the stub keeps the connection alive, so a
+    # series of resets does not pay a TLS handshake per alarm. Invalid ssl
+    # is ignored there because that happens in pyvmomi.
+    res = transport.post_soap(stub, payload)
     if res.status_code != 200:
         logging.debug("Failed to reset alarm. HTTP Status: {0}".format(
             res.status_code))
@@ -124,6 +117,68 @@ def _send_request(payload=None, session=None):
     return True
 
 
+def _alarm_item(item):
+    """
+    Turns an (entity, alarm) pair or a dict of reset_alarm keyword arguments
+    into {'entity_moref', 'entity_type', 'alarm_moref'}. Entity and alarm can
+    be managed objects or moref strings, an entity given as a string needs
+    its type in a third element.
+    """
+    if isinstance(item, dict):
+        return dict((key, item.get(key)) for key in ('entity_moref', 'entity_type', 'alarm_moref'))
+    entity, alarm = item[0], item[1]
+    if hasattr(entity, '_moId'):
+        entity_moref, entity_type = entity._moId, entity._wsdlName
+    else:
+        entity_moref, entity_type = entity, item[2] if len(item) > 2 else None
+    return {'entity_moref': entity_moref,
+            'entity_type': entity_type,
+            'alarm_moref': getattr(alarm, '_moId', alarm)}
+
+
+def reset_alarms(service_instance, items, workers=8, status='green', timeout=60):
+    """
+    Resets many alarms at once. The envelopes are rendered from one template
+    and posted concurrently, at most workers at a time, over the pooled
+    requests session of the connection, so hundreds of resets share a few
+    kept alive TLS connections.
+
+    Usage:
+    SI = SmartConnect(xxx)
+    results = alarm.reset_alarms(SI, [(host, 'alarm-1'), (datastore, 'alarm-7')])
+
+    :param service_instance:
+    :param items: (entity, alarm) pairs or dicts as taken by reset_alarm
+    :param workers: requests in flight
+    :param status: state the alarms are set to
+    :param timeout: seconds per request
+    :return list: per item, in order, {'entity_moref', 'entity_type',
+                  'alarm_moref', 'ok', 'error'}
+    """
+    stub = transport.soap_stub(service_instance)
+    # grows the pool of the session to the workers, an earlier smaller one is replaced
+    transport.soap_session(stub, pool_size=workers)
+
+    def _reset(item):
+        result = _alarm_item(item)
+        result.update({'ok': False, 'error': None})
+        try:
+            res = transport.post_soap(stub, _build_payload(status=status, **result), timeout=timeout)
+            if res.status_code == 200:
+                result['ok'] = True
+            else:
+                fault = _FAULT_STRING.search(res.text)
+                result['error'] = fault.group(1) if fault else "HTTP Status: {0}".format(res.status_code)
+        except Exception as e:
+            result['error'] = str(e)
+        if not result['ok']:
+            logging.debug("Failed to reset alarm {alarm_moref} on {entity_moref}: {error}".format(**result))
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_reset, items))
+
+
 def print_triggered_alarms(entity=None):
     """
     This is a useful method if you need to print out the alarm morefs
@@ -156,3 +211,193 @@ def get_alarm_refs(entity=None):
         }
         ret.append(tdict)
     return ret
+
+
+def _alarm_record(entity, entity_name, state):
+    return {
+        'entity': entity._moId,
+        'entityType': entity._wsdlName,
+        'entityName': entity_name,
+        'alarm': state.alarm._moId,
+        'key': state.key,
+        'status': state.overallStatus,
+        'time': state.time,
+        'acknowledged': bool(state.acknowledged),
+    }
+
+
+def alarm_names(service_instance, alarm_morefs):
+    """
+    Returns {alarm moref: name} fetched with one retrieval.
+
+    :param alarm_morefs: iterable of alarm moref strings
+    """
+    alarm_morefs = sorted(set(alarm_morefs))
+    if not alarm_morefs:
+        return {}
+    stub = service_instance._stub
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=vim.alarm.Alarm(moref, stub))
+                   for moref in alarm_morefs],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.alarm.Alarm, pathSet=['info.name'])])
+    names = {}
+    for obj in service_instance.content.propertyCollector.RetrieveContents([filter_spec]) or []:
+        for prop in obj.propSet:
+            names[obj.obj._moId] = prop.val
+    return names
+
+
+class TriggeredAlarms(object):
+    """
+    Triggered alarm records indexed by entity and by alarm. A record is
+    {'entity', 'entityType', 'entityName', 'alarm', 'alarmName', 'key',
+    'status', 'time', 'acknowledged'}.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.by_entity = {}
+        self.by_alarm = {}
+        for record in records:
+            self.by_entity.setdefault(record['entity'], []).append(record)
+            self.by_alarm.setdefault(record['alarm'], []).append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def filter(self, statuses=None, since=None, entity_types=None):
+        """
+        Returns the records in a status, triggered at or after since (a
+        datetime) and on entities of the given type names.
+        """
+        return TriggeredAlarms([r for r in self.records
+                                if (not statuses or r['status'] in statuses)
+                                and (since is None or r['time'] >= since)
+                                and (not entity_types or r['entityType'] in entity_types)])
+
+
+def harvest_triggered_alarms(service_instance, types=ALARM_ENTITY_TYPES, page_size=1000):
+    """
+    Collects the triggered alarms of all entities of the given types with one
+    paged PropertyCollector retrieval over a container view, instead of
+    reading triggeredAlarmState entity by entity. The alarm names come from
+    one more retrieval.
+
+    :return TriggeredAlarms:
+    """
+    view = pchelper.get_container_view(service_instance, list(types))
+    try:
+        records = []
+        for props in pchelper.collect_properties_paged(service_instance, view, list(types),
+                                                       ['name', 'triggeredAlarmState'], page_size):
+            for state in props.get('triggeredAlarmState') or []:
+                records.append(_alarm_record(props['obj'], props.get('name'), state))
+    finally:
+        view.Destroy()
+
+    names = alarm_names(service_instance, (r['alarm'] for r in records))
+    for record in records:
+        record['alarmName'] = names.get(record['alarm'])
+    return TriggeredAlarms(records)
+
+
+_ALARM_STATE_ELEMENT = re.compile(r'^triggeredAlarmState\["(.*)"\]$')
+
+
+class _TriggeredStates(object):
+    """
+    Triggered alarm records of the watched entities, kept up to date from the
+    ObjectUpdates of a property collector. vCenter sends triggeredAlarmState
+    whole, or element by element as triggeredAlarmState["alarm-7.host-21"]
+    with op add, assign or remove.
+    """
+
+    def __init__(self):
+        self.entity_names = {}
+        # {entity moref: {alarm state key: record}}
+        self.current = {}
+
+    def apply(self, obj_set):
+        """
+        Applies one ObjectUpdate and returns its [(change, record)].
+        """
+        entity = obj_set.obj
+        old = self.current.get(entity._moId, {})
+        new = {} if obj_set.kind == 'leave' else dict(old)
+        for change in obj_set.changeSet:
+            element = _ALARM_STATE_ELEMENT.match(change.name)
+            if change.name == 'name':
+                self.entity_names[entity._moId] = change.val
+            elif change.name == 'triggeredAlarmState':
+                new = dict((state.key, self._record(entity, state)) for state in change.val or [])
+            elif element and change.op == 'remove':
+                new.pop(element.group(1), None)
+            elif element:
+                new[element.group(1)] = self._record(entity, change.val)
+        if new:
+            self.current[entity._moId] = new
+        else:
+            self.current.pop(entity._moId, None)
+
+        changes = []
+        for key, record in new.items():
+            if key not in old:
+                changes.append(('triggered', record))
+            elif (old[key]['status'], old[key]['acknowledged']) != (record['status'], record['acknowledged']):
+                changes.append(('changed', record))
+        for key, record in old.items():
+            if key not in new:
+                changes.append(('cleared', record))
+        return changes
+
+    def _record(self, entity, state):
+        return _alarm_record(entity, self.entity_names.get(entity._moId), state)
+
+
+def watch_triggered_alarms(service_instance, types=ALARM_ENTITY_TYPES, max_wait=60):
+    """
+    Yields (change, record) as alarms trigger, change status or clear, change
+    being 'triggered', 'changed' or 'cleared'. The alarms triggered when the
+    watch starts come first as 'triggered'. Only the entities whose alarm
+    state changed are sent by vCenter, through WaitForUpdatesEx on a property
+    collector of its own which is destroyed when the generator is closed.
+
+    (None, None) is yielded whenever max_wait seconds pass without a change,
+    so the caller gets a chance to stop.
+    """
+    content = service_instance.content
+    view = pchelper.get_container_view(service_instance, list(types))
+    collector = content.propertyCollector.CreatePropertyCollector()
+    try:
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseEntities', path='view', skip=False, type=view.__class__)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])],
+            propSet=[vmodl.query.PropertyCollector.PropertySpec(type=one_type, pathSet=['name', 'triggeredAlarmState'])
+                     for one_type in types])
+        collector.CreateFilter(filter_spec, True)
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=max_wait)
+
+        version = ''
+        states = _TriggeredStates()
+        names = {}
+        while True:
+            update = collector.WaitForUpdatesEx(version, options)
+            if update is None:
+                yield None, None
+                continue
+            version = update.version
+
+            changes = []
+            for filter_set in update.filterSet:
+                for obj_set in filter_set.objectSet:
+                    changes.extend(states.apply(obj_set))
+
+            unknown = set(record['alarm'] for _, record in changes) - set(names)
+            names.update(alarm_names(service_instance, unknown))
+            for change, record in changes:
+                record['alarmName'] = names.get(record['alarm'])
+                yield change, record
+    finally:
+        collector.Destroy()
+        view.Destroy()
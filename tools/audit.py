@@ -0,0 +1,297 @@
+"""
+Audit trail of FCD operations in a local append only store.
+
+    <root>/audit.jsonl       one JSON record per line, never rewritten
+
+Three sources feed it:
+
+    - harvest_tasks reads the finished tasks of vCenter through a
+      TaskHistoryCollector and keeps the vStorageObjectManager operations
+      (create, delete, snapshot, revert, ...) and the attachDisk / detachDisk
+      of VMs
+    - harvest_events reads the EventEx / ExtendedEvent events of vCenter
+      through an EventHistoryCollector and keeps the ones about FCDs
+    - log() records what the scripts did themselves, e.g. the promotion of
+      mk-fcd, which is a plain call and leaves no task behind, or the vDiskId
+      and snapshot id of a snapshot task, which vCenter does not keep with
+      the task
+
+Both collectors are read in pages of up to 1000 records. Every page is
+appended together with a checkpoint line in one write, so a later run of
+the harvest starts after the last page stored, even after a crash.
+"""
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+from pyVmomi import vim
+
+MAX_BATCH = 1000
+# tasks finishing out of order around the checkpoint are fetched again and dropped
+TASK_OVERLAP = timedelta(minutes=5)
+
+FCD_TASK = re.compile(r'VStorageObjectManager|\battachDisk|\bdetachDisk', re.IGNORECASE)
+FCD_EVENT = re.compile(r'vstorageobject|vslm|fcd|firstclass', re.IGNORECASE)
+
+_CHECKPOINT_PREFIX = '{"checkpoint": '
+_store = None
+_lock = threading.Lock()
+
+
+def _iso(value):
+    """
+    UTC ISO 8601 text of a datetime, naive ones taken as UTC.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return value.isoformat() + 'Z'
+
+
+def _parse(text):
+    return datetime.strptime(text.rstrip('Z').split('.')[0], '%Y-%m-%dT%H:%M:%S')
+
+
+def store_path(root):
+    return os.path.join(root, 'audit.jsonl')
+
+
+def append(root, records, checkpoint=None):
+    """
+    Appends records, and optionally a checkpoint, to the store in one write.
+    """
+    lines = [json.dumps(record, sort_keys=True, default=str) + '\n' for record in records]
+    if checkpoint is not None:
+        lines.append(_CHECKPOINT_PREFIX + json.dumps(checkpoint, sort_keys=True) + '}\n')
+    if not lines:
+        return
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    with _lock:
+        with open(store_path(root), 'a') as store:
+            store.write(''.join(lines))
+            store.flush()
+            os.fsync(store.fileno())
+
+
+def _lines(root):
+    path = store_path(root)
+    if not os.path.exists(path):
+        return
+    with open(path) as store:
+        for line in store:
+            if line.endswith('\n'):
+                yield line
+
+
+def load_checkpoint(root, host):
+    """
+    The last checkpoint stored for host, {} before the first harvest.
+    """
+    checkpoint = {}
+    for line in _lines(root):
+        if line.startswith(_CHECKPOINT_PREFIX):
+            entry = json.loads(line)['checkpoint']
+            if entry.get('host') == host:
+                checkpoint = entry
+    return checkpoint
+
+
+def records(root):
+    for line in _lines(root):
+        if not line.startswith(_CHECKPOINT_PREFIX):
+            yield json.loads(line)
+
+
+def query(root, vdisk_id=None, vm=None, since=None, operation=None):
+    """
+    Records of the store matching all the given criteria, oldest first.
+
+    :param vm: VM name or moId
+    :param since: datetime, naive UTC
+    :param operation: regular expression searched in the operation
+
+    Harvested tasks carry no vDiskId when vCenter does not report one, they
+    are matched through the task key of the records log() wrote for them.
+    """
+    stored = list(records(root))
+    linked = dict((record['task'], record['vDiskId']) for record in stored
+                  if record.get('task') and record.get('vDiskId'))
+
+    selected = []
+    for record in stored:
+        if vdisk_id and (record.get('vDiskId') or linked.get(record.get('task'))) != vdisk_id:
+            continue
+        if vm and vm not in (record.get('vm'), record.get('vmMoId')):
+            continue
+        if since and (not record.get('time') or _parse(record['time']) < since):
+            continue
+        if operation and not re.search(operation, record.get('operation') or '', re.IGNORECASE):
+            continue
+        selected.append(record)
+    return sorted(selected, key=lambda r: r.get('time') or '')
+
+
+def _entity_fields(entity, entity_name):
+    if isinstance(entity, vim.VirtualMachine):
+        return {'vm': entity_name, 'vmMoId': entity._moId}
+    if isinstance(entity, vim.Datastore):
+        return {'datastore': entity_name}
+    return {}
+
+
+def task_record(host, info):
+    record = {'source': 'task', 'host': host, 'key': info.key, 'task': info.task._moId if info.task else info.key,
+              'operation': info.descriptionId, 'state': info.state,
+              'time': _iso(info.completeTime or info.startTime), 'started': _iso(info.startTime),
+              'user': getattr(info.reason, 'userName', None),
+              'error': info.error.msg if info.error else None}
+    record.update(_entity_fields(info.entity, info.entityName))
+    result = info.result
+    if isinstance(result, vim.vslm.VStorageObject):
+        record['vDiskId'] = result.config.id.id
+    elif isinstance(result, vim.vslm.ID):
+        record['snapshotId'] = result.id
+    return record
+
+
+def event_record(host, event):
+    record = {'source': 'event', 'host': host, 'key': event.key,
+              'operation': getattr(event, 'eventTypeId', None) or event.__class__.__name__,
+              'time': _iso(event.createdTime), 'user': event.userName,
+              'message': event.fullFormattedMessage}
+    if event.vm:
+        record.update(vm=event.vm.name, vmMoId=event.vm.vm._moId)
+    if event.ds:
+        record['datastore'] = event.ds.name
+    if FCD_EVENT.search(getattr(event, 'objectType', None) or ''):
+        record['vDiskId'] = event.objectId
+    for argument in getattr(event, 'arguments', None) or []:
+        if re.search(r'(disk|object|vdisk)_?id$', argument.key, re.IGNORECASE) and 'vDiskId' not in record:
+            record['vDiskId'] = str(argument.value)
+        elif re.search(r'snapshot_?id$', argument.key, re.IGNORECASE):
+            record['snapshotId'] = str(argument.value)
+    return record
+
+
+def harvest_tasks(service_instance, root, host, batch=MAX_BATCH):
+    """
+    Appends the FCD tasks finished since the last harvest.
+
+    :return: number of records added
+    """
+    checkpoint = stored = load_checkpoint(root, host)
+    state = checkpoint.get('tasks') or {}
+    latest = _parse(state['time']) if state.get('time') else None
+    # {task key: completion time} of the tasks finished within the overlap of the latest
+    recent = dict(state.get('recent') or {})
+
+    by_time = vim.TaskFilterSpec.ByTime(timeType='completedTime',
+                                        beginTime=latest - TASK_OVERLAP) if latest else None
+    spec = vim.TaskFilterSpec(time=by_time, state=['success', 'error'])
+    collector = service_instance.content.taskManager.CreateCollectorForTasks(spec)
+    added = 0
+    try:
+        collector.RewindCollector()
+        while True:
+            page = collector.ReadNextTasks(min(batch, MAX_BATCH))
+            if not page:
+                break
+            found = []
+            for info in page:
+                if info.key in recent or not FCD_TASK.search(info.descriptionId or ''):
+                    continue
+                record = task_record(host, info)
+                found.append(record)
+                recent[info.key] = record['time']
+                if latest is None or _parse(record['time']) > latest:
+                    latest = _parse(record['time'])
+            if latest is not None:
+                recent = dict((key, time) for key, time in recent.items()
+                              if _parse(time) >= latest - TASK_OVERLAP)
+                checkpoint = dict(checkpoint, host=host, tasks={'time': _iso(latest), 'recent': recent})
+            if found or checkpoint != stored:
+                append(root, found, checkpoint)
+                stored = checkpoint
+            added += len(found)
+    finally:
+        collector.DestroyCollector()
+    return added
+
+
+def harvest_events(service_instance, root, host, batch=MAX_BATCH):
+    """
+    Appends the FCD events logged since the last harvest.
+
+    :return: number of records added
+    """
+    checkpoint = stored = load_checkpoint(root, host)
+    state = checkpoint.get('events') or {}
+    last_key = state.get('key', -1)
+
+    by_time = vim.event.EventFilterSpec.ByTime(beginTime=_parse(state['time'])) if state.get('time') else None
+    spec = vim.event.EventFilterSpec(time=by_time, type=[vim.event.EventEx, vim.event.ExtendedEvent])
+    collector = service_instance.content.eventManager.CreateCollectorForEvents(spec)
+    added = 0
+    try:
+        collector.RewindCollector()
+        while True:
+            page = collector.ReadNextEvents(min(batch, MAX_BATCH))
+            if not page:
+                break
+            found = []
+            for event in page:
+                if event.key <= last_key:
+                    continue
+                state = {'key': event.key, 'time': _iso(event.createdTime)}
+                last_key = event.key
+                identity = ' '.join(str(part) for part in (getattr(event, 'eventTypeId', ''),
+                                                           getattr(event, 'objectType', '')))
+                if FCD_EVENT.search(identity):
+                    found.append(event_record(host, event))
+            checkpoint = dict(checkpoint, host=host, events=state)
+            if found or checkpoint != stored:
+                append(root, found, checkpoint)
+                stored = checkpoint
+            added += len(found)
+    finally:
+        collector.DestroyCollector()
+    return added
+
+
+def add_arguments(parser):
+    parser.add_argument('-audit', default=os.environ.get('FCD_AUDIT'),
+                        help='Directory of the audit store the operations are recorded in, default $FCD_AUDIT')
+    return parser
+
+
+def use(root, host=None):
+    """
+    Makes log() record into the store at root, None turns it off.
+    """
+    global _store
+    _store = (root, host) if root else None
+
+
+def log(operation, **fields):
+    """
+    Records an operation the script performed, when a store is in use.
+    Tasks and managed objects are stored as their moId, a VM given as vm by
+    its name and moId.
+    """
+    if _store is None:
+        return
+    root, host = _store
+    record = {'source': 'local', 'host': host, 'operation': operation, 'state': 'success',
+              'time': datetime.utcnow().isoformat() + 'Z'}
+    for name, value in fields.items():
+        if name == 'vm' and isinstance(value, vim.VirtualMachine):
+            record['vmMoId'] = value._moId
+            value = value.name
+        elif isinstance(value, (vim.Task, vim.ManagedEntity)):
+            value = value._moId
+        record[name] = value
+    append(root, [record])
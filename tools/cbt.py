@@ -0,0 +1,201 @@
+"""
+Changed block export between FCD snapshots.
+
+The disk areas that changed between two snapshots of an FCD are found with
+QueryChangedDiskAreas, using the changed block tracking id of the older
+snapshot (RetrieveSnapshotDetails). Only those extents are read from the disk
+and written to a data file. A JSON manifest next to it records where every
+extent belongs, its checksum and the export it was taken on top of, so the
+full disk can be rebuilt from a base export plus the chain of incrementals.
+
+The vSphere API gives the changed areas but not the disk contents. These are
+read through an extent reader, e.g. FileExtentReader on the block device of
+the snapshot disk hot-added to a backup proxy, or on a full image.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from pyVmomi import vim
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest.json'
+DATA_SUFFIX = '.extents'
+
+# reads are done in pieces of at most this size, whatever the extent length
+READ_SIZE = 4 * 1024 * 1024
+
+
+def _vslm_id(value):
+    id_object = vim.vslm.ID()
+    id_object.id = value
+    return id_object
+
+
+def disk_capacity(content, vdisk_id, ds_obj):
+    """
+    Returns the capacity of the FCD in bytes.
+    """
+    vstorage = content.vStorageObjectManager.RetrieveVStorageObject(_vslm_id(vdisk_id), ds_obj)
+    return vstorage.config.capacityInMB * 1024 * 1024
+
+
+def snapshot_change_id(content, vdisk_id, ds_obj, snapshot_id):
+    """
+    Returns the changed block tracking id recorded when the snapshot was taken.
+    """
+    details = content.vStorageObjectManager.RetrieveSnapshotDetails(
+        _vslm_id(vdisk_id), ds_obj, _vslm_id(snapshot_id))
+    if not details.changedBlockTrackingId:
+        raise RuntimeError("Snapshot %s of FCD %s has no changed block tracking id, "
+                           "is changed block tracking enabled on the disk?" % (snapshot_id, vdisk_id))
+    return details.changedBlockTrackingId
+
+
+def query_changed_areas(content, vdisk_id, ds_obj, snapshot_id, change_id, capacity):
+    """
+    Returns the (offset, length) areas of the snapshot which changed since
+    change_id, adjacent areas merged. change_id '*' returns every allocated
+    area, which is what a full export needs.
+    """
+    manager = content.vStorageObjectManager
+    areas = []
+    offset = 0
+    while offset < capacity:
+        info = manager.QueryChangedDiskAreas(_vslm_id(vdisk_id), ds_obj, _vslm_id(snapshot_id),
+                                             offset, change_id)
+        for area in info.changedArea or []:
+            if areas and areas[-1][0] + areas[-1][1] == area.start:
+                areas[-1] = (areas[-1][0], areas[-1][1] + area.length)
+            else:
+                areas.append((area.start, area.length))
+        if info.length <= 0:
+            break
+        offset = info.startOffset + info.length
+    return areas
+
+
+class FileExtentReader(object):
+    """
+    Reads extents from a local file or block device holding the disk contents
+    of the snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+
+    def read(self, offset, length):
+        self._file.seek(offset)
+        data = self._file.read(length)
+        if len(data) != length:
+            raise IOError("Short read of %s bytes at offset %s from %s" % (length, offset, self.path))
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def export_extents(reader, areas, target_dir, name, meta, parent=None):
+    """
+    Streams the areas from the reader into <name>.extents and writes
+    <name>.manifest.json next to it.
+
+    :param reader: object with read(offset, length)
+    :param areas: (offset, length) list as returned by query_changed_areas
+    :param meta: dict stored in the manifest (vDiskId, snapshot ids, capacity, ...)
+    :param parent: file name of the manifest this export applies on top of,
+                   None for a full export
+    :return: path of the manifest
+    """
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+
+    data_name = name + DATA_SUFFIX
+    extents = []
+    data_offset = 0
+    with open(os.path.join(target_dir, data_name), 'wb') as data_file:
+        for offset, length in areas:
+            digest = hashlib.sha256()
+            done = 0
+            while done < length:
+                piece = reader.read(offset + done, min(READ_SIZE, length - done))
+                data_file.write(piece)
+                digest.update(piece)
+                done += len(piece)
+            extents.append([offset, length, data_offset, digest.hexdigest()])
+            data_offset += length
+
+    manifest = dict(meta)
+    manifest.update({
+        'version': MANIFEST_VERSION,
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'parent': parent,
+        'data': data_name,
+        'bytes': data_offset,
+        'extents': extents,
+    })
+    manifest_path = os.path.join(target_dir, name + MANIFEST_SUFFIX)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    # the manifest only shows up once the data it describes is complete
+    os.rename(manifest_path + '.tmp', manifest_path)
+    return manifest_path
+
+
+def load_manifest(path):
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("%s has unsupported manifest version %s" % (path, manifest.get('version')))
+    return manifest
+
+
+def manifest_chain(path):
+    """
+    Returns the manifest paths from the full export up to the given one.
+    """
+    chain = []
+    while path:
+        chain.append(path)
+        parent = load_manifest(path)['parent']
+        path = os.path.join(os.path.dirname(path), parent) if parent else None
+        if path in chain:
+            raise ValueError("Manifest chain of %s loops" % chain[0])
+    chain.reverse()
+    return chain
+
+
+def rebuild_disk(manifest_path, target, verify=True):
+    """
+    Rebuilds the full disk image of the snapshot described by the manifest by
+    applying the full export and every incremental on top of it, in order.
+    Areas never written stay sparse in the target file.
+
+    :return: number of bytes written
+    """
+    chain = manifest_chain(manifest_path)
+    capacity = load_manifest(manifest_path)['capacity']
+    written = 0
+    with open(target, 'wb') as target_file:
+        target_file.truncate(capacity)
+        for path in chain:
+            manifest = load_manifest(path)
+            with open(os.path.join(os.path.dirname(path), manifest['data']), 'rb') as data_file:
+                for offset, length, data_offset, sha256 in manifest['extents']:
+                    data_file.seek(data_offset)
+                    target_file.seek(offset)
+                    digest = hashlib.sha256()
+                    done = 0
+                    while done < length:
+                        piece = data_file.read(min(READ_SIZE, length - done))
+                        if not piece:
+                            raise IOError("%s ends before extent at %s" % (manifest['data'], offset))
+                        target_file.write(piece)
+                        digest.update(piece)
+                        done += len(piece)
+                    if verify and digest.hexdigest() != sha256:
+                        raise IOError("Checksum mismatch for extent at %s in %s" % (offset, manifest['data']))
+                    written += length
+    return written
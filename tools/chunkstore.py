@@ -0,0 +1,205 @@
+"""
+Content addressed, deduplicating store for exported FCD snapshots.
+
+An exported disk image is cut into content defined chunks and every chunk is
+stored once under its sha256:
+
+    <root>/objects/ab/abcdef...          chunk data
+    <root>/manifests/<vDiskId>/<snapshot id>.json
+                                         ordered chunk list of one snapshot
+
+Chunk boundaries are decided per 4 KB disk block: a chunk ends after a block
+whose crc32 matches the boundary mask, within a minimum and maximum chunk
+size. Disk data moves in whole blocks, so this finds the same chunks again
+after data shifts while zlib.crc32 keeps the scan at C speed.
+
+The image is split into large fixed segments which are chunked, hashed and
+written by a pool of processes, one segment each, so all cores take part.
+Chunking restarts at every segment start, which keeps the result
+independent of the number of workers.
+"""
+import hashlib
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+BLOCK_SIZE = 4096
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 1024 * 1024
+# one block in 64 ends a chunk, about 256 KB per chunk on top of the minimum
+BOUNDARY_MASK = 0x3f
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def _object_path(root, sha256):
+    return os.path.join(root, 'objects', sha256[:2], sha256)
+
+
+def _manifest_path(root, vdisk_id, snapshot_id):
+    return os.path.join(root, 'manifests', vdisk_id, snapshot_id + '.json')
+
+
+def _write_object(root, sha256, data):
+    """
+    Stores a chunk unless it is there already. Returns the bytes written.
+    """
+    path = _object_path(root, sha256)
+    if os.path.exists(path):
+        return 0
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another worker created it first
+            pass
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as object_file:
+        object_file.write(data)
+    os.rename(tmp, path)
+    return len(data)
+
+
+def chunk_segment(root, source, offset, length):
+    """
+    Chunks and stores one segment of the source file.
+
+    :return: ([(sha256, length), ...], bytes newly stored)
+    """
+    chunks = []
+    stored = 0
+    with open(source, 'rb') as source_file:
+        source_file.seek(offset)
+        segment = source_file.read(length)
+
+    view = memoryview(segment)
+    start = 0
+    pos = 0
+    end = len(segment)
+    while pos < end:
+        block_end = min(pos + BLOCK_SIZE, end)
+        size = block_end - start
+        if size >= MAX_CHUNK or block_end == end or \
+                (size >= MIN_CHUNK and zlib.crc32(view[pos:block_end]) & BOUNDARY_MASK == 0):
+            data = view[start:block_end]
+            sha256 = hashlib.sha256(data).hexdigest()
+            stored += _write_object(root, sha256, data)
+            chunks.append((sha256, size))
+            start = block_end
+        pos = block_end
+    return chunks, stored
+
+
+def ingest(root, source, vdisk_id, snapshot_id, meta=None, workers=None):
+    """
+    Adds the disk image in source to the store as the given FCD snapshot.
+
+    :param meta: extra manifest fields, e.g. description and createTime from
+                 RetrieveSnapshotInfo
+    :param workers: number of processes, defaults to the number of cores
+    :return: the manifest
+    """
+    size = os.path.getsize(source)
+    segments = [(offset, min(SEGMENT_SIZE, size - offset)) for offset in range(0, size, SEGMENT_SIZE)]
+
+    chunks = []
+    stored = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(chunk_segment, root, source, offset, length) for offset, length in segments]
+        for future in futures:
+            segment_chunks, segment_stored = future.result()
+            chunks.extend(segment_chunks)
+            stored += segment_stored
+
+    manifest = dict(meta or {})
+    manifest.update({
+        'vDiskId': vdisk_id,
+        'snapshotId': snapshot_id,
+        'size': size,
+        'stored': stored,
+        'ingested': datetime.utcnow().isoformat() + 'Z',
+        'chunks': chunks,
+    })
+    path = _manifest_path(root, vdisk_id, snapshot_id)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.rename(path + '.tmp', path)
+    return manifest
+
+
+def load_manifest(root, vdisk_id, snapshot_id):
+    with open(_manifest_path(root, vdisk_id, snapshot_id)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def list_snapshots(root, vdisk_id):
+    """
+    Returns the snapshot ids of the FCD held in the store.
+    """
+    directory = os.path.join(root, 'manifests', vdisk_id)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+
+
+def restore(root, vdisk_id, snapshot_id, out, verify=True):
+    """
+    Streams the disk image of the snapshot to the writable file object out,
+    one chunk in memory at a time.
+
+    :return: number of bytes written
+    """
+    written = 0
+    for sha256, length in load_manifest(root, vdisk_id, snapshot_id)['chunks']:
+        with open(_object_path(root, sha256), 'rb') as object_file:
+            data = object_file.read()
+        if len(data) != length or (verify and hashlib.sha256(data).hexdigest() != sha256):
+            raise IOError("Chunk %s of snapshot %s is damaged" % (sha256, snapshot_id))
+        out.write(data)
+        written += length
+    return written
+
+
+def stats(root):
+    """
+    Returns logical bytes of all snapshots, bytes actually stored and the
+    number of unique chunks.
+    """
+    logical = 0
+    referenced = set()
+    manifests = os.path.join(root, 'manifests')
+    for vdisk_id in (os.listdir(manifests) if os.path.isdir(manifests) else []):
+        for snapshot_id in list_snapshots(root, vdisk_id):
+            manifest = load_manifest(root, vdisk_id, snapshot_id)
+            logical += manifest['size']
+            referenced.update((sha256, length) for sha256, length in manifest['chunks'])
+    return {'logical': logical,
+            'stored': sum(length for _, length in referenced),
+            'chunks': len(referenced)}
+
+
+def remove_snapshot(root, vdisk_id, snapshot_id):
+    """
+    Drops a snapshot from the store and deletes the chunks no other snapshot uses.
+
+    :return: number of chunks deleted
+    """
+    os.remove(_manifest_path(root, vdisk_id, snapshot_id))
+    referenced = set()
+    manifests = os.path.join(root, 'manifests')
+    for other_disk in os.listdir(manifests):
+        for other_snapshot in list_snapshots(root, other_disk):
+            referenced.update(sha256 for sha256, _ in load_manifest(root, other_disk, other_snapshot)['chunks'])
+
+    deleted = 0
+    objects = os.path.join(root, 'objects')
+    for prefix in os.listdir(objects):
+        for sha256 in os.listdir(os.path.join(objects, prefix)):
+            if sha256 not in referenced and not sha256.endswith('.tmp'):
+                os.remove(os.path.join(objects, prefix, sha256))
+                deleted += 1
+    return deleted
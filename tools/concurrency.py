@@ -0,0 +1,183 @@
+"""
+Adaptive concurrency control for bulk FCD operations.
+
+Every operation takes a slot from the global limit and, when known, from the
+limit of the datastore backing the disk and of the host running the VM. Each
+limit follows AIMD: it grows by about one slot per window of successful
+operations and is cut in half when the task latency climbs well above the
+best latency seen or vCenter answers with a busy fault such as TaskInProgress.
+The configured values are upper bounds, the limits never grow past them.
+
+The best latency is kept per operation type, a revert taking longer than a
+snapshot create is no sign of congestion in a mixed workload.
+
+Usage:
+    controller = ConcurrencyController(global_limit=16, datastore_limit=4)
+    with controller.slot(datastore='ds1', host='esx1', operation='snapshot'):
+        task = content.vStorageObjectManager.VStorageObjectCreateSnapshot_Task(...)
+        tasks.wait_for_tasks(si, [task])
+"""
+import threading
+import time
+
+from tools.resilience import BUSY_FAULTS
+
+
+class AIMDLimit(object):
+    """
+    One additive increase / multiplicative decrease limit.
+    """
+
+    def __init__(self, name, max_limit, min_limit=1, initial=None,
+                 decrease_factor=0.5, latency_tolerance=2.0, latency_target=None):
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(initial if initial is not None else max(self.min_limit, max_limit // 2))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_target = latency_target
+        self.in_flight = 0
+        # best latency seen, per operation type
+        self.baselines = {}
+        self.last_decrease = 0.0
+
+    def has_room(self):
+        return self.in_flight < int(self.limit)
+
+    def on_success(self, latency, operation=None):
+        # keep the best latency seen, slowly forgetting it so the baseline
+        # follows the storage when it gets permanently slower
+        baseline = self.baselines.get(operation)
+        if baseline is None or latency < baseline:
+            baseline = latency
+        else:
+            baseline += (latency - baseline) * 0.01
+        self.baselines[operation] = baseline
+
+        target = self.latency_target or baseline * self.latency_tolerance
+        if latency > target:
+            self.on_congestion(latency)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_congestion(self, latency=0.0):
+        # cut at most once per observed latency so a burst of slow completions
+        # started under the old limit only counts once
+        now = time.time()
+        if now - self.last_decrease < latency:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def __repr__(self):
+        return "%s: limit %.1f/%s, in flight %s" % (self.name, self.limit, self.max_limit, self.in_flight)
+
+
+class ConcurrencyController(object):
+    """
+    Hands out slots under a global, per datastore and per host AIMD limit.
+    """
+
+    def __init__(self, global_limit=16, datastore_limit=4, host_limit=8, latency_target=None):
+        self.datastore_limit = datastore_limit
+        self.host_limit = host_limit
+        self.latency_target = latency_target
+        self.global_limit = AIMDLimit('global', global_limit, latency_target=latency_target)
+        self.limits = {}
+        self._cond = threading.Condition()
+
+    def _get_limits(self, datastore, host, source=None):
+        limits = [self.global_limit]
+        for kind, name, max_limit in (('datastore', datastore, self.datastore_limit),
+                                      ('datastore', source, self.datastore_limit),
+                                      ('host', host, self.host_limit)):
+            if name:
+                key = '%s:%s' % (kind, name)
+                if key not in self.limits:
+                    self.limits[key] = AIMDLimit(key, max_limit, latency_target=self.latency_target)
+                if self.limits[key] not in limits:
+                    limits.append(self.limits[key])
+        return limits
+
+    def slot(self, datastore=None, host=None, source=None, operation=None):
+        """
+        Blocks until every limit the operation falls under has room, then
+        runs the body and feeds its latency or busy fault back to the limits.
+
+        :param source: datastore the operation reads from, e.g. the source
+                       of a clone, it takes a slot of that datastore too
+        :param operation: type of the operation, its latency is compared
+                          with the best latency of the same type only
+        """
+        return _Slot(self, datastore, host, source, operation)
+
+    def _acquire(self, datastore, host, source):
+        with self._cond:
+            limits = self._get_limits(datastore, host, source)
+            while not all(limit.has_room() for limit in limits):
+                self._cond.wait()
+            for limit in limits:
+                limit.in_flight += 1
+        return limits
+
+    def _release(self, limits, feedback):
+        with self._cond:
+            for limit in limits:
+                limit.in_flight -= 1
+                if feedback:
+                    feedback(limit)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Returns the current limits, useful for the end of run report.
+        """
+        with self._cond:
+            return [repr(self.global_limit)] + [repr(l) for _, l in sorted(self.limits.items())]
+
+
+class _Slot(object):
+    """
+    Context of ConcurrencyController.slot. A class and not a generator, a
+    pyVmomi fault thrown into a generator context fails on the __traceback__
+    the context sets on it.
+    """
+
+    def __init__(self, controller, datastore, host, source, operation):
+        self.controller = controller
+        self.where = (datastore, host, source)
+        self.operation = operation
+        self.limits = None
+        self.started = None
+
+    def __enter__(self):
+        self.limits = self.controller._acquire(*self.where)
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        latency = time.time() - self.started
+        if exc_type is None:
+            self.controller._release(self.limits, lambda limit: limit.on_success(latency, self.operation))
+        elif issubclass(exc_type, BUSY_FAULTS):
+            self.controller._release(self.limits, lambda limit: limit.on_congestion(latency))
+        else:
+            self.controller._release(self.limits, None)
+        return False
+
+
+class _NoSlot(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+def slot_or_null(controller, **where):
+    """
+    controller.slot(**where), a context doing nothing without a controller.
+    """
+    return controller.slot(**where) if controller else _NoSlot()
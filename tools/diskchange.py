@@ -0,0 +1,254 @@
+"""
+Bulk attach and detach of FCDs, one ReconfigVM_Task per VM.
+
+AttachDisk_Task and DetachDisk_Task move one disk per task. Here the disks
+are grouped by VM and every group goes in a single device change spec:
+
+    - detaching removes the disk device and keeps its file, the FCD stays
+      registered, as DetachDisk_Task does
+    - attaching adds a disk device backed by the file of the FCD, on a free
+      controller slot picked from the device list unless one is given
+    - all detaches run before the attaches, so a disk moving from one VM to
+      another is free when it is attached, and is not attached when its
+      detach failed. A disk whose attach fails after its detach worked is
+      attached back to the VM and slot it came from
+    - the VMs of a phase are reconfigured in parallel, each on a session of
+      a SessionPool and, when a ConcurrencyController is given, in a slot
+      of the host running the VM
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim, vmodl
+
+from tools import concurrency, pchelper, resilience, sessionpool
+
+# controller types disks go on, with the number of units of one controller, in order of preference
+CONTROLLER_UNITS = ((vim.vm.device.VirtualSCSIController, 16),
+                    (vim.vm.device.VirtualNVMEController, 15),
+                    (vim.vm.device.VirtualAHCIController, 30))
+
+
+def fetch_devices(service_instance, vm_objs):
+    """
+    {VM moId: (name, devices, host moId)} of the VMs, in one PropertyCollector call.
+    """
+    if not vm_objs:
+        return {}
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=vm_obj) for vm_obj in vm_objs],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                                            pathSet=['name', 'config.hardware.device',
+                                                                     'runtime.host'])])
+    return dict((props['obj']._moId, (props.get('name'), props.get('config.hardware.device') or [],
+                                      props['runtime.host']._moId if props.get('runtime.host') else None))
+                for props in pchelper.retrieve_paged(service_instance.content.propertyCollector, filter_spec))
+
+
+def free_slots(devices):
+    """
+    (controllerKey, unitNumber) pairs no device uses, controller by controller.
+    """
+    used = set((dev.controllerKey, dev.unitNumber) for dev in devices if dev.controllerKey is not None)
+    slots = []
+    for controller_type, units in CONTROLLER_UNITS:
+        for controller in sorted((dev for dev in devices if isinstance(dev, controller_type)),
+                                 key=lambda dev: dev.key):
+            # a SCSI controller takes a unit of its own bus, 7 by default
+            reserved = getattr(controller, 'scsiCtlrUnitNumber', None)
+            slots.extend((controller.key, unit) for unit in range(units)
+                         if unit != reserved and (controller.key, unit) not in used)
+    return slots
+
+
+def _vslm_id(value):
+    id_object = vim.vslm.ID()
+    id_object.id = value
+    return id_object
+
+
+def _fail(changes, error):
+    for change in changes:
+        change['ok'], change['error'] = False, error
+
+
+def disk_file(content, vdisk_id, ds_obj):
+    """
+    (file path, capacity in MB) of the FCD.
+    """
+    vstorage = content.vStorageObjectManager.RetrieveVStorageObject(_vslm_id(vdisk_id), ds_obj)
+    return vstorage.config.backing.filePath, vstorage.config.capacityInMB
+
+
+def detach_spec(devices, changes):
+    """
+    ConfigSpec removing the disks of the changes from the VM, their files
+    kept. A change whose disk is not attached to the VM fails on its own,
+    None when no change is left.
+    """
+    by_id = dict((dev.vDiskId.id, dev) for dev in devices
+                 if isinstance(dev, vim.vm.device.VirtualDisk) and dev.vDiskId)
+    _fail([change for change in changes if change['vDiskId'] not in by_id], "the FCD is not attached to the VM")
+    for change in changes:
+        if change['vDiskId'] in by_id:
+            # where the disk was, to attach it back there when its move fails
+            change['controllerKey'] = by_id[change['vDiskId']].controllerKey
+            change['unitNumber'] = by_id[change['vDiskId']].unitNumber
+    device_change = [vim.vm.device.VirtualDeviceSpec(operation=vim.vm.device.VirtualDeviceSpec.Operation.remove,
+                                                     device=by_id[change['vDiskId']])
+                     for change in changes if change['vDiskId'] in by_id]
+    return vim.vm.ConfigSpec(deviceChange=device_change) if device_change else None
+
+
+def attach_spec(devices, changes):
+    """
+    ConfigSpec adding the disks of the changes to the VM. Changes without
+    'controllerKey' and 'unitNumber' get a free slot, which is written back
+    to them.
+
+    :param changes: [{'vDiskId', 'fileName', 'capacityInMB', 'datastore'}]
+    :raise ValueError: when the controllers of the VM have too few free slots
+    """
+    taken = set((change.get('controllerKey'), change.get('unitNumber')) for change in changes)
+    slots = [slot for slot in free_slots(devices) if slot not in taken]
+    unplaced = len([change for change in changes if change.get('controllerKey') is None])
+    if unplaced > len(slots):
+        raise ValueError("the VM has %d free controller slots for %d disks" % (len(slots), unplaced))
+    device_change = []
+    for number, change in enumerate(changes):
+        if change.get('controllerKey') is None:
+            change['controllerKey'], change['unitNumber'] = slots.pop(0)
+        backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo(fileName=change['fileName'], diskMode='persistent',
+                                                               datastore=change['datastore'])
+        # negative keys are placeholders, vCenter numbers the new devices
+        disk = vim.vm.device.VirtualDisk(key=-(number + 1), backing=backing, controllerKey=change['controllerKey'],
+                                         unitNumber=change['unitNumber'],
+                                         capacityInKB=change['capacityInMB'] * 1024)
+        device_change.append(vim.vm.device.VirtualDeviceSpec(operation=vim.vm.device.VirtualDeviceSpec.Operation.add,
+                                                             device=disk))
+    return vim.vm.ConfigSpec(deviceChange=device_change)
+
+
+def _groups(changes):
+    groups = {}
+    for change in changes:
+        groups.setdefault(change['vm']._moId, []).append(change)
+    return groups
+
+
+def _reconfigure(pool, vm_changes, build_spec, workers, on_done, controller=None):
+    """
+    One ReconfigVM_Task per VM with the spec build_spec(devices, changes), VMs in parallel.
+    """
+    groups = _groups(vm_changes)
+    if not groups:
+        return
+    try:
+        with pool.checkout() as session:
+            devices = fetch_devices(session.si, [sessionpool.rebind(changes[0]['vm'], session.si)
+                                                 for changes in groups.values()])
+    except Exception:
+        # read again VM by VM below, so only the VMs which fail to answer lose their changes
+        devices = None
+
+    def _apply(item):
+        moid, changes = item
+        try:
+            if devices is None:
+                with pool.checkout() as session:
+                    vm_devices = fetch_devices(session.si, [sessionpool.rebind(changes[0]['vm'], session.si)])
+            else:
+                vm_devices = devices
+            if moid not in vm_devices:
+                raise ValueError("the VM is not found")
+            spec = build_spec(vm_devices[moid][1], changes)
+            if spec is not None:
+                with concurrency.slot_or_null(controller, host=vm_devices[moid][2]), pool.checkout() as session:
+                    task = sessionpool.rebind(changes[0]['vm'], session.si).ReconfigVM_Task(spec)
+                    resilience.wait_for_tasks(session.si, [task])
+                for change in changes:
+                    if 'ok' not in change:
+                        change['ok'], change['error'], change['task'] = True, None, task._moId
+        except Exception as e:
+            _fail([change for change in changes if 'ok' not in change], resilience.fault_message(e))
+        if on_done:
+            for change in changes:
+                on_done(change)
+
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        list(threads.map(_apply, groups.items()))
+
+
+def _files(pool, changes, workers):
+    """
+    Sets 'fileName' and 'capacityInMB' of the attaches, fails those whose FCD cannot be read.
+    """
+    def _file(change):
+        try:
+            with pool.checkout() as session:
+                change['fileName'], change['capacityInMB'] = disk_file(
+                    session.content, change['vDiskId'], sessionpool.rebind(change['datastore'], session.si))
+        except Exception as e:
+            _fail([change], resilience.fault_message(e))
+
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        list(threads.map(_file, changes))
+    return [change for change in changes if 'ok' not in change]
+
+
+def _attach_back(pool, detaches, attaches, workers, controller):
+    """
+    Attaches the FCDs whose detach worked but whose attach failed back to
+    the VM and slot they were detached from, and says so in the error of
+    the failed attach.
+    """
+    detached = dict((change['vDiskId'], change) for change in detaches if change['ok'])
+    failed = [change for change in attaches if not change['ok'] and change['vDiskId'] in detached]
+    if not failed:
+        return
+    back = [{'op': 'attach', 'vm': detached[change['vDiskId']]['vm'], 'vDiskId': change['vDiskId'],
+             'datastore': change['datastore'], 'controllerKey': detached[change['vDiskId']]['controllerKey'],
+             'unitNumber': detached[change['vDiskId']]['unitNumber']} for change in failed]
+    _reconfigure(pool, _files(pool, back, workers), attach_spec, workers, None, controller)
+    for change, undo in zip(failed, back):
+        if undo['ok']:
+            change['error'] += ', the FCD is attached back to the VM it was detached from'
+        else:
+            change['error'] += ', the FCD stays detached : %s' % undo['error']
+        change['attachedBack'] = undo['ok']
+
+
+def run(pool, changes, workers=8, on_done=None, controller=None):
+    """
+    Applies the changes and returns them with 'ok' and 'error' set. An FCD
+    whose detach worked but whose attach failed, e.g. a move to a VM without
+    a free slot, is attached back where it was, 'attachedBack' of the failed
+    attach tells whether that worked.
+
+    :param pool: sessionpool.SessionPool the calls run on
+    :param changes: [{'op': 'attach' or 'detach', 'vm': vim.VirtualMachine,
+                    'vDiskId', 'datastore': vim.Datastore of the FCD}],
+                    attaches may carry 'controllerKey' and 'unitNumber'
+    :param on_done: callable(change) run after every change
+    :param controller: concurrency.ConcurrencyController the reconfigures
+                       take a slot of, per host of the VM
+    """
+    detaches = [change for change in changes if change['op'] == 'detach']
+    attaches = [change for change in changes if change['op'] == 'attach']
+
+    _reconfigure(pool, detaches, detach_spec, workers, on_done, controller)
+
+    failed = set(change['vDiskId'] for change in detaches if not change['ok'])
+    for change in attaches:
+        if change['vDiskId'] in failed:
+            _fail([change], "the FCD was not detached")
+            if on_done:
+                on_done(change)
+    attaches = [change for change in attaches if change['vDiskId'] not in failed]
+
+    # on_done of the attaches waits for the attach back of the failed ones
+    _reconfigure(pool, _files(pool, attaches, workers), attach_spec, workers, None, controller)
+    _attach_back(pool, detaches, attaches, workers, controller)
+    if on_done:
+        for change in attaches:
+            on_done(change)
+    return changes
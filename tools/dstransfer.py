@@ -0,0 +1,276 @@
+"""
+Parallel ranged transfers over the datastore HTTP endpoint
+(https://<vc>/folder/<path>?dcPath=<dc>&dsName=<ds>).
+
+Downloads are split into fixed size chunks fetched with Range requests by a
+pool of workers sharing one keep-alive connection pool. Chunks are written in
+place into a preallocated target file. Every finished chunk is recorded with
+its sha256 in a <target>.transfer.json state file, so an interrupted download
+resumes with the missing chunks only. The state file also keeps the URL, the
+size and the ETag or Last-Modified of the remote file, a download of another
+or a changed file starts over.
+
+The endpoint accepts no ranged PUT, so an upload is one streamed request per
+file, sent with its Content-Length; uploads of several files run in parallel.
+
+Nothing here is specific to vCenter apart from the session cookie, so the
+functions work against any HTTP server honouring Range, e.g. a local one
+standing in for the datastore browser in tests.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+STATE_SUFFIX = '.transfer.json'
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def datastore_url(host, dc_name, ds_name, path, scheme='https'):
+    """
+    URL of a file on a datastore, path relative to the datastore root.
+    """
+    return "%s://%s/folder/%s?dcPath=%s&dsName=%s" % (
+        scheme, host, quote(path.lstrip('/')), quote(dc_name), quote(ds_name))
+
+
+def split_datastore_path(ds_path):
+    """
+    '[ds1] fcd/abc.vmdk' -> ('ds1', 'fcd/abc.vmdk')
+    """
+    if not ds_path.startswith('[') or ']' not in ds_path:
+        raise ValueError("%s is not a datastore path" % ds_path)
+    ds_name, path = ds_path[1:].split(']', 1)
+    return ds_name, path.strip()
+
+
+def build_session(service_instance=None, pool_size=8, verify=False):
+    """
+    requests.Session with a connection pool sized for pool_size workers,
+    authenticated with the vCenter session cookie when a service instance
+    is given.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = verify
+    if service_instance is not None:
+        session.headers['Cookie'] = service_instance._stub.cookie
+    return session
+
+
+def _validator(headers):
+    return headers.get('ETag') or headers.get('Last-Modified')
+
+
+def remote_info(session, url):
+    """
+    (size, ETag or Last-Modified, None when the server sends neither) of a remote file.
+    """
+    res = session.head(url, allow_redirects=True)
+    if res.status_code == 200 and res.headers.get('Content-Length'):
+        return int(res.headers['Content-Length']), _validator(res.headers)
+    # some servers do not answer HEAD, ask for the first byte instead
+    res = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True)
+    try:
+        res.raise_for_status()
+        if res.status_code == 206 and '/' in res.headers.get('Content-Range', ''):
+            return int(res.headers['Content-Range'].rsplit('/', 1)[1]), _validator(res.headers)
+        return int(res.headers['Content-Length']), _validator(res.headers)
+    finally:
+        res.close()
+
+
+def remote_size(session, url):
+    return remote_info(session, url)[0]
+
+
+class _TransferState(object):
+    """
+    Chunks done so far, persisted after every chunk.
+    """
+
+    def __init__(self, path, url, size, chunk_size, validator=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {'url': url, 'size': size, 'chunk_size': chunk_size, 'validator': validator, 'chunks': {}}
+        if os.path.exists(path):
+            with open(path) as state_file:
+                saved = json.load(state_file)
+            if all(saved.get(key) == self.state[key] for key in ('url', 'size', 'chunk_size', 'validator')):
+                self.state = saved
+            else:
+                logging.info("%s does not match the remote file any more, starting over", path)
+
+    def done(self, index):
+        return str(index) in self.state['chunks']
+
+    def digest(self, index):
+        return self.state['chunks'][str(index)]
+
+    def mark_done(self, index, sha256):
+        with self._lock:
+            self.state['chunks'][str(index)] = sha256
+            self._save()
+
+    def forget(self, index):
+        with self._lock:
+            self.state['chunks'].pop(str(index), None)
+            self._save()
+
+    def _save(self):
+        with open(self.path + '.tmp', 'w') as state_file:
+            json.dump(self.state, state_file)
+        os.rename(self.path + '.tmp', self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def download(session, url, target, chunk_size=DEFAULT_CHUNK_SIZE, workers=8, expected_sha256=None):
+    """
+    Downloads url into target with parallel Range requests, resuming a
+    previous interrupted download of the same file.
+
+    :param expected_sha256: checksum of the whole file, checked at the end
+    :return: sha256 of the downloaded file
+    """
+    size, validator = remote_info(session, url)
+    state = _TransferState(target + STATE_SUFFIX, url, size, chunk_size, validator)
+
+    mode = 'r+b' if os.path.exists(target) else 'wb'
+    with open(target, mode) as target_file:
+        target_file.truncate(size)
+
+    chunks = [(i, offset, min(chunk_size, size - offset))
+              for i, offset in enumerate(range(0, size, chunk_size))]
+    todo = [c for c in chunks if not state.done(c[0])]
+    if len(todo) < len(chunks):
+        logging.info("Resuming %s, %s of %s chunks left", target, len(todo), len(chunks))
+
+    def _fetch(chunk):
+        index, offset, length = chunk
+        res = session.get(url, headers={'Range': 'bytes=%s-%s' % (offset, offset + length - 1)}, stream=True)
+        try:
+            res.raise_for_status()
+            if res.status_code != 206 and length != size:
+                raise IOError("%s ignored the Range request" % url)
+            digest = hashlib.sha256()
+            received = 0
+            with open(target, 'r+b') as target_file:
+                target_file.seek(offset)
+                for piece in res.iter_content(READ_SIZE):
+                    target_file.write(piece)
+                    digest.update(piece)
+                    received += len(piece)
+            if received != length:
+                raise IOError("Chunk %s of %s: got %s of %s bytes" % (index, url, received, length))
+        finally:
+            res.close()
+        state.mark_done(index, digest.hexdigest())
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() so the first failed chunk raises here
+        list(pool.map(_fetch, todo))
+
+    sha256 = verify_chunks(target, state, chunks)
+    if expected_sha256 and sha256 != expected_sha256:
+        raise IOError("Checksum of %s is %s, expected %s" % (target, sha256, expected_sha256))
+    state.remove()
+    return sha256
+
+
+def verify_chunks(target, state, chunks):
+    """
+    Re-reads the target, checks every chunk against the digest recorded when
+    it was written and returns the sha256 of the whole file.
+    """
+    whole = hashlib.sha256()
+    with open(target, 'rb') as target_file:
+        for index, offset, length in chunks:
+            digest = hashlib.sha256()
+            done = 0
+            while done < length:
+                piece = target_file.read(min(READ_SIZE, length - done))
+                if not piece:
+                    break
+                digest.update(piece)
+                whole.update(piece)
+                done += len(piece)
+            if digest.hexdigest() != state.digest(index):
+                # forget the chunk, the next run fetches it again
+                state.forget(index)
+                raise IOError("Chunk %s of %s is corrupt, run the transfer again" % (index, target))
+    return whole.hexdigest()
+
+
+def file_sha256(path):
+    """
+    sha256 of a local file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for piece in iter(lambda: source_file.read(READ_SIZE), b''):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+class _HashingReader(object):
+    """
+    File object over source hashing what is read, with a length so requests
+    sends a Content-Length and not a chunked body.
+    """
+
+    def __init__(self, source):
+        self._file = open(source, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+        self.digest = hashlib.sha256()
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        piece = self._file.read(size)
+        self.digest.update(piece)
+        return piece
+
+    def close(self):
+        self._file.close()
+
+
+def upload(session, url, source):
+    """
+    Streams source to url with a single PUT.
+
+    :return: sha256 of the uploaded data
+    """
+    reader = _HashingReader(source)
+    try:
+        res = session.put(url, data=reader, headers={'Content-Type': 'application/octet-stream'})
+        res.raise_for_status()
+    finally:
+        reader.close()
+    return reader.digest.hexdigest()
+
+
+def upload_files(session, jobs, workers=4):
+    """
+    Uploads several (source, url) pairs in parallel.
+
+    :return: list of sha256 in job order
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda job: upload(session, job[1], job[0]), jobs))
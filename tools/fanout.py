@@ -0,0 +1,134 @@
+"""
+Fan out of FCD operations over several vCenters.
+
+Every vCenter gets its own daemon thread, both for logging in and for the
+work itself. Records emitted by the workers are merged into a single stream,
+each tagged with the vCenter it came from, in the order they are produced.
+A vCenter that is slow or unreachable only delays its own records: once the
+deadline passes the stream ends with a timeout record for it and the thread
+is abandoned (it is a daemon, so it cannot keep the process alive).
+"""
+import threading
+import time
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+
+from tools import resilience
+
+# record kinds besides the ones the work function emits
+CONNECTED = 'connected'
+DONE = 'done'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+
+
+def _run_threads(targets, timeout):
+    """
+    Starts target(emit) for every key and yields (key, record) until all are
+    done or the timeout passes.
+    """
+    records = Queue()
+    pending = set(targets)
+
+    for key, target in targets.items():
+        def _runner(key=key, target=target):
+            def _emit(record):
+                records.put((key, record))
+            try:
+                target(_emit)
+                records.put((key, {'kind': DONE}))
+            except Exception as e:
+                records.put((key, {'kind': ERROR, 'error': resilience.fault_message(e)}))
+
+        thread = threading.Thread(target=_runner, name='fanout-%s' % key)
+        thread.daemon = True
+        thread.start()
+
+    deadline = time.time() + timeout if timeout else None
+    while pending:
+        wait = deadline - time.time() if deadline else None
+        if wait is not None and wait <= 0:
+            break
+        try:
+            key, record = records.get(timeout=wait)
+        except Empty:
+            break
+        if record.get('kind') in (DONE, ERROR):
+            pending.discard(key)
+        yield key, record
+
+    for key in sorted(pending):
+        yield key, {'kind': TIMEOUT, 'error': 'no answer within %ss' % timeout}
+
+
+def connect_all(hosts, user, pwd, port=443, timeout=60, on_connect=None):
+    """
+    Logs in to all vCenters concurrently. Sessions of logins which finish
+    after the timeout are logged out again.
+
+    :param on_connect: called with every service instance once logged in
+
+    :return: ({host: service instance}, {host: error message})
+    """
+    lock = threading.Lock()
+    logged_in = {}
+    closed = []
+
+    def _connect(host):
+        def _target(emit):
+            si = SmartConnectNoSSL(host=host, user=user, pwd=pwd, port=int(port))
+            with lock:
+                late = bool(closed)
+                if not late:
+                    logged_in[host] = si
+            if late:
+                # nobody collects the session any more, it would stay logged in
+                Disconnect(si)
+                return
+            resilience.install(si, user, pwd)
+            if on_connect is not None:
+                on_connect(si)
+            emit({'kind': CONNECTED, 'si': si})
+        return _target
+
+    sessions = {}
+    errors = {}
+    for host, record in _run_threads(dict((host, _connect(host)) for host in hosts), timeout):
+        if record['kind'] == CONNECTED:
+            sessions[host] = record['si']
+        elif record['kind'] in (ERROR, TIMEOUT):
+            errors[host] = record['error']
+
+    with lock:
+        closed.append(True)
+        abandoned = [si for host, si in logged_in.items() if host not in sessions]
+    # logins which finished without their record being collected in time
+    disconnect_all(dict(enumerate(abandoned)))
+    return sessions, errors
+
+
+def disconnect_all(sessions):
+    for si in sessions.values():
+        try:
+            Disconnect(si)
+        except Exception:
+            pass
+
+
+def fan_out(sessions, work, timeout=None):
+    """
+    Runs work(host, si, emit) for every vCenter in parallel and yields the
+    emitted records as they arrive, each with a 'vcenter' key added. The
+    stream ends with a done, error or timeout record per vCenter.
+    """
+    targets = dict((host, lambda emit, host=host, si=si: work(host, si, emit))
+                   for host, si in sessions.items())
+    for host, record in _run_threads(targets, timeout):
+        record = dict(record)
+        record['vcenter'] = host
+        yield record
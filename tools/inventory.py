@@ -0,0 +1,220 @@
+"""
+Fleet wide FCD to VM attachment index.
+
+Two passes collect everything needed:
+    - ListVStorageObject on every datastore (run in parallel) gives all FCDs
+    - one paged PropertyCollector retrieval of config.hardware.device over a
+      container view gives every virtual disk of every VM with its vDiskId
+
+FcdIndex joins them into a bidirectional FCD <-> VM index. Orphaned FCDs
+and VM disks not promoted yet (mk-fcd candidates) then fall out of
+dictionary and set operations instead of a VM scan per FCD.
+
+The per datastore and per FCD calls run in threads. Given a
+sessionpool.SessionPool, every call goes through a session of its own.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim
+
+from tools import pchelper
+
+
+def collect_datastores(service_instance, page_size=1000):
+    """
+    Returns {datastore moId: {'obj', 'name', 'url', 'capacity', 'freeSpace', 'accessible'}}
+    """
+    view = pchelper.get_container_view(service_instance, [vim.Datastore])
+    try:
+        datastores = {}
+        for props in pchelper.collect_properties_paged(
+                service_instance, view, vim.Datastore,
+                ['name', 'summary.url', 'summary.capacity', 'summary.freeSpace', 'summary.accessible'],
+                page_size):
+            datastores[props['obj']._moId] = {
+                'obj': props['obj'],
+                'name': props.get('name'),
+                'url': props.get('summary.url'),
+                'capacity': props.get('summary.capacity'),
+                'freeSpace': props.get('summary.freeSpace'),
+                'accessible': props.get('summary.accessible'),
+            }
+        return datastores
+    finally:
+        view.Destroy()
+
+
+class _StorageManager(object):
+    """
+    The vStorageObjectManager of a pool session, or manager without a pool.
+    A class and not a generator context, pyVmomi faults do not pass through those.
+    """
+
+    def __init__(self, manager, pool):
+        self.manager = manager
+        self.checkout = pool.checkout() if pool is not None else None
+
+    def __enter__(self):
+        if self.checkout is None:
+            return self.manager
+        return self.checkout.__enter__().content.vStorageObjectManager
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.checkout is not None:
+            return self.checkout.__exit__(exc_type, exc_value, traceback)
+        return False
+
+
+def list_fcds(service_instance, datastores, workers=8, pool=None):
+    """
+    Lists the FCDs of every accessible datastore in parallel.
+
+    :param datastores: as returned by collect_datastores
+    :param pool: optional SessionPool spreading the calls over sessions
+    :return: {vDiskId: datastore moId}
+    """
+    manager = service_instance.content.vStorageObjectManager
+    accessible = [moid for moid, ds in datastores.items() if ds['accessible'] is not False]
+
+    def _list(moid):
+        with _StorageManager(manager, pool) as session_manager:
+            return moid, session_manager.ListVStorageObject(datastores[moid]['obj']) or []
+
+    fcds = {}
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        for moid, ids in threads.map(_list, accessible):
+            for id_object in ids:
+                fcds[id_object.id] = moid
+    return fcds
+
+
+def snapshot_count(manager, vdisk_id, ds_obj):
+    """
+    Number of snapshots of the FCD. The delta disks of the backing chain are
+    no measure, VM snapshots add redo logs to it as well.
+    """
+    id_object = vim.vslm.ID()
+    id_object.id = vdisk_id
+    return len(manager.RetrieveSnapshotInfo(id_object, ds_obj).snapshots or [])
+
+
+def associations(manager, disks):
+    """
+    Live attachments of the FCDs, all read with one
+    RetrieveVStorageObjectAssociations call.
+
+    :param disks: [(vDiskId, vim.Datastore)]
+    :return: {vDiskId: [(VM moId, disk key)]}, FCDs vCenter could not
+             answer for are left out
+    """
+    specs = [vim.vslm.vcenter.RetrieveVStorageObjSpec(id=vim.vslm.ID(id=vdisk_id), datastore=ds_obj)
+             for vdisk_id, ds_obj in disks]
+    found = {}
+    for association in manager.RetrieveVStorageObjectAssociations(specs) or []:
+        if association.fault is None:
+            found[association.id.id] = [(vm_disk.vmId, vm_disk.diskKey)
+                                        for vm_disk in association.vmDiskAssociations or []]
+    return found
+
+
+def collect_vm_disks(service_instance, page_size=500):
+    """
+    Yields one record per virtual disk of every VM, fetched with a single
+    paged retrieval of name and config.hardware.device.
+    """
+    view = pchelper.get_container_view(service_instance, [vim.VirtualMachine])
+    try:
+        for props in pchelper.collect_properties_paged(
+                service_instance, view, vim.VirtualMachine,
+                ['name', 'config.hardware.device'], page_size):
+            for dev in props.get('config.hardware.device') or []:
+                if not isinstance(dev, vim.vm.device.VirtualDisk):
+                    continue
+                datastore = getattr(dev.backing, 'datastore', None)
+                yield {
+                    'vm': props['obj']._moId,
+                    'vmName': props.get('name'),
+                    'key': dev.key,
+                    'label': dev.deviceInfo.label,
+                    'vDiskId': dev.vDiskId.id if dev.vDiskId else None,
+                    'datastore': datastore._moId if datastore is not None else None,
+                    'fileName': getattr(dev.backing, 'fileName', None),
+                    'controllerKey': dev.controllerKey,
+                    'unitNumber': dev.unitNumber,
+                    'capacity': dev.capacityInBytes,
+                }
+    finally:
+        view.Destroy()
+
+
+class FcdIndex(object):
+    """
+    Bidirectional FCD <-> VM index built from one inventory pass.
+    """
+
+    def __init__(self, datastores, fcds, vm_disks):
+        self.datastores = datastores
+        # vDiskId -> datastore moId, for every FCD on every datastore
+        self.fcds = fcds
+        # vDiskId -> disk record of the VM it is attached to
+        self.attachments = {}
+        # VM name -> [disk records]
+        self.vm_disks = {}
+        # disk records without vDiskId
+        self.unpromoted = []
+
+        for disk in vm_disks:
+            self.vm_disks.setdefault(disk['vmName'], []).append(disk)
+            if disk['vDiskId']:
+                self.attachments[disk['vDiskId']] = disk
+            else:
+                self.unpromoted.append(disk)
+
+    @classmethod
+    def build(cls, service_instance, page_size=500, workers=8, pool=None):
+        datastores = collect_datastores(service_instance)
+        fcds = list_fcds(service_instance, datastores, workers, pool)
+        return cls(datastores, fcds, collect_vm_disks(service_instance, page_size))
+
+    def datastore_name(self, moid):
+        return self.datastores[moid]['name'] if moid in self.datastores else moid
+
+    def vm_of(self, vdisk_id):
+        """
+        Returns the disk record of the VM the FCD is attached to, None when unattached.
+        """
+        return self.attachments.get(vdisk_id)
+
+    def fcds_of(self, vm_name):
+        return [d['vDiskId'] for d in self.vm_disks.get(vm_name, []) if d['vDiskId']]
+
+    def orphans(self):
+        """
+        FCDs attached to no VM.
+        """
+        return sorted(set(self.fcds) - set(self.attachments))
+
+    def missing(self):
+        """
+        vDiskIds VMs refer to which no datastore listed, e.g. on an inaccessible datastore.
+        """
+        return sorted(set(self.attachments) - set(self.fcds))
+
+    def deep_chains(self, threshold, service_instance, workers=8, pool=None):
+        """
+        FCDs with at least threshold snapshots as {vDiskId: depth}, counted
+        with one RetrieveSnapshotInfo per FCD, in parallel.
+        """
+        manager = service_instance.content.vStorageObjectManager
+
+        def _count(vdisk_id):
+            with _StorageManager(manager, pool) as session_manager:
+                return vdisk_id, snapshot_count(session_manager, vdisk_id,
+                                                self.datastores[self.fcds[vdisk_id]]['obj'])
+
+        deep = {}
+        with ThreadPoolExecutor(max_workers=workers) as threads:
+            for vdisk_id, depth in threads.map(_count, sorted(self.fcds)):
+                if depth >= threshold:
+                    deep[vdisk_id] = depth
+        return deep
@@ -0,0 +1,293 @@
+"""
+Memory mappable inventory snapshot file.
+
+dump-inventory.py walks the inventory once, with one paged PropertyCollector
+query following serviceutil.build_full_traversal, and writes the lookup
+tables the scripts need at startup into one binary file:
+
+    - names:      (type, name) -> moId for VMs, datastores, datacenters,
+                  hosts and clusters
+    - vdisks:     vDiskId -> (datastore moId, VM moId, controller key, unit
+                  number), unattached FCDs with an empty VM and -1
+    - datastores: moId -> (name, url)
+
+Layout, all integers little endian:
+
+    header    magic, format version, creation time, counts and offsets of
+              the tables, offset and length of the vCenter name
+    tables    fixed size records sorted by key, strings referenced as
+              (offset, length) into the string area
+    strings   UTF-8, concatenated
+
+A lookup maps the file and binary searches a table, nothing is parsed up
+front, so it costs the same for 100 or 100000 VMs.
+
+The file describes the inventory when it was dumped. It is not used when it
+is older than the maximum age, from another vCenter or of another format
+version, and get_obj() checks the name of every object it returns from the
+file with one property read, falling back to a live search on a mismatch.
+"""
+import mmap
+import os
+import struct
+import time
+
+from pyVmomi import vim, vmodl
+
+from tools import pchelper, serviceutil
+
+MAGIC = b'FCDINV\0\0'
+FORMAT_VERSION = 1
+DEFAULT_MAX_AGE = 24 * 3600
+
+# magic, version, created, host (offset, length), then (offset, count) of
+# the names, vdisks and datastores tables
+_HEADER = struct.Struct('<8sHdIIIIIIII')
+# type code, name, moId
+_NAME = struct.Struct('<BIIII')
+# vDiskId, datastore moId, VM moId, controller key, unit number
+_VDISK = struct.Struct('<IIIIIIii')
+# moId, name, url
+_DATASTORE = struct.Struct('<IIIIII')
+
+TYPE_CODES = {'VirtualMachine': 1, 'Datastore': 2, 'Datacenter': 3, 'HostSystem': 4,
+              'ClusterComputeResource': 5}
+NAMED_TYPES = (vim.VirtualMachine, vim.Datastore, vim.Datacenter, vim.HostSystem, vim.ClusterComputeResource)
+
+_active = None
+
+
+class StaleInventory(Exception):
+    """
+    The file cannot be trusted for this connection.
+    """
+
+
+def collect(service_instance, page_size=1000, fcds=None):
+    """
+    Walks the inventory once and returns the tables to write.
+
+    :param fcds: optional {vDiskId: datastore moId} of all FCDs, e.g. from
+                 inventory.list_fcds, to include the unattached ones
+    :return: (names, vdisks, datastores) as
+             [(type, name, moId)], {vDiskId: (ds, vm, controller, unit)}, {moId: (name, url)}
+    """
+    content = service_instance.content
+    path_sets = {vim.VirtualMachine: ['name', 'config.hardware.device'],
+                 vim.Datastore: ['name', 'summary.url']}
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=content.rootFolder, skip=False,
+                                                            selectSet=serviceutil.build_full_traversal())],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(type=one_type, pathSet=path_sets.get(one_type, ['name']))
+                 for one_type in NAMED_TYPES])
+
+    names = []
+    vdisks = {}
+    datastores = {}
+    for props in pchelper.retrieve_paged(content.propertyCollector, filter_spec, page_size):
+        obj = props['obj']
+        names.append((obj._wsdlName, props.get('name') or '', obj._moId))
+        if isinstance(obj, vim.Datastore):
+            datastores[obj._moId] = (props.get('name') or '', props.get('summary.url') or '')
+        for dev in props.get('config.hardware.device') or []:
+            if isinstance(dev, vim.vm.device.VirtualDisk) and dev.vDiskId:
+                datastore = getattr(dev.backing, 'datastore', None)
+                vdisks[dev.vDiskId.id] = (datastore._moId if datastore is not None else '', obj._moId,
+                                          dev.controllerKey, dev.unitNumber if dev.unitNumber is not None else -1)
+    for vdisk_id, ds_moid in (fcds or {}).items():
+        vdisks.setdefault(vdisk_id, (ds_moid, '', -1, -1))
+    return names, vdisks, datastores
+
+
+class _Strings(object):
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, text):
+        raw = text.encode('utf-8')
+        if raw not in self.offsets:
+            self.offsets[raw] = len(self.data)
+            self.data.extend(raw)
+        return self.offsets[raw], len(raw)
+
+
+def write(path, host, names, vdisks, datastores):
+    """
+    Writes the tables returned by collect, atomically replacing path.
+    """
+    strings = _Strings()
+    host_ref = strings.add(host)
+
+    name_records = []
+    for type_name, name, moid in sorted(names, key=lambda n: (TYPE_CODES[n[0]], n[1].encode('utf-8'))):
+        name_records.append(_NAME.pack(TYPE_CODES[type_name], *(strings.add(name) + strings.add(moid))))
+
+    vdisk_records = []
+    for vdisk_id in sorted(vdisks, key=lambda v: v.encode('utf-8')):
+        ds_moid, vm_moid, controller, unit = vdisks[vdisk_id]
+        vdisk_records.append(_VDISK.pack(*(strings.add(vdisk_id) + strings.add(ds_moid) + strings.add(vm_moid) +
+                                           (controller, unit))))
+
+    ds_records = []
+    for moid in sorted(datastores, key=lambda m: m.encode('utf-8')):
+        name, url = datastores[moid]
+        ds_records.append(_DATASTORE.pack(*(strings.add(moid) + strings.add(name) + strings.add(url))))
+
+    names_at = _HEADER.size
+    vdisks_at = names_at + _NAME.size * len(name_records)
+    ds_at = vdisks_at + _VDISK.size * len(vdisk_records)
+    strings_at = ds_at + _DATASTORE.size * len(ds_records)
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, time.time(),
+                          strings_at + host_ref[0], host_ref[1],
+                          names_at, len(name_records), vdisks_at, len(vdisk_records), ds_at, len(ds_records))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(header)
+        for records in (name_records, vdisk_records, ds_records):
+            out.write(b''.join(records))
+        out.write(bytes(strings.data))
+    os.rename(tmp_path, path)
+    return {'names': len(name_records), 'vdisks': len(vdisk_records), 'datastores': len(ds_records),
+            'bytes': strings_at + len(strings.data)}
+
+
+class InventoryFile(object):
+    """
+    Read only view of an inventory file through mmap.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as source:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise StaleInventory("%s is not an inventory file" % path)
+        (magic, self.version, self.created, host_at, host_len, self._names_at, self._names_count,
+         self._vdisks_at, self._vdisks_count, self._ds_at, self._ds_count) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise StaleInventory("%s is not an inventory file" % path)
+        if self.version != FORMAT_VERSION:
+            raise StaleInventory("%s has format version %s, expected %s" % (path, self.version, FORMAT_VERSION))
+        self._strings_at = self._ds_at + _DATASTORE.size * self._ds_count
+        self.host = self._map[host_at:host_at + host_len].decode('utf-8')
+
+    def close(self):
+        self._map.close()
+
+    def age(self):
+        return time.time() - self.created
+
+    def check(self, host, max_age=DEFAULT_MAX_AGE):
+        """
+        Raises StaleInventory when the file is not for host or too old.
+        """
+        if self.host != host:
+            raise StaleInventory("%s was dumped from %s, not %s" % (self.path, self.host, host))
+        if max_age and self.age() > max_age:
+            raise StaleInventory("%s is %d minutes old" % (self.path, self.age() / 60))
+
+    def _string(self, offset, length):
+        start = self._strings_at + offset
+        return self._map[start:start + length]
+
+    def _search(self, record, table_at, count, key, key_of):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            fields = record.unpack_from(self._map, table_at + middle * record.size)
+            if key_of(fields) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < count:
+            fields = record.unpack_from(self._map, table_at + low * record.size)
+            if key_of(fields) == key:
+                return fields
+        return None
+
+    def moid(self, type_name, name):
+        """
+        MoID of the object of the type (a wsdl name like 'VirtualMachine') with that name, or None.
+        """
+        code = TYPE_CODES.get(type_name)
+        if code is None:
+            return None
+        fields = self._search(_NAME, self._names_at, self._names_count, (code, name.encode('utf-8')),
+                              lambda f: (f[0], self._string(f[1], f[2])))
+        return self._string(fields[3], fields[4]).decode('utf-8') if fields else None
+
+    def vdisk(self, vdisk_id):
+        """
+        {'datastore', 'vm', 'controllerKey', 'unitNumber'} of the FCD or None,
+        'vm' is None for unattached FCDs.
+        """
+        fields = self._search(_VDISK, self._vdisks_at, self._vdisks_count, vdisk_id.encode('utf-8'),
+                              lambda f: self._string(f[0], f[1]))
+        if not fields:
+            return None
+        return {'datastore': self._string(fields[2], fields[3]).decode('utf-8'),
+                'vm': self._string(fields[4], fields[5]).decode('utf-8') or None,
+                'controllerKey': fields[6] if fields[6] >= 0 else None,
+                'unitNumber': fields[7] if fields[7] >= 0 else None}
+
+    def datastore(self, moid):
+        """
+        (name, url) of the datastore or None.
+        """
+        fields = self._search(_DATASTORE, self._ds_at, self._ds_count, moid.encode('utf-8'),
+                              lambda f: self._string(f[0], f[1]))
+        if not fields:
+            return None
+        return self._string(fields[2], fields[3]).decode('utf-8'), self._string(fields[4], fields[5]).decode('utf-8')
+
+
+def add_arguments(parser):
+    parser.add_argument('-inventory', default=os.environ.get('FCD_INVENTORY'),
+                        help='Inventory file written by dump-inventory.py to look objects up in, '
+                             'default $FCD_INVENTORY')
+    parser.add_argument('-inventory-max-age', dest='inventory_max_age', type=int, default=DEFAULT_MAX_AGE,
+                        help='Seconds after which the inventory file is not used any more')
+    return parser
+
+
+def use(path, host, max_age=DEFAULT_MAX_AGE):
+    """
+    Makes get_obj() and active() use the inventory file at path, when it
+    exists and is fresh for host. Returns the file or None.
+    """
+    global _active
+    _active = None
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        inventory_file = InventoryFile(path)
+        inventory_file.check(host, max_age)
+    except (StaleInventory, IOError, ValueError) as e:
+        print("##Not using the inventory file : %s" % e)
+        return None
+    _active = inventory_file
+    return _active
+
+
+def active():
+    return _active
+
+
+def get_obj(content, vim_type, name):
+    """
+    pchelper.get_obj_by_name, answered from the active inventory file when
+    the object is in it and still has that name.
+    """
+    if _active is not None and len(vim_type) == 1:
+        moid = _active.moid(vim_type[0]._wsdlName, name)
+        if moid is not None:
+            obj = vim_type[0](moid, content.rootFolder._stub)
+            try:
+                if obj.name == name:
+                    return obj
+            except vmodl.fault.ManagedObjectNotFound:
+                pass
+    return pchelper.get_obj_by_name(content, vim_type, name)
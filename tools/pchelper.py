@@ -76,6 +76,172 @@ def collect_properties(service_instance, view_ref, obj_type, path_set=None,
     return data
 
 
+def collect_properties_paged(service_instance, view_ref, obj_type, path_set=None,
+                             page_size=1000):
+    """
+    Like collect_properties, but fetched with RetrievePropertiesEx pages of
+    page_size objects and yielded one object at a time, so memory stays
+    bounded by a page and the first results arrive before the last page.
+
+    Args:
+        si          (ServiceInstance): ServiceInstance connection
+        view_ref (pyVmomi.vim.view.*): Starting point of inventory navigation
+        obj_type      (pyVmomi.vim.*): Type of managed object, or a list of
+                                       types sharing the properties
+        path_set               (list): List of properties to retrieve
+        page_size               (int): Objects per page
+
+    Yields:
+        A dict of properties per managed object, the object itself under 'obj'
+
+    """
+    collector = service_instance.content.propertyCollector
+
+    obj_spec = pyVmomi.vmodl.query.PropertyCollector.ObjectSpec()
+    obj_spec.obj = view_ref
+    obj_spec.skip = True
+
+    traversal_spec = pyVmomi.vmodl.query.PropertyCollector.TraversalSpec()
+    traversal_spec.name = 'traverseEntities'
+    traversal_spec.path = 'view'
+    traversal_spec.skip = False
+    traversal_spec.type = view_ref.__class__
+    obj_spec.selectSet = [traversal_spec]
+
+    filter_spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec()
+    filter_spec.objectSet = [obj_spec]
+    for one_type in (obj_type if isinstance(obj_type, (list, tuple)) else [obj_type]):
+        property_spec = pyVmomi.vmodl.query.PropertyCollector.PropertySpec()
+        property_spec.type = one_type
+        if not path_set:
+            property_spec.all = True
+        property_spec.pathSet = path_set
+        filter_spec.propSet.append(property_spec)
+
+    return retrieve_paged(collector, filter_spec, page_size)
+
+
+def retrieve_paged(collector, filter_spec, page_size=1000):
+    """
+    Runs a filter spec with RetrievePropertiesEx in pages of page_size
+    objects. The server side result set is cancelled when the caller stops
+    before the last page.
+
+    Args:
+        collector (PropertyCollector): Collector to run the retrieval on
+        filter_spec      (FilterSpec): What to retrieve
+        page_size               (int): Objects per page
+
+    Yields:
+        A dict of properties per managed object, the object itself under 'obj'
+
+    """
+    options = pyVmomi.vmodl.query.PropertyCollector.RetrieveOptions()
+    options.maxObjects = page_size
+
+    token = None
+    result = collector.RetrievePropertiesEx([filter_spec], options)
+    try:
+        while result:
+            token = result.token
+            for obj in result.objects:
+                properties = dict((prop.name, prop.val) for prop in obj.propSet)
+                properties['obj'] = obj.obj
+                yield properties
+            if not token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(token)
+            token = None
+    finally:
+        # release the server side result set when the caller stops early
+        if token:
+            collector.CancelRetrievePropertiesEx(token)
+
+
+def get_obj_by_name(content, vim_type, name, page_size=1000):
+    """
+    Finds a managed object by name with one paged retrieval of the names,
+    instead of reading the name of every object in the view one call at a
+    time. The container view is destroyed before returning.
+
+    Args:
+        content (ServiceContent): ServiceContent of the connection
+        vim_type          (list): Managed object types to search
+        name               (str): Name of the object
+        page_size          (int): Objects per page
+
+    Returns:
+        The first managed object named name, None if there is none
+
+    """
+    view_ref = content.viewManager.CreateContainerView(content.rootFolder, vim_type, True)
+    try:
+        obj_spec = pyVmomi.vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = view_ref
+        obj_spec.skip = True
+
+        traversal_spec = pyVmomi.vmodl.query.PropertyCollector.TraversalSpec()
+        traversal_spec.name = 'traverseEntities'
+        traversal_spec.path = 'view'
+        traversal_spec.skip = False
+        traversal_spec.type = view_ref.__class__
+        obj_spec.selectSet = [traversal_spec]
+
+        filter_spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [obj_spec]
+        filter_spec.propSet = [pyVmomi.vmodl.query.PropertyCollector.PropertySpec(type=obj_type, pathSet=['name'])
+                               for obj_type in vim_type]
+
+        found = None
+        results = retrieve_paged(content.propertyCollector, filter_spec, page_size)
+        for properties in results:
+            if properties.get('name') == name:
+                found = properties['obj']
+                break
+        # cancels the rest of the result set
+        results.close()
+        return found
+    finally:
+        view_ref.Destroy()
+
+
+def get_object_properties(service_instance, obj, path_set):
+    """
+    Retrieve properties of a single managed object in one round trip
+
+    Nested data objects (e.g. a whole snapshot tree) come back fully
+    populated, so reading them afterwards costs no further calls.
+
+    Args:
+        si          (ServiceInstance): ServiceInstance connection
+        obj       (pyVmomi.vim.*): Managed object to read
+        path_set               (list): List of properties to retrieve
+
+    Returns:
+        A dict of property path to value, unset properties are left out
+
+    """
+    collector = service_instance.content.propertyCollector
+
+    obj_spec = pyVmomi.vmodl.query.PropertyCollector.ObjectSpec()
+    obj_spec.obj = obj
+    obj_spec.skip = False
+
+    property_spec = pyVmomi.vmodl.query.PropertyCollector.PropertySpec()
+    property_spec.type = obj.__class__
+    property_spec.pathSet = path_set
+
+    filter_spec = pyVmomi.vmodl.query.PropertyCollector.FilterSpec()
+    filter_spec.objectSet = [obj_spec]
+    filter_spec.propSet = [property_spec]
+
+    properties = {}
+    for content in collector.RetrieveContents([filter_spec]):
+        for prop in content.propSet:
+            properties[prop.name] = prop.val
+    return properties
+
+
 def get_container_view(service_instance, obj_type, container=None):
     """
     Get a vSphere Container View reference to all objects of type 'obj_type'
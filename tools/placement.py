@@ -0,0 +1,270 @@
+"""
+Datastore placement advisor.
+
+PlacementAdvisor holds one view of every datastore: capacity, free space
+and number of FCDs. It is filled by one batched pass (inventory.FcdIndex)
+and can be cached in a file for the next runs, so choosing a target costs no
+vCenter call.
+
+Bulk operations ask it for targets and it
+
+    - rejects a datastore which would go past the thresholds of the Policy:
+      used space and FCDs per datastore
+    - prefers the emptiest datastore, counting the disks it already handed
+      out, and every operation planned on a datastore as 2% more used space,
+      so work is spread over datastores and not only by free bytes
+
+Checking and reserving happen under a lock, workers of a bulk operation
+share one advisor.
+
+Single disk operations (mk-fcd, vdisk-sn-op create) call check(), which
+answers from the active advisor or reads the one datastore live. The
+snapshot chain limit of the Policy is checked there too, against the number
+of snapshots the caller read for the FCD, the view holds no chains.
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from pyVmomi import vim
+
+from tools import inventory, pchelper
+
+CACHE_VERSION = 1
+# every operation planned on a datastore weighs as much as this part of its capacity
+IO_WEIGHT = 0.02
+
+Policy = namedtuple('Policy', ['max_used', 'max_fcds', 'max_chain'])
+DEFAULT_POLICY = Policy(max_used=0.9, max_fcds=0, max_chain=32)
+
+_active = None
+_policy = DEFAULT_POLICY
+
+
+class PlacementRejected(ValueError):
+    """
+    The work would push a datastore past a threshold, or fits nowhere.
+    """
+
+
+def add_arguments(parser):
+    parser.add_argument('-max-used', dest='max_used', type=float, default=DEFAULT_POLICY.max_used * 100,
+                        help='Percent of the capacity of a datastore new work may fill it up to')
+    parser.add_argument('-max-fcds', dest='max_fcds', type=int, default=DEFAULT_POLICY.max_fcds,
+                        help='FCDs a datastore may hold, 0 for no limit')
+    parser.add_argument('-max-chain', dest='max_chain', type=int, default=DEFAULT_POLICY.max_chain,
+                        help='Snapshots an FCD may have before no further one is taken, 0 for no limit')
+    parser.add_argument('-placement-cache', dest='placement_cache',
+                        help='File caching the datastore view between runs')
+    parser.add_argument('-placement-max-age', dest='placement_max_age', type=int, default=600,
+                        help='Seconds the cached datastore view is used for')
+    return parser
+
+
+def policy(args):
+    return Policy(args.max_used / 100.0, args.max_fcds, args.max_chain)
+
+
+class PlacementAdvisor(object):
+    """
+    Datastore view with thresholds and the placements handed out so far.
+    """
+
+    def __init__(self, datastores, policy=DEFAULT_POLICY, created=None):
+        """
+        :param datastores: {moId: {'obj', 'name', 'capacity', 'freeSpace',
+                           'accessible', 'fcds'}}
+        """
+        self.datastores = datastores
+        self.policy = policy
+        self.created = created or time.time()
+        self.planned = dict((moid, 0) for moid in datastores)
+        self.planned_bytes = dict((moid, 0) for moid in datastores)
+        # problem() and reserve() of one placement must not interleave with another
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_index(cls, index, policy=DEFAULT_POLICY):
+        datastores = dict((moid, dict(ds, fcds=0)) for moid, ds in index.datastores.items())
+        for moid in index.fcds.values():
+            if moid in datastores:
+                datastores[moid]['fcds'] += 1
+        return cls(datastores, policy)
+
+    @classmethod
+    def build(cls, service_instance, policy=DEFAULT_POLICY, pool=None, cache=None, max_age=600, host=None):
+        """
+        The advisor from the cache file when it is younger than max_age and
+        of the same vCenter, otherwise from a fresh inventory pass which is
+        then written to the cache.
+        """
+        if cache and os.path.exists(cache):
+            try:
+                advisor = cls.load(cache, service_instance, policy, host)
+                if time.time() - advisor.created <= max_age:
+                    return advisor
+            except (ValueError, KeyError):
+                pass
+        advisor = cls.from_index(inventory.FcdIndex.build(service_instance, pool=pool), policy)
+        if cache:
+            advisor.save(cache, host)
+        return advisor
+
+    def save(self, path, host=None):
+        entries = dict((moid, dict((key, val) for key, val in ds.items() if key != 'obj'))
+                       for moid, ds in self.datastores.items())
+        with open(path + '.tmp', 'w') as cache:
+            json.dump({'version': CACHE_VERSION, 'host': host, 'created': self.created, 'datastores': entries},
+                      cache)
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, service_instance, policy=DEFAULT_POLICY, host=None):
+        with open(path) as cache:
+            data = json.load(cache)
+        if data['version'] != CACHE_VERSION or data['host'] != host:
+            raise ValueError("%s does not match" % path)
+        stub = service_instance._stub
+        datastores = dict((moid, dict(ds, obj=vim.Datastore(moid, stub))) for moid, ds in data['datastores'].items())
+        return cls(datastores, policy, data['created'])
+
+    def headroom(self, moid):
+        """
+        Bytes that may still be written to the datastore, after the placements handed out.
+        """
+        ds = self.datastores[moid]
+        if ds['accessible'] is False or not ds['capacity']:
+            return 0
+        return ds['freeSpace'] - self.planned_bytes[moid] - ds['capacity'] * (1 - self.policy.max_used)
+
+    def problem(self, moid, size=0, new_fcd=True):
+        """
+        Why size more bytes, and one FCD more, would push the datastore past
+        a threshold, None when they would not.
+        """
+        ds = self.datastores.get(moid)
+        if ds is None:
+            return "datastore %s is unknown" % moid
+        with self._lock:
+            if ds['accessible'] is False:
+                return "datastore %s is not accessible" % ds['name']
+            if self.headroom(moid) < size:
+                return "datastore %s would be more than %d%% full" % (ds['name'], self.policy.max_used * 100)
+            if new_fcd and self.policy.max_fcds and ds['fcds'] + self.planned[moid] >= self.policy.max_fcds:
+                return "datastore %s already holds %d FCDs" % (ds['name'], ds['fcds'] + self.planned[moid])
+            return None
+
+    def score(self, moid, size=0):
+        """
+        Lower is better: fraction used once size is added, plus the operations planned on it.
+        """
+        ds = self.datastores[moid]
+        used = ds['capacity'] - ds['freeSpace'] + self.planned_bytes[moid] + size
+        return float(used) / ds['capacity'] + IO_WEIGHT * self.planned[moid]
+
+    def reserve(self, moid, size, new_fcd=True):
+        with self._lock:
+            self.planned_bytes[moid] += size
+            if new_fcd:
+                self.planned[moid] += 1
+
+    def reserve_if_fits(self, moid, size=0, new_fcd=True):
+        """
+        Reserves size bytes, and one FCD, on the datastore unless that would
+        push it past a threshold, in one step.
+
+        :return: the problem, None when the reservation is made
+        """
+        with self._lock:
+            problem = self.problem(moid, size, new_fcd)
+            if problem is None:
+                self.reserve(moid, size, new_fcd)
+            return problem
+
+    def choose(self, size, candidates=None, exclude=(), new_fcd=True):
+        """
+        Best datastore for a disk of size bytes, reserved right away.
+
+        :raise PlacementRejected: when it fits on none of the candidates
+        """
+        with self._lock:
+            allowed = [moid for moid in sorted(candidates if candidates is not None else self.datastores)
+                       if moid not in exclude and self.problem(moid, size, new_fcd) is None]
+            if not allowed:
+                raise PlacementRejected("a disk of %d MB fits on none of the datastores without going past the "
+                                        "thresholds" % (size // (1024 * 1024)))
+            moid = min(allowed, key=lambda m: self.score(m, size))
+            self.reserve(moid, size, new_fcd)
+            return moid
+
+    def place(self, count, size, candidates=None):
+        """
+        Datastores for count disks of size bytes, one moId per disk.
+        """
+        placements = []
+        for number in range(count):
+            try:
+                placements.append(self.choose(size, candidates))
+            except PlacementRejected as e:
+                raise PlacementRejected("%s, %d of %d disks placed" % (e, number, count))
+        return placements
+
+
+def use(advisor):
+    """
+    Makes check() answer from the advisor, None reads datastores live.
+    """
+    global _active
+    _active = advisor
+
+
+def current_policy():
+    """
+    The thresholds check() applies.
+    """
+    return _policy
+
+
+def configure(service_instance, args, host=None):
+    """
+    Sets the thresholds of check() from the arguments of add_arguments, and
+    answers it from -placement-cache when that is fresh.
+    """
+    global _policy
+    _policy = policy(args)
+    use(None)
+    if args.placement_cache and os.path.exists(args.placement_cache):
+        try:
+            advisor = PlacementAdvisor.load(args.placement_cache, service_instance, _policy, host)
+        except (ValueError, KeyError):
+            return
+        if time.time() - advisor.created <= args.placement_max_age:
+            use(advisor)
+
+
+def check(service_instance, ds_obj, size=0, new_fcd=False, chain_depth=None):
+    """
+    Raises PlacementRejected when writing size bytes to the datastore, adding
+    an FCD to it or one more snapshot to a chain of chain_depth snapshots
+    would go past the thresholds.
+    """
+    advisor = _active
+    if advisor is None or ds_obj._moId not in advisor.datastores:
+        props = pchelper.get_object_properties(service_instance, ds_obj,
+                                               ['name', 'summary.capacity', 'summary.freeSpace',
+                                                'summary.accessible'])
+        fcds = 0
+        if new_fcd and _policy.max_fcds:
+            fcds = len(service_instance.content.vStorageObjectManager.ListVStorageObject(ds_obj) or [])
+        advisor = PlacementAdvisor({ds_obj._moId: {'obj': ds_obj, 'name': props.get('name'),
+                                                   'capacity': props.get('summary.capacity'),
+                                                   'freeSpace': props.get('summary.freeSpace'),
+                                                   'accessible': props.get('summary.accessible'),
+                                                   'fcds': fcds}}, _policy)
+    if chain_depth is not None and advisor.policy.max_chain and chain_depth >= advisor.policy.max_chain:
+        raise PlacementRejected("the FCD already has %d snapshots" % chain_depth)
+    problem = advisor.reserve_if_fits(ds_obj._moId, size, new_fcd)
+    if problem:
+        raise PlacementRejected(problem)
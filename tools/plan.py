@@ -0,0 +1,146 @@
+"""
+Declarative operation plans for FCD runbooks.
+
+A plan is a JSON (or YAML, when PyYAML is installed) document with a list of
+steps. Every step names one FCD operation, the objects it works on and the
+steps it has to wait for:
+
+    {
+      "steps": [
+        {"id": "promote", "op": "promote", "vm": "web01", "disk": 2,
+         "datacenter": "DC1"},
+        {"id": "snap", "op": "snapshot", "vm": "web01", "disk": 2,
+         "description": "before upgrade", "after": ["promote"]},
+        {"id": "revert", "op": "revert", "vm": "web01", "disk": 2,
+         "snid": "${snap}", "after": ["snap"]}
+      ]
+    }
+
+A value of the form ``${step-id}`` is replaced with the result of that step
+when the step runs, e.g. the snapshot id returned by a snapshot step.
+"""
+import json
+import re
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# operation -> fields which must be present on the step
+OPERATIONS = {
+    'promote': ('vm', 'disk', 'datacenter'),
+    'snapshot': ('vm', 'disk', 'description'),
+    'delete': ('vm', 'disk', 'snid'),
+    'revert': ('vm', 'disk', 'snid'),
+    'attach': ('vm', 'vDiskId', 'ds', 'controllerKey', 'unitNumber'),
+    'detach': ('vm', 'disk'),
+}
+
+_REFERENCE = re.compile(r'\$\{([^}]+)\}')
+
+
+def load_plan(path):
+    """
+    Reads and validates a plan file. Files ending in .yml or .yaml are parsed
+    as YAML, everything else as JSON.
+
+    :param path: path of the plan file
+    :return: the plan dictionary
+    """
+    with open(path) as plan_file:
+        if path.endswith(('.yml', '.yaml')):
+            if yaml is None:
+                raise RuntimeError("PyYAML is needed to read the plan %s" % path)
+            plan = yaml.safe_load(plan_file)
+        else:
+            plan = json.load(plan_file)
+
+    validate_plan(plan)
+    return plan
+
+
+def validate_plan(plan):
+    """
+    Checks the plan for unknown operations, missing fields, duplicate ids,
+    unknown dependencies and dependency cycles. Raises ValueError on the first
+    problem found.
+    """
+    steps = plan.get('steps') if isinstance(plan, dict) else None
+    if not steps:
+        raise ValueError("The plan has no steps")
+
+    ids = set()
+    for step in steps:
+        step_id = step.get('id')
+        if not step_id:
+            raise ValueError("Every step needs an id: %s" % step)
+        if step_id in ids:
+            raise ValueError("Duplicate step id %s" % step_id)
+        ids.add(step_id)
+
+        op = step.get('op')
+        if op not in OPERATIONS:
+            raise ValueError("Step %s has unknown operation %s" % (step_id, op))
+        missing = [f for f in OPERATIONS[op] if step.get(f) in (None, '')]
+        if missing:
+            raise ValueError("Step %s is missing %s" % (step_id, ', '.join(missing)))
+
+    for step in steps:
+        for dep in dependencies(step):
+            if dep not in ids:
+                raise ValueError("Step %s depends on unknown step %s" % (step['id'], dep))
+
+    # Kahn's algorithm, whatever is left over sits on a cycle
+    remaining = dict((s['id'], set(dependencies(s))) for s in steps)
+    while remaining:
+        ready = [k for k, v in remaining.items() if not v]
+        if not ready:
+            raise ValueError("Dependency cycle between steps %s" % ', '.join(sorted(remaining)))
+        for k in ready:
+            del remaining[k]
+        for v in remaining.values():
+            v.difference_update(ready)
+
+
+def dependencies(step):
+    """
+    Returns the ids of the steps this step waits for. Besides the explicit
+    "after" list a step also waits for every step referenced as ${id}.
+    """
+    deps = list(step.get('after') or [])
+    for value in step.values():
+        if isinstance(value, str):
+            for ref in _REFERENCE.findall(value):
+                if ref not in deps:
+                    deps.append(ref)
+    return deps
+
+
+def resource_keys(step):
+    """
+    Returns the resources a step needs exclusive access to. Two steps that
+    share a key are never run at the same time.
+    """
+    keys = set()
+    if step.get('vm'):
+        keys.add('vm:%s' % step['vm'])
+    if step.get('vDiskId'):
+        keys.add('fcd:%s' % step['vDiskId'])
+    return keys
+
+
+def resolve(step, results):
+    """
+    Returns a copy of the step with ${id} references replaced by the results
+    of the steps already run.
+    """
+    def _lookup(match):
+        return str(results[match.group(1)])
+
+    resolved = {}
+    for key, value in step.items():
+        if isinstance(value, str):
+            value = _REFERENCE.sub(_lookup, value)
+        resolved[key] = value
+    return resolved
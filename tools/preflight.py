@@ -0,0 +1,228 @@
+"""
+Preflight validation of a set of planned FCD operations.
+
+Every problem which would make a step fail once it runs is looked for up
+front, for all steps at once, with batched fetches:
+
+    - the VMs with name, config.version and their devices in one paged
+      PropertyCollector retrieval, of the VM objects the caller already
+      has, a container view of all VMs is only walked for the other names
+    - all datastores in one paged retrieval
+    - the snapshots of every FCD a snapshot, delete or revert works on, and
+      the FCDs of every datastore an attach names, one call per FCD or
+      datastore, run in parallel
+
+Steps use the fields of plan.OPERATIONS. A disk a promote step of the same
+set turns into an FCD, and a snapshot id given as a ${step} reference, are
+taken as valid, they only exist once the earlier steps ran.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim, vmodl
+
+from tools import inventory, pchelper, placement, resilience
+
+# operations which need an FCD level snapshot capable VM, hardware version 13 and later
+SNAPSHOT_OPS = ('snapshot', 'delete', 'revert')
+MIN_HW_VERSION = 13
+
+
+def hw_version(config_version):
+    """
+    13 of 'vmx-13', None when it cannot be read.
+    """
+    try:
+        return int((config_version or '').split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _vslm_id(value):
+    id_object = vim.vslm.ID()
+    id_object.id = value
+    return id_object
+
+
+def _vm_record(props):
+    return {
+        'obj': props['obj'],
+        'version': props.get('config.version'),
+        'disks': dict((dev.deviceInfo.label, dev) for dev in props.get('config.hardware.device') or []
+                      if isinstance(dev, vim.vm.device.VirtualDisk)),
+    }
+
+
+def fetch_vms(service_instance, names, page_size=500, resolved=None):
+    """
+    {VM name: {'obj', 'version', 'disks': {label: VirtualDisk}}} of the VMs named.
+
+    :param resolved: {VM name: vim.VirtualMachine} of VMs already looked up,
+                     read directly, the container view is only walked for
+                     the other names
+    """
+    path_set = ['name', 'config.version', 'config.hardware.device']
+    resolved = dict((name, vm_obj) for name, vm_obj in (resolved or {}).items() if name in names and vm_obj)
+    vms = {}
+    if resolved:
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=vm_obj) for vm_obj in resolved.values()],
+            propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=path_set)])
+        by_moid = dict((vm_obj._moId, name) for name, vm_obj in resolved.items())
+        for props in pchelper.retrieve_paged(service_instance.content.propertyCollector, filter_spec, page_size):
+            vms[by_moid[props['obj']._moId]] = _vm_record(props)
+    unresolved = set(names) - set(resolved)
+    if not unresolved:
+        return vms
+    view = pchelper.get_container_view(service_instance, [vim.VirtualMachine])
+    try:
+        for props in pchelper.collect_properties_paged(service_instance, view, vim.VirtualMachine, path_set,
+                                                       page_size):
+            if props.get('name') in unresolved:
+                vms[props['name']] = _vm_record(props)
+        return vms
+    finally:
+        view.Destroy()
+
+
+def _label(step):
+    return 'Hard disk %s' % step['disk']
+
+
+def _is_reference(value):
+    return isinstance(value, str) and '${' in value
+
+
+def _too_deep(step, policy):
+    return "%s of %s would have more than %d snapshots" % (_label(step), step['vm'], policy.max_chain)
+
+
+def check(service_instance, steps, policy=placement.DEFAULT_POLICY, workers=8, vms=None, records=None):
+    """
+    Validates all steps and returns {step id: [problems]} of the steps which
+    would fail, empty when every step can run.
+
+    :param vms: {VM name: vim.VirtualMachine} of VMs the caller already looked up
+    :param records: fetch_vms result of the VMs of the steps the caller
+                    already fetched, nothing is read again
+    """
+    manager = service_instance.content.vStorageObjectManager
+    if records is None:
+        records = fetch_vms(service_instance, set(step['vm'] for step in steps if step.get('vm')), resolved=vms)
+    vms = records
+    datastores = inventory.collect_datastores(service_instance)
+    by_name = dict((ds['name'], moid) for moid, ds in datastores.items())
+    advisor = placement.PlacementAdvisor(dict((moid, dict(ds, fcds=0))
+                                              for moid, ds in datastores.items()), policy)
+    promoted = set((step['vm'], str(step['disk'])) for step in steps if step['op'] == 'promote')
+
+    issues = {}
+
+    def _issue(step, problem):
+        issues.setdefault(step['id'], []).append(problem)
+
+    def _disk(step):
+        """ The VirtualDisk of the step, None after recording why there is none """
+        vm = vms.get(step['vm'])
+        if vm is None:
+            _issue(step, "VM %s is not found" % step['vm'])
+            return None
+        disk = vm['disks'].get(_label(step))
+        if disk is None:
+            _issue(step, "VM %s has no %s" % (step['vm'], _label(step)))
+        return disk
+
+    # first pass, everything the VM and datastore fetches answer
+    snapshot_checks = {}
+    attach_checks = {}
+    # snapshots the steps add to a disk, on top of those it already has
+    added = {}
+    for step in steps:
+        op = step['op']
+        if op == 'attach':
+            if step['vm'] not in vms:
+                _issue(step, "VM %s is not found" % step['vm'])
+            moid = by_name.get(step['ds'])
+            if moid is None:
+                _issue(step, "datastore %s is not found" % step['ds'])
+            elif datastores[moid]['accessible'] is False:
+                _issue(step, "datastore %s is not accessible" % step['ds'])
+            elif not _is_reference(step['vDiskId']):
+                attach_checks.setdefault(moid, []).append(step)
+            continue
+
+        disk = _disk(step)
+        if disk is None:
+            continue
+        if op in SNAPSHOT_OPS:
+            version = hw_version(vms[step['vm']]['version'])
+            if version is not None and version < MIN_HW_VERSION:
+                _issue(step, "VM %s has hardware version %d, FCD snapshots need %d or later"
+                       % (step['vm'], version, MIN_HW_VERSION))
+
+        becomes_fcd = (step['vm'], str(step['disk'])) in promoted
+        if op == 'promote':
+            if disk.vDiskId:
+                _issue(step, "%s of %s is already the FCD %s" % (_label(step), step['vm'], disk.vDiskId.id))
+        elif not disk.vDiskId and not becomes_fcd:
+            _issue(step, "%s of %s is not promoted to FCD" % (_label(step), step['vm']))
+
+        datastore = getattr(disk.backing, 'datastore', None)
+        if datastore is None or datastore._moId not in datastores:
+            _issue(step, "the datastore of %s of %s is not found" % (_label(step), step['vm']))
+            continue
+        if op in ('promote', 'snapshot'):
+            problem = advisor.problem(datastore._moId, 0, new_fcd=False)
+            if problem:
+                _issue(step, problem)
+        if op == 'snapshot' and policy.max_chain:
+            key = (step['vm'], str(step['disk']))
+            added[key] = added.get(key, 0) + 1
+            step = dict(step, added=added[key])
+            if disk.vDiskId:
+                snapshot_checks.setdefault((disk.vDiskId.id, datastore._moId), []).append(step)
+            elif step['added'] > policy.max_chain:
+                _issue(step, _too_deep(step, policy))
+        if op in ('delete', 'revert') and disk.vDiskId and not _is_reference(step['snid']):
+            snapshot_checks.setdefault((disk.vDiskId.id, datastore._moId), []).append(step)
+
+    # second pass, the per FCD and per datastore calls, in parallel
+    def _snapshots(item):
+        (vdisk_id, moid), _ = item
+        try:
+            info = manager.RetrieveSnapshotInfo(_vslm_id(vdisk_id), datastores[moid]['obj'])
+            return set(snapshot.id.id for snapshot in info.snapshots or []), None
+        except Exception as e:
+            return None, resilience.fault_message(e)
+
+    def _fcds(item):
+        moid, _ = item
+        try:
+            return set(fcd.id for fcd in manager.ListVStorageObject(datastores[moid]['obj']) or []), None
+        except Exception as e:
+            return None, resilience.fault_message(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        snapshot_items = list(snapshot_checks.items())
+        attach_items = list(attach_checks.items())
+        snapshot_found = threads.map(_snapshots, snapshot_items)
+        attach_found = threads.map(_fcds, attach_items)
+        snapshot_found, attach_found = list(snapshot_found), list(attach_found)
+
+    for ((vdisk_id, _), waiting), (ids, error) in zip(snapshot_items, snapshot_found):
+        for step in waiting:
+            if error is not None:
+                _issue(step, "the snapshots of FCD %s could not be read : %s" % (vdisk_id, error))
+            elif step['op'] == 'snapshot':
+                if len(ids) + step['added'] > policy.max_chain:
+                    _issue(step, _too_deep(step, policy))
+            elif step['snid'] not in ids:
+                _issue(step, "FCD %s has no snapshot %s" % (vdisk_id, step['snid']))
+
+    for (moid, waiting), (ids, error) in zip(attach_items, attach_found):
+        for step in waiting:
+            if error is not None:
+                _issue(step, "the FCDs of datastore %s could not be listed : %s" % (step['ds'], error))
+            elif step['vDiskId'] not in ids:
+                _issue(step, "FCD %s is not on datastore %s" % (step['vDiskId'], step['ds']))
+
+    return issues
@@ -0,0 +1,152 @@
+"""
+Bulk creation of FCDs from an FCD snapshot.
+
+CreateDiskFromSnapshot_Task creates the new disk on the datastore of the
+source FCD. Disks meant for other datastores are cloned with
+CloneVStorageObject_Task from a seed disk created from the snapshot, so the
+snapshot is read once per run and not once per disk:
+
+    - the disks placed on the source datastore come straight from the snapshot
+    - the first of them is the seed, when no disk is placed there a temporary
+      seed is created and deleted after the clones
+
+Every creation and clone takes a slot of a ConcurrencyController on the
+datastore the disk is written to, a clone also one on the source datastore
+it reads from, and then runs on a session of a SessionPool, so creations
+waiting for a busy datastore hold no session. When the temporary
+seed cannot be deleted the records are still returned, each clone noting
+the leftover seed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim
+
+from tools import resilience
+
+
+def _vslm_id(value):
+    id_object = vim.vslm.ID()
+    id_object.id = value
+    return id_object
+
+
+def source_disk(content, vdisk_id, ds_obj):
+    """
+    (provisioned size in bytes, provisioning type) of the FCD.
+    """
+    vstorage = content.vStorageObjectManager.RetrieveVStorageObject(_vslm_id(vdisk_id), ds_obj)
+    return vstorage.config.capacityInMB * 1024 * 1024, getattr(vstorage.config.backing, 'provisioningType', None)
+
+
+def capacity_bytes(content, vdisk_id, ds_obj):
+    """
+    Provisioned size of the FCD.
+    """
+    return source_disk(content, vdisk_id, ds_obj)[0]
+
+
+def from_snapshot(si, content, vdisk_id, ds_obj, snapshot_id, name):
+    """
+    Creates an FCD from the snapshot on the datastore of the source, returns its vDiskId.
+    """
+    task = content.vStorageObjectManager.CreateDiskFromSnapshot_Task(_vslm_id(vdisk_id), ds_obj,
+                                                                     _vslm_id(snapshot_id), name)
+    resilience.wait_for_tasks(si, [task])
+    return task.info.result.config.id.id
+
+
+def clone(si, content, vdisk_id, ds_obj, target_ds_obj, name, provisioning_type=None):
+    """
+    Clones the FCD to the target datastore, returns the vDiskId of the clone.
+
+    :param provisioning_type: 'thin', 'lazyZeroedThick' or 'eagerZeroedThick',
+                              None leaves it to vCenter
+    """
+    backing = vim.vslm.CreateSpec.DiskFileBackingSpec(datastore=target_ds_obj, provisioningType=provisioning_type)
+    spec = vim.vslm.CloneSpec(name=name, backingSpec=backing)
+    task = content.vStorageObjectManager.CloneVStorageObject_Task(_vslm_id(vdisk_id), ds_obj, spec)
+    resilience.wait_for_tasks(si, [task])
+    return task.info.result.config.id.id
+
+
+def delete(si, content, vdisk_id, ds_obj):
+    task = content.vStorageObjectManager.DeleteVStorageObject_Task(_vslm_id(vdisk_id), ds_obj)
+    resilience.wait_for_tasks(si, [task])
+
+
+def provision(pool, controller, datastores, vdisk_id, source_moid, snapshot_id, placements, names,
+              workers=16, provisioning_type=None):
+    """
+    Creates one FCD per placement from the snapshot of the source FCD.
+
+    :param pool: sessionpool.SessionPool the calls run on
+    :param controller: concurrency.ConcurrencyController, slots per target
+                       datastore and, for clones, the source datastore
+    :param datastores: {moId: {'obj', 'name', ...}} covering the source and the placements
+    :param placements: target datastore moIds, e.g. from placement.PlacementAdvisor.place()
+    :param names: name of every new disk, same length as placements
+    :param provisioning_type: provisioning type of the clones, e.g. that of
+                              the source FCD from source_disk()
+    :return: one record per disk, in placement order:
+             {'name', 'datastore', 'vDiskId', 'method', 'ok', 'error'},
+             clones with 'warning' when the temporary seed is left over
+    """
+    source_ds = datastores[source_moid]['obj']
+    items = [{'name': name, 'datastore': moid, 'vDiskId': None} for moid, name in zip(placements, names)]
+    local = [item for item in items if item['datastore'] == source_moid]
+    remote = [item for item in items if item['datastore'] != source_moid]
+
+    def _create(item, method, seed=None):
+        target_ds = datastores[item['datastore']]['obj']
+        item['method'] = method
+        try:
+            # the slot is taken before the session, a creation waiting for room holds no session.
+            # Clones read the seed, so the source datastore carries their load too
+            with controller.slot(datastore=item['datastore'], source=source_moid if method == 'clone' else None,
+                                 operation=method), pool.checkout() as session:
+                if method == 'snapshot':
+                    item['vDiskId'] = from_snapshot(session.si, session.content, vdisk_id, source_ds,
+                                                    snapshot_id, item['name'])
+                else:
+                    item['vDiskId'] = clone(session.si, session.content, seed, source_ds, target_ds,
+                                            item['name'], provisioning_type)
+        except Exception as e:
+            item['ok'], item['error'] = False, resilience.fault_message(e)
+            return item
+        item['ok'], item['error'] = True, None
+        return item
+
+    seed, temporary = None, False
+    if remote:
+        if local:
+            seed = _create(local.pop(0), 'snapshot').get('vDiskId')
+        else:
+            try:
+                with pool.checkout() as session:
+                    seed = from_snapshot(session.si, session.content, vdisk_id, source_ds, snapshot_id,
+                                         '%s-seed' % names[0])
+                temporary = True
+            except Exception as e:
+                for item in remote:
+                    item.update(method='clone', ok=False, vDiskId=None,
+                                error='the seed disk could not be created : %s' % resilience.fault_message(e))
+                remote = []
+        if seed is None:
+            for item in remote:
+                item.update(method='clone', ok=False, vDiskId=None, error='the seed disk could not be created')
+            remote = []
+
+    try:
+        jobs = [(item, 'snapshot') for item in local] + [(item, 'clone') for item in remote]
+        with ThreadPoolExecutor(max_workers=workers) as threads:
+            list(threads.map(lambda job: _create(job[0], job[1], seed), jobs))
+    finally:
+        if temporary:
+            try:
+                with pool.checkout() as session:
+                    delete(session.si, session.content, seed, source_ds)
+            except Exception as e:
+                warning = 'the temporary seed FCD %s could not be deleted : %s' % (seed, resilience.fault_message(e))
+                for item in remote:
+                    item['warning'] = warning
+    return items
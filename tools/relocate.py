@@ -0,0 +1,289 @@
+"""
+Bulk relocation of FCDs between datastores.
+
+    - unattached FCDs move with RelocateVStorageObject_Task, FCDs attached to
+      a VM with a RelocateVM_Task moving only that disk, so the VM keeps
+      running on it
+    - Dispatcher starts a move only while its source and its destination
+      datastore are below their limit of moves in flight. These limits are
+      upper bounds, with a ConcurrencyController every move also holds a
+      slot of its destination datastore, whose AIMD limit shrinks below
+      the bound on busy faults and rising latency. Among the moves
+      allowed it starts the one whose datastores drain their bytes in
+      flight soonest, at the throughput measured on earlier moves, the
+      largest disk first when that is a tie, so no datastore pair is
+      saturated while others idle and big moves do not trail at the end
+    - Progress reads info.progress of every running task in one
+      PropertyCollector call and derives the ETA from the bytes moved
+    - Journal appends every start and end of a move to a file, a run started
+      again with the same journal skips the finished moves and waits for the
+      tasks an interrupted run left running
+"""
+import json
+import os
+import threading
+import time
+
+from pyVmomi import vim, vmodl
+
+from tools import concurrency, pchelper, placement, resilience, sessionpool
+
+# throughput assumed for a datastore before a move on it finished, bytes per second
+DEFAULT_RATE = 100 * 1024 * 1024
+
+
+def assign_targets(moves, advisor, targets):
+    """
+    Sets 'target' of every move without one to the datastore among targets
+    the advisor chooses, largest disk first. A move already on its target
+    is left alone.
+
+    :param moves: [{'vDiskId', 'source', 'size'}], datastore moIds
+    :param advisor: placement.PlacementAdvisor covering the targets
+    :raise ValueError: when a disk fits on no target without going past the thresholds
+    """
+    for move in sorted(moves, key=lambda m: -m['size']):
+        if move.get('target'):
+            continue
+        try:
+            move['target'] = advisor.choose(move['size'], candidates=targets, exclude=(move['source'],))
+        except placement.PlacementRejected:
+            raise ValueError("FCD %s of %d MB fits on none of the target datastores"
+                             % (move['vDiskId'], move['size'] // (1024 * 1024)))
+    return moves
+
+
+class Journal(object):
+    """
+    Append only record of the moves of a run, one JSON line per event.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        {vDiskId: last event} of the moves in the journal.
+        """
+        last = {}
+        if os.path.exists(self.path):
+            with open(self.path) as journal:
+                for line in journal:
+                    if line.endswith('\n'):
+                        event = json.loads(line)
+                        last[event['vDiskId']] = event
+        return last
+
+    def write(self, **event):
+        event['time'] = time.time()
+        with self._lock:
+            with open(self.path, 'a') as journal:
+                journal.write(json.dumps(event, sort_keys=True) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+
+
+class Dispatcher(object):
+    """
+    Picks the next move under the per source and per destination limits.
+    """
+
+    def __init__(self, moves, source_limit=2, target_limit=2):
+        self.pending = list(moves)
+        self.source_limit = source_limit
+        self.target_limit = target_limit
+        self.in_flight = {}
+        self.bytes_in_flight = {}
+        self.rates = {}
+
+    def _rate(self, moid):
+        if moid in self.rates:
+            return self.rates[moid]
+        return sum(self.rates.values()) / len(self.rates) if self.rates else DEFAULT_RATE
+
+    def _allowed(self, move):
+        return (self.in_flight.get(('source', move['source']), 0) < self.source_limit and
+                self.in_flight.get(('target', move['target']), 0) < self.target_limit)
+
+    def _drain_time(self, move):
+        return (self.bytes_in_flight.get(move['source'], 0) / self._rate(move['source']) +
+                self.bytes_in_flight.get(move['target'], 0) / self._rate(move['target']))
+
+    def next(self):
+        """
+        Takes the best move that may start now out of pending, None when none may.
+        """
+        allowed = [move for move in self.pending if self._allowed(move)]
+        if not allowed:
+            return None
+        move = min(allowed, key=lambda m: (self._drain_time(m), -m['size']))
+        self.pending.remove(move)
+        for key in (('source', move['source']), ('target', move['target'])):
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        for moid in (move['source'], move['target']):
+            self.bytes_in_flight[moid] = self.bytes_in_flight.get(moid, 0) + move['size']
+        return move
+
+    def finished(self, move, seconds, ok):
+        for key in (('source', move['source']), ('target', move['target'])):
+            self.in_flight[key] -= 1
+        for moid in (move['source'], move['target']):
+            self.bytes_in_flight[moid] -= move['size']
+            if ok and seconds > 0:
+                rate = move['size'] / seconds
+                # moving average, a single odd move does not swing the plan
+                self.rates[moid] = rate if moid not in self.rates else self.rates[moid] * 0.7 + rate * 0.3
+
+
+class Progress(object):
+    """
+    Bytes moved, in flight progress and ETA of a run.
+    """
+
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        self.done = 0
+        self.failed = 0
+        self.running = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def start(self, move, task):
+        with self._lock:
+            self.running[move['vDiskId']] = (move, task, 0)
+
+    def end(self, move, ok):
+        with self._lock:
+            self.running.pop(move['vDiskId'], None)
+            if ok:
+                self.done += 1
+                self.done_bytes += move['size']
+            else:
+                self.failed += 1
+                self.total_bytes -= move['size']
+
+    def poll(self, service_instance):
+        """
+        Reads info.progress of all running tasks in one call.
+        """
+        with self._lock:
+            tasks = dict((task, vdisk_id) for vdisk_id, (_, task, _) in self.running.items() if task is not None)
+        if not tasks:
+            return
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks],
+            propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=['info.progress'])])
+        try:
+            found = list(pchelper.retrieve_paged(service_instance.content.propertyCollector, filter_spec))
+        except vmodl.fault.ManagedObjectNotFound:
+            return
+        with self._lock:
+            for props in found:
+                vdisk_id = tasks.get(props['obj'])
+                if vdisk_id in self.running:
+                    move, task, _ = self.running[vdisk_id]
+                    self.running[vdisk_id] = (move, task, props.get('info.progress') or 0)
+
+    def snapshot(self):
+        """
+        {'done', 'failed', 'running', 'moved', 'total', 'rate', 'eta'}, bytes and seconds.
+        """
+        with self._lock:
+            moved = self.done_bytes + sum(move['size'] * percent / 100.0
+                                          for move, _, percent in self.running.values())
+            elapsed = max(time.time() - self.started, 1e-6)
+            rate = moved / elapsed
+            remaining = max(self.total_bytes - moved, 0)
+            return {'done': self.done, 'failed': self.failed, 'running': len(self.running),
+                    'moved': moved, 'total': self.total_bytes, 'rate': rate,
+                    'eta': remaining / rate if rate else None}
+
+
+def start_move(session, move, datastores):
+    """
+    Starts the relocation task of one move on the session and returns it.
+    """
+    target_ds = sessionpool.rebind(datastores[move['target']]['obj'], session.si)
+    if move.get('vm'):
+        # only the disk moves, the VM and its other disks stay where they are
+        locator = vim.vm.RelocateSpec.DiskLocator(diskId=move['deviceKey'], datastore=target_ds)
+        vm_obj = vim.VirtualMachine(move['vm'], session.si._stub)
+        return vm_obj.RelocateVM_Task(vim.vm.RelocateSpec(disk=[locator]))
+    id_object = vim.vslm.ID()
+    id_object.id = move['vDiskId']
+    backing = vim.vslm.CreateSpec.DiskFileBackingSpec(datastore=target_ds)
+    spec = vim.vslm.RelocateSpec(backingSpec=backing)
+    return session.content.vStorageObjectManager.RelocateVStorageObject_Task(
+        id_object, sessionpool.rebind(datastores[move['source']]['obj'], session.si), spec)
+
+
+def run(pool, moves, datastores, journal, progress, source_limit=2, target_limit=2, workers=8,
+        on_done=None, controller=None):
+    """
+    Runs the moves, at most workers at a time, and returns them with 'ok'
+    and 'error' set. Moves whose journal entry is a running task are waited
+    for instead of started again.
+
+    :param on_done: callable(move) run after every move
+    :param controller: concurrency.ConcurrencyController, slots per destination datastore
+    """
+    dispatcher = Dispatcher(moves, source_limit, target_limit)
+    cond = threading.Condition()
+    running = [0]
+    resumed = journal.load()
+
+    def _move(move):
+        started = time.time()
+        task = None
+        try:
+            previous = resumed.get(move['vDiskId'])
+            if previous and previous['state'] == 'started' and previous.get('task'):
+                with pool.checkout() as session:
+                    task = vim.Task(previous['task'], session.si._stub)
+                    progress.start(move, task)
+                    resilience.wait_for_tasks(session.si, [task])
+            else:
+                # the slot is taken before the session, a move waiting for room holds no session
+                with concurrency.slot_or_null(controller, datastore=move['target'], operation='relocate'):
+                    with pool.checkout() as session:
+                        task = start_move(session, move, datastores)
+                        journal.write(vDiskId=move['vDiskId'], state='started', task=task._moId,
+                                      source=move['source'], target=move['target'])
+                        progress.start(move, task)
+                        resilience.wait_for_tasks(session.si, [task])
+            move['ok'], move['error'] = True, None
+        except Exception as e:
+            move['ok'], move['error'] = False, resilience.fault_message(e)
+        try:
+            journal.write(vDiskId=move['vDiskId'], state='done' if move['ok'] else 'failed',
+                          task=task._moId if task is not None else None, error=move['error'],
+                          source=move['source'], target=move['target'])
+            progress.end(move, move['ok'])
+        finally:
+            # the dispatch loop waits on running, it must drop even when the bookkeeping fails
+            with cond:
+                try:
+                    dispatcher.finished(move, time.time() - started, move['ok'])
+                finally:
+                    running[0] -= 1
+                    cond.notify_all()
+        if on_done:
+            on_done(move)
+
+    threads = []
+    with cond:
+        while dispatcher.pending or running[0]:
+            move = dispatcher.next() if running[0] < workers else None
+            if move is None:
+                cond.wait()
+                continue
+            running[0] += 1
+            thread = threading.Thread(target=_move, args=(move,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return moves
@@ -0,0 +1,252 @@
+"""
+Retry, backoff and circuit breaking for vSphere SOAP calls and task waits.
+
+install() wraps the InvokeMethod of a connection's stub, so every SOAP call
+made through that connection, property reads included, goes through the
+retry policy:
+
+    si = SmartConnectNoSSL(host=..., user=user, pwd=pwd)
+    resilience.install(si, user, pwd)
+
+Faults are classified as
+    - busy: vCenter refused the call for now (TaskInProgress, ...), raised
+      to the caller so a ConcurrencyController slot sees it and backs off,
+      the scheduler or the caller decides whether to try again
+    - session lost: NotAuthenticated, the session is logged in again with the
+      same stub and the call retried
+    - connection: socket and HTTP errors, retried only for calls that do not
+      change anything (reads, retrievals, WaitForUpdates) because a call that
+      was sent before the connection broke may already have run
+    - anything else is raised right away
+
+Connection errors and server side system errors also count against a circuit
+breaker. Once it opens, calls fail fast with CircuitOpenError until the
+cool down has passed and a trial call succeeds.
+"""
+import logging
+import random
+import socket
+import threading
+import time
+
+try:
+    from http.client import HTTPException
+except ImportError:
+    from httplib import HTTPException
+
+from pyVmomi import vim, vmodl
+
+from tools import tasks
+
+BUSY_FAULTS = (
+    vim.fault.TaskInProgress,
+    vim.fault.ResourceInUse,
+    vim.fault.ConcurrentAccess,
+    vim.fault.FileLocked,
+    vmodl.fault.HostCommunication,
+)
+
+SESSION_FAULTS = (
+    vim.fault.NotAuthenticated,
+)
+
+CONNECTION_ERRORS = (
+    socket.error,
+    HTTPException,
+)
+
+# server side faults telling us vCenter itself is unwell
+UNHEALTHY_FAULTS = (
+    vmodl.fault.SystemError,
+)
+
+# calls without side effects, safe to send again after a broken connection
+_SAFE_METHOD_PREFIXES = ('Fetch', 'Retrieve', 'ContinueRetrieve', 'List', 'Query', 'Find',
+                         'WaitForUpdates', 'CheckForUpdates', 'CurrentTime', 'ReadNext', 'ReadPrevious')
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling vCenter while the circuit breaker is open.
+    """
+
+    def __init__(self, retry_in):
+        Exception.__init__(self, "vCenter looks unhealthy, calls are suspended for %.0fs" % retry_in)
+        self.msg = self.args[0]
+        self.retry_in = retry_in
+
+
+def fault_message(exc):
+    """
+    vim faults carry their text in msg, plain python exceptions do not.
+    """
+    return getattr(exc, 'msg', None) or str(exc) or exc.__class__.__name__
+
+
+def is_retryable(exc):
+    """
+    True for faults where the same call made a bit later is expected to work.
+    """
+    return isinstance(exc, BUSY_FAULTS + SESSION_FAULTS + CONNECTION_ERRORS) or \
+        isinstance(exc, CircuitOpenError)
+
+
+def backoff_delays(retries, base_delay=1.0, max_delay=30.0):
+    """
+    Yields the sleep before every retry: exponential backoff with full jitter.
+    """
+    for attempt in range(retries):
+        yield random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker(object):
+    """
+    Opens after failure_threshold consecutive unhealthy failures and stays
+    open for reset_timeout seconds. Then a single trial call is let through,
+    its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.time()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(max(remaining, 1.0))
+            self._trial = True
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial:
+                    logging.warning("Opening the circuit after %s unhealthy vCenter calls", self.failures)
+                self.opened_at = time.time()
+                self._trial = False
+
+
+class RetryPolicy(object):
+    """
+    Runs calls with retries, re-authentication and a circuit breaker.
+
+    :param login: callable logging the session in again, None to disable
+    """
+
+    def __init__(self, retries=4, base_delay=1.0, max_delay=30.0, breaker=None, login=None):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.login = login
+        self._login_lock = threading.Lock()
+        self._session_generation = 0
+
+    def call(self, fn, args=(), kwargs=None, safe=True):
+        """
+        Calls fn(*args, **kwargs) under the policy.
+
+        :param safe: whether the call may be sent again after a connection
+                     error, i.e. it has no side effects
+        """
+        kwargs = kwargs or {}
+        delays = backoff_delays(self.retries, self.base_delay, self.max_delay)
+        while True:
+            self.breaker.before_call()
+            generation = self._session_generation
+            try:
+                result = fn(*args, **kwargs)
+            except SESSION_FAULTS:
+                self.breaker.on_success()
+                if self.login is None:
+                    raise
+                self._relogin(generation)
+                delay = next(delays, None)
+                if delay is None:
+                    raise
+                continue
+            except CONNECTION_ERRORS + UNHEALTHY_FAULTS as e:
+                self.breaker.on_failure()
+                delay = next(delays, None)
+                if delay is None or not safe or not is_retryable(e):
+                    raise
+            except BUSY_FAULTS:
+                # retrying here would hide the fault from the concurrency limits
+                self.breaker.on_success()
+                raise
+            else:
+                self.breaker.on_success()
+                return result
+            time.sleep(delay)
+
+    def _relogin(self, generation):
+        # only the first thread noticing the lost session logs in again
+        with self._login_lock:
+            if generation == self._session_generation:
+                logging.info("The vCenter session was lost, logging in again")
+                self.login()
+                self._session_generation += 1
+
+
+def install(si, user, pwd, policy=None):
+    """
+    Routes every SOAP call of the connection through the retry policy.
+
+    :return RetryPolicy: the policy installed
+    """
+    stub = si._stub
+    invoke = stub.InvokeMethod
+    local = threading.local()
+
+    def _login():
+        local.bypass = True
+        try:
+            si.content.sessionManager.Login(user, pwd)
+        finally:
+            local.bypass = False
+
+    if policy is None:
+        policy = RetryPolicy(login=_login)
+    elif policy.login is None:
+        policy.login = _login
+
+    def _invoke(mo, info, args, *rest):
+        if getattr(local, 'bypass', False):
+            return invoke(mo, info, args, *rest)
+        safe = info.wsdlName.startswith(_SAFE_METHOD_PREFIXES)
+        return policy.call(invoke, (mo, info, args) + rest, safe=safe)
+
+    stub.InvokeMethod = _invoke
+    return policy
+
+
+def wait_for_tasks(service_instance, task_list, policy=None):
+    """
+    tools.tasks.wait_for_tasks which survives connection drops and session
+    loss while waiting. The tasks keep running inside vCenter, so waiting
+    again with a fresh property filter is always safe.
+    Errors of the tasks themselves are raised as they are.
+    """
+    delays = backoff_delays(policy.retries if policy else 4)
+    while True:
+        try:
+            return tasks.wait_for_tasks(service_instance, task_list)
+        except CONNECTION_ERRORS + SESSION_FAULTS + (vmodl.query.InvalidCollectorVersion,):
+            # a new session has none of the property filters of the old one
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            time.sleep(delay)
@@ -0,0 +1,137 @@
+"""
+Dependency aware parallel scheduler for plan steps.
+
+Steps whose dependencies have succeeded are handed to a thread pool as soon as
+none of their resources (see plan.resource_keys) is held by a running step, so
+independent work runs in parallel while operations on the same VM or FCD are
+serialized. Steps depending on a failed step are skipped. When a
+concurrency controller is given, each step also waits for a slot on the
+datastore and host it touches (see concurrency.ConcurrencyController).
+"""
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from tools import plan
+from tools.resilience import is_retryable, fault_message
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def run_steps(steps, execute, max_workers=4, retries=0, retry_delay=5.0,
+              is_transient=is_retryable, controller=None, placement=None, blocked=None,
+              resources=plan.resource_keys):
+    """
+    Runs the plan steps and returns one report record per step, in plan order.
+
+    :param steps: validated plan steps
+    :param execute: callable taking a resolved step and returning its result
+    :param max_workers: number of steps run at the same time
+    :param retries: how often a step failing with a transient fault is retried
+    :param retry_delay: seconds to wait before the first retry, doubled after
+                        every further attempt
+    :param is_transient: callable deciding whether an exception is transient
+    :param controller: optional concurrency.ConcurrencyController
+    :param placement: callable returning {'datastore': .., 'host': ..} for a
+                      resolved step, used to pick the controller limits
+    :param blocked: {step id: reason} of steps not to run, e.g. from a
+                    preflight check, they and their dependents are skipped
+    :param resources: callable returning the resource keys of a resolved
+                      step, plan.resource_keys by default
+    :return list: [{'id': 'snap', 'op': 'snapshot', 'status': 'succeeded', ...}]
+    """
+    pending = OrderedDict((s['id'], s) for s in steps)
+    report = {}
+    results = {}
+    busy = set()
+    running = {}
+
+    for step_id, reason in (blocked or {}).items():
+        if step_id in pending:
+            report[step_id] = _record(pending.pop(step_id), SKIPPED, error=reason)
+
+    def _status(step_id):
+        return report.get(step_id, {}).get('status')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for step_id, step in list(pending.items()):
+                    failed = [d for d in plan.dependencies(step) if _status(d) in (FAILED, SKIPPED)]
+                    if failed:
+                        report[step_id] = _record(step, SKIPPED, error="dependency %s did not succeed" % failed[0])
+                        del pending[step_id]
+                        changed = True
+
+            for step_id, step in list(pending.items()):
+                if len(running) >= max_workers:
+                    break
+                if any(_status(d) != SUCCEEDED for d in plan.dependencies(step)):
+                    continue
+                resolved = plan.resolve(step, results)
+                keys = resources(resolved)
+                if keys & busy:
+                    continue
+                busy |= keys
+                future = pool.submit(_run_step, resolved, execute, retries, retry_delay, is_transient,
+                                     controller, placement)
+                running[future] = (step_id, keys)
+                del pending[step_id]
+
+            if not running:
+                # nothing can make progress any more, validate_plan should have prevented this
+                for step_id, step in pending.items():
+                    report[step_id] = _record(step, SKIPPED, error="dependencies never became ready")
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                step_id, keys = running.pop(future)
+                busy -= keys
+                report[step_id] = future.result()
+                if report[step_id]['status'] == SUCCEEDED:
+                    results[step_id] = report[step_id]['result']
+
+    return [report[s['id']] for s in steps]
+
+
+def _run_step(step, execute, retries, retry_delay, is_transient, controller, placement):
+    started = time.time()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            result = _execute(step, execute, controller, placement)
+            return _record(step, SUCCEEDED, result=result, attempts=attempts, started=started)
+        except Exception as e:
+            if attempts > retries or not is_transient(e):
+                return _record(step, FAILED, error=fault_message(e), attempts=attempts, started=started)
+            # an open circuit tells how long vCenter should be left alone
+            time.sleep(getattr(e, 'retry_in', None) or retry_delay * (2 ** (attempts - 1)))
+
+
+def _execute(step, execute, controller, placement):
+    if controller is None:
+        return execute(step)
+    where = placement(step) if placement else {}
+    with controller.slot(operation=step['op'], **where):
+        return execute(step)
+
+
+def _record(step, status, result=None, error=None, attempts=0, started=None):
+    finished = time.time()
+    return {
+        'id': step['id'],
+        'op': step['op'],
+        'status': status,
+        'attempts': attempts,
+        'started': datetime.fromtimestamp(started).isoformat() if started else None,
+        'duration': round(finished - started, 3) if started else 0,
+        'result': result,
+        'error': error,
+    }
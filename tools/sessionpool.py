@@ -0,0 +1,204 @@
+"""
+Pool of authenticated vCenter sessions for thread parallel SOAP calls.
+
+Every session has its own stub, so its own cookie and its own keep-alive
+HTTP connections, and a thread holds a session exclusively between checkout
+and return. Sessions are opened lazily up to the pool size. A background
+thread calls CurrentTime on sessions idle for longer than the keep-alive
+interval, so vCenter does not expire them between bursts of work. A session
+being pinged stays in the pool, marked, and checkouts wait for it rather
+than share it or open another one.
+
+Usage:
+    pool = SessionPool(host, user, pwd, size=8)
+    with pool.checkout() as session:
+        vm = sessionpool.rebind(vm, session.si)
+        task = vm.AttachDisk_Task(...)
+    pool.close()
+
+Managed objects are bound to the stub of the session that returned them.
+Passing them as arguments to calls on another session is fine, but to call
+their own methods from another session rebind() them first.
+"""
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+
+from tools import resilience
+
+Session = namedtuple('Session', ['si', 'content'])
+
+
+def rebind(mo, si):
+    """
+    Returns the same managed object bound to the stub of si.
+    """
+    if mo is None or mo._stub is si._stub:
+        return mo
+    return mo.__class__(mo._moId, si._stub)
+
+
+class _Checkout(object):
+    """
+    Context of SessionPool.checkout. A class and not a generator, a pyVmomi
+    fault thrown into a generator context fails on the __traceback__ the
+    context sets on it.
+    """
+
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.session = None
+
+    def __enter__(self):
+        self.session = self.pool._take(self.timeout)
+        return self.session
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool._give_back(self.session)
+        return False
+
+
+class SessionPool(object):
+
+    def __init__(self, host, user, pwd, port=443, size=4, keepalive=600, seed=None, on_connect=None):
+        """
+        :param size: maximum number of sessions
+        :param keepalive: seconds of idleness after which a session is pinged,
+                          0 disables the pings
+        :param seed: already connected service instance to adopt as first session,
+                     it stays connected when the pool is closed
+        :param on_connect: called with every service instance the pool opens,
+                           e.g. transport.tuner(args)
+        """
+        self.host = host
+        self.user = user
+        self.pwd = pwd
+        self.port = port
+        self.size = size
+        self.keepalive = keepalive
+        self._idle = []
+        self._sessions = []
+        self._last_used = {}
+        # ids of the idle sessions the keep-alive thread is pinging
+        self._pinging = set()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._closed = threading.Event()
+        self._seed = seed
+        self._on_connect = on_connect
+
+        if seed is not None:
+            self._add(seed)
+
+        if keepalive:
+            thread = threading.Thread(target=self._keepalive_loop, name='sessionpool-%s' % host)
+            thread.daemon = True
+            thread.start()
+
+    def _add(self, si):
+        session = Session(si, si.RetrieveContent())
+        with self._cond:
+            self._sessions.append(session)
+            self._last_used[id(session)] = time.time()
+            self._idle.append(session)
+            self._cond.notify()
+
+    def _connect(self):
+        si = SmartConnectNoSSL(host=self.host, user=self.user, pwd=self.pwd, port=int(self.port))
+        resilience.install(si, self.user, self.pwd)
+        if self._on_connect is not None:
+            self._on_connect(si)
+        return si
+
+    def checkout(self, timeout=None):
+        """
+        Hands out an idle session, opening a new one while the pool is below
+        its size, otherwise waiting for one to be returned.
+
+        :raise Empty: when timeout seconds pass without a session
+        """
+        return _Checkout(self, timeout)
+
+    def _take(self, timeout):
+        deadline = time.time() + timeout if timeout is not None else None
+        grow = False
+        with self._cond:
+            while True:
+                free = [s for s in self._idle if id(s) not in self._pinging]
+                if free:
+                    session = free[0]
+                    self._idle.remove(session)
+                    break
+                # idle sessions being pinged are back shortly, no need for another one
+                if not self._idle and len(self._sessions) < self.size:
+                    # reserve the place before the slow login
+                    self._sessions.append(None)
+                    grow = True
+                    break
+                wait = deadline - time.time() if deadline is not None else None
+                if wait is not None and wait <= 0:
+                    raise Empty()
+                self._cond.wait(wait)
+        if grow:
+            try:
+                si = self._connect()
+                session = Session(si, si.RetrieveContent())
+            except Exception:
+                with self._cond:
+                    self._sessions.remove(None)
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._sessions[self._sessions.index(None)] = session
+        return session
+
+    def _give_back(self, session):
+        with self._cond:
+            self._last_used[id(session)] = time.time()
+            self._idle.append(session)
+            self._cond.notify()
+
+    def sessions(self):
+        """
+        The sessions opened so far, idle or checked out.
+        """
+        with self._lock:
+            return [s for s in self._sessions if s is not None]
+
+    def _keepalive_loop(self):
+        while not self._closed.wait(min(self.keepalive, 60)):
+            with self._cond:
+                stale = [s for s in self._idle if time.time() - self._last_used[id(s)] >= self.keepalive]
+                self._pinging.update(id(s) for s in stale)
+            for session in stale:
+                try:
+                    session.si.CurrentTime()
+                    self._last_used[id(session)] = time.time()
+                except Exception:
+                    # the retry policy of the session logs in again on the next real call
+                    pass
+                finally:
+                    with self._cond:
+                        self._pinging.discard(id(session))
+                        self._cond.notify()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            sessions = [s for s in self._sessions if s is not None]
+            self._sessions = []
+        for session in sessions:
+            if session.si is self._seed:
+                continue
+            try:
+                Disconnect(session.si)
+            except Exception:
+                pass
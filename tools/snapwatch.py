@@ -0,0 +1,325 @@
+"""
+Change feed of VM and FCD snapshots.
+
+One PropertyCollector of its own, waited on with WaitForUpdatesEx, carries
+two filters:
+
+    - snapshot and config.hardware.device of the watched VMs, vCenter sends
+      a VM only when its snapshot tree or its devices changed
+    - the recentTask list of the TaskManager, through which FCD snapshot
+      operations (create, delete, revert of a vStorageObject) are noticed,
+      as they do not touch any VM property
+
+The snapshot list of an FCD is only read when it first shows up and after
+an FCD snapshot task finished on it. The task names the FCD in the
+arguments of its description, or its datastore as entity or entity name;
+only when it names neither are all attached FCDs read again. The reads of
+one update run in parallel on a bounded pool. Between changes the watch
+costs one pending WaitForUpdatesEx call.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim, vmodl
+
+from tools import pchelper, resilience
+
+FCD_SNAPSHOT_TASK = re.compile(r'VStorageObjectManager\.\w*(snapshot|revert)', re.IGNORECASE)
+
+
+def _snapshots(snapshot_info):
+    """
+    {snapshot moId: record} of a VM snapshot tree, plus the current snapshot moId.
+    """
+    if snapshot_info is None:
+        return {}, None
+    nodes = {}
+    stack = [(0, node) for node in snapshot_info.rootSnapshotList or []]
+    while stack:
+        depth, node = stack.pop()
+        nodes[node.snapshot._moId] = {'id': node.snapshot._moId, 'name': node.name, 'depth': depth,
+                                      'description': node.description, 'createTime': node.createTime}
+        stack.extend((depth + 1, child) for child in node.childSnapshotList or [])
+    current = snapshot_info.currentSnapshot
+    return nodes, current._moId if current is not None else None
+
+
+def _disks(devices):
+    """
+    {device key: record} of the virtual disks in a device list.
+    """
+    disks = {}
+    for dev in devices or []:
+        if isinstance(dev, vim.vm.device.VirtualDisk):
+            disks[dev.key] = {'label': dev.deviceInfo.label,
+                              'vDiskId': dev.vDiskId.id if dev.vDiskId else None,
+                              'datastore': getattr(dev.backing, 'datastore', None),
+                              'fileName': getattr(dev.backing, 'fileName', None)}
+    return disks
+
+
+def _event(change, kind, vm_name, **fields):
+    return dict(fields, change=change, kind=kind, vm=vm_name)
+
+
+class _VmState(object):
+
+    def __init__(self, name=None):
+        self.name = name
+        self.snapshots = {}
+        self.current = None
+        self.disks = {}
+
+    def update_snapshots(self, snapshot_info, events):
+        nodes, current = _snapshots(snapshot_info)
+        for moid, node in nodes.items():
+            old = self.snapshots.get(moid)
+            if old is None:
+                events.append(_event('created', 'vm-snapshot', self.name, **node))
+            elif (old['name'], old['description']) != (node['name'], node['description']):
+                events.append(_event('renamed', 'vm-snapshot', self.name, **node))
+        for moid, node in self.snapshots.items():
+            if moid not in nodes:
+                events.append(_event('removed', 'vm-snapshot', self.name, **node))
+        if current != self.current and current is not None:
+            events.append(_event('current', 'vm-snapshot', self.name, **nodes[current]))
+        self.snapshots, self.current = nodes, current
+
+    def update_disks(self, devices, events):
+        disks = _disks(devices)
+        for key, disk in disks.items():
+            old = self.disks.get(key)
+            fields = dict((k, v) for k, v in disk.items() if k != 'datastore')
+            if old is None:
+                events.append(_event('added', 'disk', self.name, **fields))
+            elif disk['vDiskId'] and not old['vDiskId']:
+                events.append(_event('promoted', 'disk', self.name, **fields))
+            elif disk['fileName'] != old['fileName']:
+                # a VM snapshot or its removal moves the disk to another delta file
+                events.append(_event('backing', 'disk', self.name, **fields))
+        for key, disk in self.disks.items():
+            if key not in disks:
+                events.append(_event('removed', 'disk', self.name,
+                                     **dict((k, v) for k, v in disk.items() if k != 'datastore')))
+        self.disks = disks
+
+    def fcds(self):
+        return dict((disk['vDiskId'], disk) for disk in self.disks.values() if disk['vDiskId'])
+
+
+def _vm_filter_spec(service_instance, vms):
+    path_set = ['name', 'snapshot', 'config.hardware.device']
+    if vms:
+        return vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=vm_obj, skip=False) for vm_obj in vms],
+            propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=path_set)]), None
+    view = pchelper.get_container_view(service_instance, [vim.VirtualMachine])
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseEntities', path='view', skip=False, type=view.__class__)
+    return vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=path_set)]), view
+
+
+def _task_filter_spec(content):
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseTasks', path='recentTask', skip=False, type=vim.TaskManager)
+    return vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=content.taskManager, skip=True,
+                                                            selectSet=[traversal_spec])],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(
+            type=vim.Task, pathSet=['info.descriptionId', 'info.state', 'info.entity', 'info.entityName',
+                                    'info.description'])])
+
+
+def watch_snapshots(service_instance, vms=None, max_wait=60, workers=8):
+    """
+    Yields lists of change records of the snapshots of the VMs (all VMs when
+    None) and of the FCDs attached to them, as they happen.
+
+    Every record has 'change', 'kind' and 'vm':
+        - kind 'vm-snapshot', change 'present', 'created', 'removed',
+          'renamed' or 'current' (reverted to or taken), with 'id', 'name',
+          'description', 'createTime', 'depth'
+        - kind 'disk', change 'present', 'added', 'removed', 'promoted' or
+          'backing', with 'label', 'vDiskId', 'fileName'
+        - kind 'fcd-snapshot', change 'present', 'created' or 'removed', with
+          'vDiskId', 'label', 'id', 'description', 'createTime', or change
+          'error' with 'vDiskId', 'label' and 'error' when the snapshots of
+          the FCD could not be read
+        - kind 'fcd-task', change 'success' or 'error', with 'task' and
+          'descriptionId' of an FCD snapshot operation, 'vm' None
+
+    The first list holds the state when the watch starts, as 'present'. An
+    empty list is yielded whenever max_wait seconds pass without a change,
+    so the caller gets a chance to stop. The collector and the view are
+    destroyed when the generator is closed.
+
+    :param workers: FCD snapshot lists read in parallel
+    """
+    content = service_instance.content
+    manager = content.vStorageObjectManager
+    collector = content.propertyCollector.CreatePropertyCollector()
+    vm_spec, view = _vm_filter_spec(service_instance, vms)
+    try:
+        collector.CreateFilter(vm_spec, True)
+        collector.CreateFilter(_task_filter_spec(content), True)
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=max_wait)
+
+        version = ''
+        baseline = True
+        states = {}
+        tasks = {}
+        fcd_snapshots = {}
+        # {datastore moId: name}, read when a task names a datastore by name only
+        ds_names = {}
+        while True:
+            update = collector.WaitForUpdatesEx(version, options)
+            if update is None:
+                yield []
+                continue
+            version = update.version
+
+            events = []
+            refresh = set()
+            for filter_set in update.filterSet:
+                for obj_set in filter_set.objectSet:
+                    obj = obj_set.obj
+                    if isinstance(obj, vim.Task):
+                        _task_changes(obj, obj_set, tasks, baseline, events, refresh)
+                        continue
+                    state = states.setdefault(obj._moId, _VmState())
+                    if obj_set.kind == 'leave':
+                        state.update_snapshots(None, events)
+                        state.update_disks([], events)
+                        del states[obj._moId]
+                        continue
+                    for change in obj_set.changeSet:
+                        if change.name == 'name':
+                            state.name = change.val
+                    for change in obj_set.changeSet:
+                        if change.name == 'snapshot':
+                            state.update_snapshots(change.val, events)
+                        elif change.name == 'config.hardware.device':
+                            state.update_disks(change.val, events)
+
+            attached = {}
+            for state in states.values():
+                for vdisk_id, disk in state.fcds().items():
+                    if disk['datastore'] is not None:
+                        attached[vdisk_id] = (state.name, disk)
+            for vdisk_id in set(fcd_snapshots) - set(attached):
+                del fcd_snapshots[vdisk_id]
+            if any(target[0] == 'datastore-name' for target in refresh if target != 'all'):
+                ds_names.update(_datastore_names(service_instance, dict(
+                    (disk['datastore']._moId, disk['datastore']) for _, disk in attached.values()
+                    if disk['datastore']._moId not in ds_names).values()))
+            reads = [(vdisk_id, vm_name, disk) for vdisk_id, (vm_name, disk) in attached.items()
+                     if vdisk_id not in fcd_snapshots
+                     or _refreshed(refresh, vdisk_id, disk['datastore']._moId, ds_names)]
+            read = []
+            if reads:
+                with ThreadPoolExecutor(max_workers=workers) as threads:
+                    read = list(threads.map(lambda item: _fcd_changes(manager, item[0], item[1], item[2],
+                                                                      fcd_snapshots.get(item[0], {})), reads))
+            for (vdisk_id, _, _), (snapshots, fcd_events) in zip(reads, read):
+                events.extend(fcd_events)
+                if snapshots is not None:
+                    fcd_snapshots[vdisk_id] = snapshots
+
+            if baseline:
+                events = [event for event in events if event['change'] != 'current']
+                for event in events:
+                    event['change'] = 'present'
+                # a large inventory arrives in several truncated updates
+                baseline = bool(update.truncated)
+            yield events
+    finally:
+        collector.Destroy()
+        if view is not None:
+            view.Destroy()
+
+
+def _task_changes(task, obj_set, tasks, baseline, events, refresh):
+    if obj_set.kind == 'leave':
+        tasks.pop(task._moId, None)
+        return
+    info = tasks.setdefault(task._moId, {})
+    for change in obj_set.changeSet:
+        info[change.name] = change.val
+    description_id = info.get('info.descriptionId') or ''
+    if not FCD_SNAPSHOT_TASK.search(description_id) or info.get('info.state') not in ('success', 'error'):
+        return
+    if info.get('reported'):
+        return
+    info['reported'] = True
+    if baseline:
+        # finished before the watch started, the first snapshot read covers it
+        return
+    events.append(_event(info['info.state'], 'fcd-task', None, task=task._moId, descriptionId=description_id))
+    refresh.update(_task_targets(info))
+
+
+def _task_targets(info):
+    """
+    What an FCD snapshot task worked on: ('fcd', vDiskId) of the FCDs its
+    description names, ('datastore', moId) of a datastore entity or
+    ('datastore-name', name) of an entity name, 'all' without any of them.
+    """
+    description = info.get('info.description')
+    targets = set(('fcd', arg.value) for arg in (getattr(description, 'arg', None) or [])
+                  if isinstance(arg.value, str))
+    entity = info.get('info.entity')
+    if isinstance(entity, vim.Datastore):
+        targets.add(('datastore', entity._moId))
+    elif info.get('info.entityName'):
+        targets.add(('datastore-name', info['info.entityName']))
+    return targets or set(['all'])
+
+
+def _refreshed(refresh, vdisk_id, ds_moid, ds_names):
+    return ('all' in refresh or ('fcd', vdisk_id) in refresh or ('datastore', ds_moid) in refresh
+            or ('datastore-name', ds_names.get(ds_moid)) in refresh)
+
+
+def _datastore_names(service_instance, ds_objs):
+    """
+    {moId: name} of the datastores, in one retrieval.
+    """
+    ds_objs = list(ds_objs)
+    if not ds_objs:
+        return {}
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=ds_obj) for ds_obj in ds_objs],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.Datastore, pathSet=['name'])])
+    return dict((props['obj']._moId, props.get('name'))
+                for props in pchelper.retrieve_paged(service_instance.content.propertyCollector, filter_spec))
+
+
+def _fcd_changes(manager, vdisk_id, vm_name, disk, old):
+    """
+    (snapshots, events) of the FCD against the snapshots old known so far,
+    snapshots None when they could not be read.
+    """
+    id_object = vim.vslm.ID()
+    id_object.id = vdisk_id
+    events = []
+    try:
+        info = manager.RetrieveSnapshotInfo(id_object, disk['datastore'])
+    except vim.fault.NotFound:
+        return None, events
+    except vmodl.MethodFault as e:
+        # the snapshots known so far stay, the next refresh reads them again
+        events.append(_event('error', 'fcd-snapshot', vm_name, vDiskId=vdisk_id, label=disk['label'],
+                             error=resilience.fault_message(e)))
+        return None, events
+    snapshots = dict((sn.id.id, sn) for sn in info.snapshots or [])
+    for snapshot_id, sn in snapshots.items():
+        if snapshot_id not in old:
+            events.append(_event('created', 'fcd-snapshot', vm_name, vDiskId=vdisk_id, label=disk['label'],
+                                 id=snapshot_id, description=sn.description, createTime=sn.createTime))
+    for snapshot_id, sn in old.items():
+        if snapshot_id not in snapshots:
+            events.append(_event('removed', 'fcd-snapshot', vm_name, vDiskId=vdisk_id, label=disk['label'],
+                                 id=snapshot_id, description=sn.description, createTime=sn.createTime))
+    return snapshots, events
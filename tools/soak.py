@@ -0,0 +1,269 @@
+"""
+Building blocks of the scale and soak harness, fcd-soak.py.
+
+    - LatencyHistogram and OpStats keep latency percentiles of millions of
+      operations in constant memory, with log spaced buckets 5% apart
+    - MemoryTrend samples the resident set size and fits its growth per hour
+    - leak_census counts the PropertyCollector filters and container views a
+      session holds on the server, which only grow when something forgets
+      to Destroy() them
+    - start_vcsim launches the govmomi simulator with an inventory of the
+      given size, populate_fcds and attach_fcds fill it with FCDs
+"""
+import bisect
+import math
+import os
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim
+
+from tools import resilience, sessionpool
+
+_BASE = 1e-4
+_RATIO = 1.05
+
+
+class LatencyHistogram(object):
+    """
+    Latencies in seconds, from 0.1 ms up, in buckets 5% wide.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = int(math.log(max(seconds, _BASE) / _BASE) / math.log(_RATIO))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """
+        Upper bound of the bucket holding the p-th percentile, 0 <= p <= 100.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(_BASE * _RATIO ** (index + 1), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class OpStats(object):
+    """
+    Thread safe latency histograms and error counts per operation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.errors = {}
+        self.last_error = {}
+        self.started = time.time()
+
+    def record(self, op, seconds, error=None):
+        with self._lock:
+            self.latency.setdefault(op, LatencyHistogram()).record(seconds)
+            if error is not None:
+                self.errors[op] = self.errors.get(op, 0) + 1
+                self.last_error[op] = resilience.fault_message(error)
+
+    def total(self):
+        with self._lock:
+            return sum(h.count for h in self.latency.values())
+
+    def report(self):
+        """
+        {op: {'count', 'errors', 'throughput', 'mean', 'p50', 'p95', 'p99', 'max'}}, seconds
+        """
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-6)
+            result = {}
+            for op, hist in sorted(self.latency.items()):
+                result[op] = {'count': hist.count,
+                              'errors': self.errors.get(op, 0),
+                              'lastError': self.last_error.get(op),
+                              'throughput': hist.count / elapsed,
+                              'mean': hist.mean(),
+                              'p50': hist.percentile(50),
+                              'p95': hist.percentile(95),
+                              'p99': hist.percentile(99),
+                              'max': hist.max}
+            return result
+
+
+def rss_bytes():
+    """
+    Resident set size of this process, peak RSS where /proc is missing.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryTrend(object):
+    """
+    RSS samples over time with a least squares fit of the growth.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.samples = []
+        self.max_samples = max_samples
+
+    def sample(self):
+        rss = rss_bytes()
+        self.samples.append((time.time(), rss))
+        if len(self.samples) > self.max_samples:
+            # keep the first sample, thin out the rest
+            self.samples = self.samples[:1] + self.samples[2::2]
+        return rss
+
+    def growth_per_hour(self):
+        if len(self.samples) < 2:
+            return 0.0
+        n = float(len(self.samples))
+        mean_t = sum(t for t, _ in self.samples) / n
+        mean_m = sum(m for _, m in self.samples) / n
+        var = sum((t - mean_t) ** 2 for t, _ in self.samples)
+        if not var:
+            return 0.0
+        slope = sum((t - mean_t) * (m - mean_m) for t, m in self.samples) / var
+        return slope * 3600
+
+    def summary(self):
+        rss = [m for _, m in self.samples] or [0]
+        return {'start': rss[0], 'end': rss[-1], 'peak': max(rss),
+                'growthPerHour': self.growth_per_hour()}
+
+
+def leak_census(content):
+    """
+    Server side objects the session of content holds.
+
+    :return: {'filters': PropertyCollector filters, 'views': views of the ViewManager}
+    """
+    return {'filters': len(content.propertyCollector.filter or []),
+            'views': len(content.viewManager.viewList or [])}
+
+
+def wait_for_port(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def start_vcsim(binary='vcsim', port=8989, datacenters=1, clusters=1, hosts=3, vms=2, datastores=1,
+                extra_args=None):
+    """
+    Starts the govmomi vCenter simulator on 127.0.0.1:port.
+
+    The inventory has datacenters x clusters x hosts hosts, vms VMs per host
+    (each with one disk) and datastores datastores. Returns the process once
+    the port accepts connections, stop it with terminate().
+    """
+    cmd = [binary, '-l', '127.0.0.1:%d' % port,
+           '-dc', str(datacenters), '-cluster', str(clusters), '-host', str(hosts),
+           '-vm', str(vms), '-ds', str(datastores)] + list(extra_args or [])
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(cmd, stdout=devnull, stderr=devnull)
+    try:
+        wait_for_port('127.0.0.1', port)
+    except Exception:
+        process.terminate()
+        raise
+    return process
+
+
+def _round_robin(items, count):
+    return [items[i % len(items)] for i in range(count)]
+
+
+def populate_fcds(pool, datastores, count, capacity_mb=1, prefix='soak-fcd', workers=16):
+    """
+    Creates count thin FCDs spread over the datastores.
+
+    :param pool: SessionPool the creations run on, one session per worker
+    :return: {vDiskId: datastore moId}
+    """
+    def _create(item):
+        number, ds_obj = item
+        with pool.checkout() as session:
+            backing = vim.vslm.CreateSpec.DiskFileBackingSpec(datastore=ds_obj, provisioningType='thin')
+            spec = vim.vslm.CreateSpec(name='%s-%06d' % (prefix, number), capacityInMB=capacity_mb,
+                                       backingSpec=backing)
+            task = session.content.vStorageObjectManager.CreateDisk_Task(spec)
+            resilience.wait_for_tasks(session.si, [task])
+            return task.info.result.config.id.id, ds_obj._moId
+
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        return dict(threads.map(_create, enumerate(_round_robin(datastores, count))))
+
+
+def attach_fcds(pool, vms, fcds, datastores, ratio, workers=16):
+    """
+    Attaches a ratio of the FCDs to the VMs round robin, so the inventory has
+    both attached and orphaned FCDs. VMs are reconfigured one disk at a time.
+
+    :param datastores: {moId: datastore object}
+    :return: the attached vDiskIds
+    """
+    chosen = sorted(fcds)[:int(len(fcds) * ratio)]
+    by_vm = {}
+    for vm_obj, vdisk_id in zip(_round_robin(vms, len(chosen)), chosen):
+        by_vm.setdefault(vm_obj, []).append(vdisk_id)
+
+    def _attach(item):
+        vm_obj, ids = item
+        with pool.checkout() as session:
+            for vdisk_id in ids:
+                id_object = vim.vslm.ID()
+                id_object.id = vdisk_id
+                task = sessionpool.rebind(vm_obj, session.si).AttachDisk_Task(
+                    id_object, datastores[fcds[vdisk_id]])
+                resilience.wait_for_tasks(session.si, [task])
+        return ids
+
+    attached = []
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        for ids in threads.map(_attach, by_vm.items()):
+            attached.extend(ids)
+    return attached
+
+
+def weighted_choice(rand, weights):
+    """
+    Picks a key of weights {key: weight} with probability proportional to its weight.
+    """
+    keys = sorted(k for k, w in weights.items() if w > 0)
+    cumulative = []
+    total = 0
+    for key in keys:
+        total += weights[key]
+        cumulative.append(total)
+    return keys[bisect.bisect_right(cumulative, rand.random() * total)]
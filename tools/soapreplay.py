@@ -0,0 +1,303 @@
+"""
+Record and replay of the SOAP traffic of a vCenter session.
+
+Recording hooks the HTTP connections of the pyVmomi stub and keeps every
+request / response pair, compressed responses are stored inflated so the
+fixture holds plain XML. Before anything is written it is sanitized:
+passwords, user names, session keys and cookies, the vCenter host name and
+IPv4 addresses are replaced by fixed placeholders, version numbers such as
+7.0.3.0 are kept.
+
+Recording starts once the session is connected, the login exchange is not
+in the fixture. A replay starts from a session taken as logged in, a script
+logging in again, e.g. the relogin of resilience, misses the fixture.
+
+Replaying builds a stub whose connections answer from the fixture instead
+of the network, optionally after an injected round trip latency. pyVmomi
+still serializes every request and parses every response, so a script run
+against a replay makes the same calls in the same order as against vCenter,
+which is what round trip counts and concurrency behaviour are measured on.
+
+Requests are matched on their sanitized XML. Identical requests, e.g. the
+polls of a task, are answered in the order they were recorded, the last
+answer repeating once the recorded ones are used up.
+
+Usage:
+    parser = cli.build_arg_parser()
+    soapreplay.add_arguments(parser)
+    ...
+    si = soapreplay.connect(args, lambda: SmartConnectNoSSL(...))
+"""
+import atexit
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from io import BytesIO
+
+from pyVmomi import vim, SoapStubAdapter
+from pyVim.connect import Disconnect
+
+from tools import transport
+
+FIXTURE_VERSION = 1
+REPLAY_HOST = 'vcenter.invalid'
+
+_METHOD = re.compile(r'<(?:\w+:)?Body[^>]*>\s*<(?:\w+:)?(\w+)')
+_BETWEEN_TAGS = re.compile(r'>\s+<')
+
+# (pattern, replacement) applied to every request and response
+SANITIZE_RULES = [
+    (re.compile(r'<password>[^<]*</password>'), '<password>********</password>'),
+    (re.compile(r'<userName>[^<]*</userName>'), '<userName>user</userName>'),
+    (re.compile(r'<fullName>[^<]*</fullName>'), '<fullName>user</fullName>'),
+    (re.compile(r'<key>[0-9a-fA-F]{8}-[0-9a-fA-F-]{27}</key>'),
+     '<key>00000000-0000-0000-0000-000000000000</key>'),
+    (re.compile(r'vmware_soap_session=(&quot;|")?[0-9a-fA-F]+'), r'vmware_soap_session=\g<1>0000000000000000'),
+    # a dotted quad of octets, not in a version element or the urn:vim25/<version> namespace
+    (re.compile(r'(?<!ersion>)(?<!vim25/)(?<![\w.])(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}'
+                r'(?:25[0-5]|2[0-4]\d|1?\d?\d)(?![\w.])'), '192.0.2.1'),
+]
+
+
+class ReplayMiss(LookupError):
+    """
+    Raised when a replayed script makes a request that was never recorded.
+    """
+
+
+def add_arguments(parser):
+    parser.add_argument('-record', '--record', metavar='FIXTURE',
+                        help='Record the SOAP traffic of the run to a sanitized fixture file')
+    parser.add_argument('-replay', '--replay', metavar='FIXTURE',
+                        help='Answer the SOAP calls from a fixture file instead of vCenter, '
+                             'the connection arguments are not used but still required')
+    parser.add_argument('-replay-latency', '--replay-latency', dest='replay_latency', type=float, default=0.0,
+                        help='Milliseconds every replayed round trip takes')
+    parser.add_argument('-replay-jitter', '--replay-jitter', dest='replay_jitter', type=float, default=0.0,
+                        help='Up to this many milliseconds added at random to every replayed round trip')
+    return parser
+
+
+def sanitize(text, host=None):
+    for pattern, replacement in SANITIZE_RULES:
+        text = pattern.sub(replacement, text)
+    if host:
+        text = re.sub(re.escape(host.split(':')[0]), REPLAY_HOST, text, flags=re.IGNORECASE)
+    return text
+
+
+def method_name(request):
+    match = _METHOD.search(request)
+    return match.group(1) if match else None
+
+
+def _text(body):
+    if body is None:
+        return ''
+    if isinstance(body, bytes):
+        return body.decode('utf-8')
+    return body
+
+
+def _inflate(data, encoding):
+    if encoding == 'gzip':
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
+
+
+def _normalize(request):
+    return _BETWEEN_TAGS.sub('><', request.strip())
+
+
+class Recorder(object):
+    """
+    Captures the SOAP exchanges of a stub until save().
+    """
+
+    def __init__(self, stub, host=None):
+        self.stub = stub
+        self.host = host or stub.host
+        self.exchanges = []
+        self._lock = threading.Lock()
+        self._get_connection = stub.GetConnection
+        stub.GetConnection = self._recorded_connection
+
+    def _recorded_connection(self):
+        conn = self._get_connection()
+        if getattr(conn, '_recorded', False):
+            return conn
+        conn._recorded = True
+        request = conn.request
+        getresponse = conn.getresponse
+        pending = {}
+
+        def _request(method, url, body=None, headers=None, **kwargs):
+            pending['request'] = _text(body)
+            return request(method, url, body, headers or {}, **kwargs)
+
+        def _getresponse(*args, **kwargs):
+            resp = getresponse(*args, **kwargs)
+            exchange = {'request': pending.pop('request', ''), 'status': resp.status, 'chunks': [],
+                        'encoding': (resp.getheader('Content-Encoding') or 'identity').lower()}
+            with self._lock:
+                self.exchanges.append(exchange)
+            read = resp.read
+
+            def _read(*read_args):
+                data = read(*read_args)
+                exchange['chunks'].append(data)
+                return data
+            resp.read = _read
+            return resp
+
+        conn.request = _request
+        conn.getresponse = _getresponse
+        return conn
+
+    def save(self, path):
+        with self._lock:
+            exchanges = list(self.exchanges)
+        fixture = {'version': FIXTURE_VERSION,
+                   'vimVersion': self.stub.version,
+                   'exchanges': []}
+        for exchange in exchanges:
+            request = sanitize(exchange['request'], self.host)
+            fixture['exchanges'].append({
+                'method': method_name(request),
+                'request': request,
+                'status': exchange['status'],
+                'response': sanitize(_text(_inflate(b''.join(exchange['chunks']), exchange['encoding'])),
+                                     self.host),
+            })
+        with open(path, 'w') as fixture_file:
+            json.dump(fixture, fixture_file, indent=1)
+        return len(fixture['exchanges'])
+
+    def remove(self):
+        self.stub.GetConnection = self._get_connection
+
+
+class Fixture(object):
+    """
+    Recorded exchanges indexed by request.
+    """
+
+    def __init__(self, fixture):
+        if fixture.get('version') != FIXTURE_VERSION:
+            raise ValueError("Unsupported fixture version %s" % fixture.get('version'))
+        self.vim_version = fixture['vimVersion']
+        self._answers = {}
+        self._lock = threading.Lock()
+        for exchange in fixture['exchanges']:
+            self._answers.setdefault(_normalize(exchange['request']), []).append(
+                (exchange['status'], exchange['response']))
+        self._used = dict((key, 0) for key in self._answers)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fixture_file:
+            return cls(json.load(fixture_file))
+
+    def answer(self, request, host=None):
+        key = _normalize(sanitize(request, host))
+        with self._lock:
+            answers = self._answers.get(key)
+            if not answers:
+                raise ReplayMiss("No recorded answer for %s" % (method_name(key) or key[:200]))
+            position = min(self._used[key], len(answers) - 1)
+            self._used[key] += 1
+        return answers[position]
+
+
+class ReplayResponse(object):
+
+    def __init__(self, status, body):
+        self.status = status
+        self.reason = 'OK' if status == 200 else 'Internal Server Error'
+        self._body = BytesIO(body.encode('utf-8'))
+
+    def getheader(self, name, default=None):
+        if name.lower() == 'content-type':
+            return 'text/xml; charset=utf-8'
+        return default
+
+    def read(self, size=-1):
+        return self._body.read(size)
+
+
+class ReplayConnection(object):
+    """
+    Stands in for the HTTPS connection of the stub.
+    """
+    sock = None
+
+    def __init__(self, fixture, delay, host):
+        self._fixture = fixture
+        self._delay = delay
+        self._host = host
+        self._answer = None
+
+    def request(self, method, url, body=None, headers=None, **kwargs):
+        self._answer = self._fixture.answer(_text(body), self._host)
+
+    def getresponse(self):
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        status, response = self._answer
+        self._answer = None
+        return ReplayResponse(status, response)
+
+    def close(self):
+        pass
+
+
+def replay(path, latency=0.0, jitter=0.0, seed=0, host=None):
+    """
+    Returns a service instance answering from the fixture at path.
+
+    :param host: vCenter the fixture was recorded against, sanitized out of
+                 the requests before they are matched
+
+    :param latency: seconds every round trip takes
+    :param jitter: up to this many seconds added at random, seeded so runs repeat
+    """
+    fixture = Fixture.load(path)
+    rand = random.Random(seed)
+    rand_lock = threading.Lock()
+
+    def _delay():
+        if not jitter:
+            return latency
+        with rand_lock:
+            return latency + rand.uniform(0, jitter)
+
+    stub = SoapStubAdapter(host=REPLAY_HOST, version=fixture.vim_version)
+    stub.GetConnection = lambda: ReplayConnection(fixture, _delay, host)
+    return vim.ServiceInstance('ServiceInstance', stub)
+
+
+def connect(args, smart_connect):
+    """
+    Connects as the arguments of add_arguments ask for: to the fixture of
+    -replay, or with smart_connect() and, with -record, saving the traffic at
+    exit. The recording stops before the session is logged out.
+    """
+    if args.replay:
+        return replay(args.replay, args.replay_latency / 1000.0, args.replay_jitter / 1000.0, host=args.host)
+
+    si = smart_connect()
+    atexit.register(Disconnect, si)
+    if args.record:
+        recorder = Recorder(transport.soap_stub(si), args.host)
+        # registered after Disconnect, so it runs before it
+        atexit.register(recorder.save, args.record)
+    return si
@@ -0,0 +1,198 @@
+"""
+SOAP transport options: gzip responses and persistent connections.
+
+The pyVmomi stub keeps a small pool of HTTP connections and can ask for
+gzip encoded responses, both set when the stub is built and not reachable
+through SmartConnect. tune() adjusts them on a connected service instance.
+A PropertyCollector page of device lists or a RetrieveSnapshotInfo of a long
+chain is repetitive XML that compresses roughly tenfold, and a connection
+kept in the pool saves the TCP and TLS handshakes, i.e. several round trips
+on a WAN link, on every call.
+
+The raw SOAP helpers (alarm.py) post through soap_session(), one
+requests.Session per stub, instead of opening a connection per request.
+
+TrafficMeter counts calls, new connections and bytes on the wire of a stub
+and is what fcd-bench.py reports.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 8
+
+_sessions = {}
+_pool_sizes = {}
+_sessions_lock = threading.Lock()
+
+
+def add_arguments(parser):
+    """
+    Adds the transport options to an argument parser.
+    """
+    parser.add_argument('-no-compress', dest='no_compress', action='store_true',
+                        help='Do not ask vCenter for gzip encoded SOAP responses')
+    parser.add_argument('-http-pool', dest='http_pool', type=int, default=DEFAULT_POOL_SIZE,
+                        help='HTTP connections kept alive per vCenter session')
+    return parser
+
+
+def soap_stub(si):
+    """
+    The SoapStubAdapter of a service instance, also behind a session oriented stub.
+    """
+    stub = si._stub
+    return getattr(stub, 'soapStub', stub)
+
+
+def tune(si, compress=True, pool_size=DEFAULT_POOL_SIZE, idle_timeout=None):
+    """
+    Sets the transport options of a connected service instance.
+
+    :param compress: send Accept-Encoding gzip, deflate with every call
+    :param pool_size: idle HTTP connections kept for reuse, at least the
+                      number of threads sharing the session
+    :param idle_timeout: seconds after which an idle connection is closed
+    :return: the SOAP stub
+    """
+    stub = soap_stub(si)
+    stub._acceptCompressedResponses = compress
+    stub.poolSize = pool_size
+    if idle_timeout is not None:
+        stub.connectionPoolTimeout = idle_timeout
+    return stub
+
+
+def tuner(args):
+    """
+    Returns a function applying the transport options parsed by add_arguments,
+    for the places where sessions are opened on the fly.
+    """
+    def _tune(si):
+        return tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+    return _tune
+
+
+def soap_session(stub, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Returns the requests.Session used for raw SOAP requests on behalf of stub.
+    Connections are kept alive between requests and responses are accepted
+    gzip encoded.
+
+    :param pool_size: connections kept for reuse. The pool only grows: a
+                      larger size than the session has mounts a new adapter,
+                      a smaller one keeps the current pool.
+    """
+    with _sessions_lock:
+        session = _sessions.get(id(stub))
+        if session is None:
+            session = requests.Session()
+            # vCenter certificates are not validated by the stub either
+            session.verify = False
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _sessions[id(stub)] = session
+            _pool_sizes[id(stub)] = 0
+        if pool_size > _pool_sizes[id(stub)]:
+            # urllib3 discards the connections returned to a full pool, so
+            # more threads than pooled connections would lose the reuse
+            previous = session.adapters.get('https://')
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _pool_sizes[id(stub)] = pool_size
+            if previous is not None:
+                previous.close()
+        return session
+
+
+def close_soap_session(stub):
+    with _sessions_lock:
+        session = _sessions.pop(id(stub), None)
+        _pool_sizes.pop(id(stub), None)
+    if session is not None:
+        session.close()
+
+
+def post_soap(stub, payload, timeout=None):
+    """
+    Posts a SOAP envelope with the session cookie of stub.
+
+    :return: the requests response
+    """
+    url = 'https://{0}/sdk'.format(stub.host)
+    return soap_session(stub).post(url=url, data=payload, timeout=timeout, headers={
+        'Cookie': stub.cookie,
+        'SOAPAction': 'urn:vim25',
+        'Content-Type': 'text/xml; charset=utf-8'
+    })
+
+
+class TrafficMeter(object):
+    """
+    Counts the SOAP traffic of a stub: calls, connections opened, bytes sent
+    and bytes received as they come off the socket, so compressed.
+
+    Usage:
+        meter = TrafficMeter(soap_stub(si))
+        ...
+        print(meter.snapshot())
+        meter.remove()
+    """
+
+    def __init__(self, stub):
+        self.stub = stub
+        self._lock = threading.Lock()
+        self.reset()
+        self._get_connection = stub.GetConnection
+        stub.GetConnection = self._metered_connection
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.connections = 0
+            self.sent = 0
+            self.received = 0
+            self.started = time.time()
+
+    def _count(self, **counts):
+        with self._lock:
+            for key, val in counts.items():
+                setattr(self, key, getattr(self, key) + val)
+
+    def _metered_connection(self):
+        conn = self._get_connection()
+        if not getattr(conn, '_metered', False):
+            conn._metered = True
+            self._count(connections=1)
+            request = conn.request
+            getresponse = conn.getresponse
+
+            def _request(method, url, body=None, headers=None, **kwargs):
+                self._count(calls=1, sent=len(body or b''))
+                return request(method, url, body, headers or {}, **kwargs)
+
+            def _getresponse(*args, **kwargs):
+                resp = getresponse(*args, **kwargs)
+                read = resp.read
+
+                def _read(*read_args):
+                    data = read(*read_args)
+                    self._count(received=len(data))
+                    return data
+                resp.read = _read
+                return resp
+
+            conn.request = _request
+            conn.getresponse = _getresponse
+        return conn
+
+    def snapshot(self):
+        with self._lock:
+            return {'calls': self.calls, 'connections': self.connections,
+                    'sent': self.sent, 'received': self.received,
+                    'seconds': time.time() - self.started}
+
+    def remove(self):
+        self.stub.GetConnection = self._get_connection
@@ -17,13 +17,35 @@
 This module implements simple helper functions for python samples working with
 virtual machine objects
 """
+import csv
+import json
+import sys
+
+from pyVmomi import vim, vmodl
+
+from tools import pchelper, serviceutil
+
 __author__ = "VMware, Inc."
 
+# (record key, property path, label) of the fields print_vm_info prints
+REPORT_FIELDS = (
+    ('name', 'summary.config.name', 'Name'),
+    ('path', 'summary.config.vmPathName', 'Path'),
+    ('guest', 'summary.config.guestFullName', 'Guest'),
+    ('annotation', 'summary.config.annotation', 'Annotation'),
+    ('state', 'summary.runtime.powerState', 'State'),
+    ('ip', 'summary.guest.ipAddress', 'IP'),
+    ('question', 'summary.runtime.question', 'Question'),
+)
+
 
 def print_vm_info(vm, depth=1, max_depth=10):
     """
     Print information for a particular virtual machine or recurse into a
     folder with depth protection
+
+    Every field read here can be a round trip of its own, for more than a
+    handful of VMs use iter_vm_report and write_vm_report instead.
     """
 
     # if this is a group it will have children. if it does, recurse into them
@@ -51,3 +73,67 @@ def print_vm_info(vm, depth=1, max_depth=10):
     if summary.runtime.question is not None:
         print("Question  : {}".format(summary.runtime.question.text))
     print("")
+
+
+def iter_vm_report(service_instance, root=None, page_size=500, fcd_counts=True):
+    """
+    Yields the print_vm_info fields of every VM below root (the root folder
+    by default) as a dict per VM. All VMs are fetched with one paged
+    PropertyCollector query following serviceutil.build_full_traversal and
+    projected on the fields, so the number of round trips grows with the
+    number of pages, not with the number of fields or VMs.
+
+    With fcd_counts the device list is fetched too and every record gets the
+    number of virtual disks ('disks') and of those that are FCDs ('fcds').
+    """
+    content = service_instance.content
+    path_set = [path for _, path, _ in REPORT_FIELDS]
+    if fcd_counts:
+        path_set.append('config.hardware.device')
+
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=root or content.rootFolder, skip=False,
+                                                            selectSet=serviceutil.build_full_traversal())],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=path_set)])
+
+    for props in pchelper.retrieve_paged(content.propertyCollector, filter_spec, page_size):
+        record = dict((key, props.get(path)) for key, path, _ in REPORT_FIELDS)
+        record['moId'] = props['obj']._moId
+        if record['question'] is not None:
+            record['question'] = record['question'].text
+        if fcd_counts:
+            disks = [dev for dev in props.get('config.hardware.device') or []
+                     if isinstance(dev, vim.vm.device.VirtualDisk)]
+            record['disks'] = len(disks)
+            record['fcds'] = len([dev for dev in disks if dev.vDiskId])
+        yield record
+
+
+def write_vm_report(records, output_format='text', out=None):
+    """
+    Writes VM report records as they arrive, as print_vm_info does ('text'),
+    as one JSON object per line ('json') or as CSV with a header ('csv').
+
+    :return: number of records written
+    """
+    out = out or sys.stdout
+    count = 0
+    writer = None
+    for record in records:
+        count += 1
+        if output_format == 'json':
+            out.write(json.dumps(record, default=str) + "\n")
+        elif output_format == 'csv':
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=['moId'] + [key for key, _, _ in REPORT_FIELDS] +
+                                        [key for key in ('disks', 'fcds') if key in record])
+                writer.writeheader()
+            writer.writerow(record)
+        else:
+            for key, _, label in REPORT_FIELDS:
+                if record[key] or key in ('name', 'path', 'guest', 'state'):
+                    out.write("{0:<11}: {1}\n".format(label, record[key]))
+            if 'fcds' in record:
+                out.write("{0:<11}: {1} of {2}\n".format('FCDs', record['fcds'], record['disks']))
+            out.write("\n")
+    return count
@@ -11,12 +11,12 @@
 
 from __future__ import print_function
 
-import atexit
 import argparse
 import getpass
-from tools import cli, tasks
-from pyVmomi import vim
-from pyVim.connect import SmartConnectNoSSL, Disconnect
+import json
+from tools import audit, cli, inventory, invfile, pchelper, placement, preflight, resilience, snapwatch, soapreplay, transport
+from pyVmomi import vim, vmodl
+from pyVim.connect import SmartConnectNoSSL
 import detach_disk, attach_disk
 from termcolor import colored
 
@@ -52,15 +52,27 @@ def get_args():
                         choices = ['create', 'delete','view','revert'],
                         help='The operation that you want to perform')
     parser.add_argument('-snid',required=False,
-                        help='Snapshot id to which you need to revert to or delete')
+                        help='Snapshot id to which you need to revert to or delete, comma separated to go with several -vDiskId')
 
     parser.add_argument('-vm', '--vmname', required=False,
                         help='Name of the VirtualMachine you want to change.')
 
     parser.add_argument('-vDiskId', '--virtualDiskId',
                         required=False,
-                        help='vDiskId of FCD Disk')
-
+                        help='vDiskId of FCD Disk. With -op revert and no -vm it can be comma separated values, '
+                             'each reverted to the snapshot at the same place in -snid')
+    parser.add_argument('-watch', '--watch', action='store_true',
+                        help='With -op view, keep running and print the VM and FCD snapshot changes as they happen. '
+                             '-vm can be a comma separated list, without it every VM is watched')
+    parser.add_argument('-max-wait', '--max-wait', dest='max_wait', type=int, default=60,
+                        help='Seconds the watch waits for vCenter per update call')
+    parser.add_argument('-json', '--json', action='store_true',
+                        help='Print the watched changes as one JSON record per line')
+    transport.add_arguments(parser)
+    soapreplay.add_arguments(parser)
+    invfile.add_arguments(parser)
+    audit.add_arguments(parser)
+    placement.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -73,15 +85,13 @@ def get_args():
 
 #Get the vim object
 def get_obj(content, vim_type, name):
-    obj = None
+    return invfile.get_obj(content, vim_type, name)
 
-    container = content.viewManager.CreateContainerView(content.rootFolder, vim_type, True)
 
-    for c in container.view:
-        if c.name == name:
-            obj = c
-            break
-    return obj
+def vslm_id(value):
+    id_object = vim.vslm.ID()
+    id_object.id = value
+    return id_object
 
 
 #find the disk
@@ -107,131 +117,154 @@ def find_disk(content, vm_obj, disk_label , ):
     return [vdisk_id, disk_backed_datastore , controllerKey , unitNumber]
 
 
-#To create the snapshot
-def create_snapshot(vc_name, si, content, vm_obj,  dn , description, disk_prefix_label='Hard disk '):
+#To create the snapshot on a single disk, the exceptions are left to the caller.
+#checked tells that a preflight already checked the datastore space and the snapshot count of the disk
+def create_disk_snapshot(si, content, vm_obj, n, description, disk_prefix_label='Hard disk ', checked=False):
 
-    disk_numbers = dn.split(',')
+    disk_label = disk_prefix_label + str(n)
+    virtual_disk_device = None
 
-    for n in disk_numbers:
-        try:
-            disk_label = disk_prefix_label + str(n)
-            virtual_disk_device = None
+    # find the disk device
+    for dev in vm_obj.config.hardware.device:
+        if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
+            virtual_disk_device = dev
 
-            # find the disk device
-            for dev in vm_obj.config.hardware.device:
-                if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
-                    virtual_disk_device = dev
+            if virtual_disk_device.vDiskId is None:
+                print(colored("##The Hard Disk %s should be promoted to FCD before Taking FCD level Snapshot.", "green") % n)
 
-                    if virtual_disk_device.vDiskId is None:
-                        print(colored("##The Hard Disk %s should be promoted to FCD before Taking FCD level Snapshot.", "green") % n)
+    # if virtual disk is not found
+    if not virtual_disk_device:
+        raise RuntimeError("##Virtual {} could not be found".format(disk_label))
 
-            # if virtual disk is not found
-            if not virtual_disk_device:
-                raise RuntimeError("##Virtual {} could not be found".format(disk_label))
+    list_vdiskid_ds = find_disk(content, vm_obj,
+                                disk_label)  # return is list with two values one is vdisk id and other is datastore name
 
-            list_vdiskid_ds = find_disk(content, vm_obj,
-                                        disk_label)  # return is list with two values one is vdisk id and other is datastore name
+    id_object = vim.vslm.ID()
+    id_object.id = list_vdiskid_ds[0]
 
-            id_object = vim.vslm.ID()
-            id_object.id = list_vdiskid_ds[0]
+    ds_obj = get_obj(content, [vim.Datastore], list_vdiskid_ds[1])
 
-            ds_obj = get_obj(content, [vim.Datastore], list_vdiskid_ds[1])
+    # the delta disk needs room on the datastore and the chain must stay below -max-chain,
+    # the snapshots are only counted when there is a limit
+    if not checked:
+        chain_depth = None
+        if placement.current_policy().max_chain:
+            chain_depth = inventory.snapshot_count(content.vStorageObjectManager, id_object.id, ds_obj)
+        placement.check(si, ds_obj, chain_depth=chain_depth)
 
-            # snapshot taken with the vstorageobjectmanager api
-            snapshot_task = content.vStorageObjectManager.VStorageObjectCreateSnapshot_Task(id_object, ds_obj,
-                                                                                            description)
+    # snapshot taken with the vstorageobjectmanager api
+    snapshot_task = content.vStorageObjectManager.VStorageObjectCreateSnapshot_Task(id_object, ds_obj,
+                                                                                    description)
 
-            # calling wait_for_task module to monitor the task
-            tasks.wait_for_tasks(si, [snapshot_task])
+    # calling wait_for_task module to monitor the task
+    resilience.wait_for_tasks(si, [snapshot_task])
 
-            print(colored("##Snapshot taken successfully on disk %s. Task id : %s", "green") % (n, snapshot_task))
+    print(colored("##Snapshot taken successfully on disk %s. Task id : %s", "green") % (n, snapshot_task))
+    audit.log('createSnapshot', task=snapshot_task, vDiskId=id_object.id, snapshotId=snapshot_task.info.result.id,
+              datastore=list_vdiskid_ds[1], vm=vm_obj, label=disk_label, description=description)
+
+    # the task result is the vim.vslm.ID of the new snapshot
+    return snapshot_task.info.result.id
+
+
+#To create the snapshot
+def create_snapshot(vc_name, si, content, vm_obj,  dn , description, disk_prefix_label='Hard disk ', checked=False):
+
+    disk_numbers = dn.split(',')
+
+    for n in disk_numbers:
+        try:
+            create_disk_snapshot(si, content, vm_obj, n, description, disk_prefix_label, checked)
 
         except Exception as e:
-            print(colored("##Exception in taking snapshot %s ", "red") % (e.msg))
+            print(colored("##Exception in taking snapshot %s ", "red") % (resilience.fault_message(e)))
+
+
+#Flatten the VM snapshot tree into (depth, node) pairs, depth first and without recursion so deep chains are fine
+def walk_snapshot_tree(root_snapshot_list):
+    stack = [(0, node) for node in reversed(root_snapshot_list or [])]
+    while stack:
+        depth, node = stack.pop()
+        yield depth, node
+        stack.extend((depth + 1, child) for child in reversed(node.childSnapshotList or []))
+
+
+def print_fcd_snapshots(content, virtual_disk_device, title):
+    snapshot = content.vStorageObjectManager.RetrieveSnapshotInfo(virtual_disk_device.vDiskId,
+                                                                  virtual_disk_device.backing.datastore)
+    print(title)
+    count = 1
+    for sn in snapshot.snapshots:
+        print(colored("\t\t#%s -> description : %s, creation Time : %s , snapshot identifier : %s ", "green") % (
+            count, sn.description, sn.createTime, sn.id.id))
+        count = count + 1
 
 
 #To view the snapshot
-def view_snapshot(content, vm_obj,  dn, disk_prefix_label='Hard disk '):
+def view_snapshot(si, content, vm_obj,  dn, disk_prefix_label='Hard disk '):
 
-    print("<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Snapshots at VM level >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n")
+    # the whole snapshot tree and the device list come back in one PropertyCollector call,
+    # every node is then fully populated and reading it costs no further round trips
+    props = pchelper.get_object_properties(si, vm_obj, ['name', 'snapshot.rootSnapshotList',
+                                                        'snapshot.currentSnapshot', 'config.hardware.device'])
+    devices = props.get('config.hardware.device', [])
 
-    if vm_obj.snapshot:
-        snap_info = vm_obj.snapshot
+    print("<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Snapshots at VM level >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n")
 
-        tree = snap_info.rootSnapshotList
-        while tree[0].childSnapshotList is not None:
-            print("### Name : {0}     ===>    Created Time : {1} | Snapshot State : {2} | Description : {3}".format(
-                tree[0].name, tree[0].createTime, tree[0].state, tree[0].description))
-            if len(tree[0].childSnapshotList) < 1:
-                break
-            tree = tree[0].childSnapshotList
+    if props.get('snapshot.rootSnapshotList'):
+        current = props.get('snapshot.currentSnapshot')
+        for depth, node in walk_snapshot_tree(props['snapshot.rootSnapshotList']):
+            marker = "  <== you are here" if current is not None and node.snapshot == current else ""
+            print("###{0} Name : {1}     ===>    Created Time : {2} | Snapshot State : {3} | Description : {4}{5}".format(
+                "    " * depth + ("|-- " if depth else " "), node.name, node.createTime, node.state, node.description, marker))
     else:
-        print("### No Snapshots found for VM {} at VM layer\n\n\n".format(vm_obj.name))
+        print("### No Snapshots found for VM {} at VM layer\n\n\n".format(props.get('name')))
 
 
     print("\n\n<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< Snapshots at FCD level >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
 
+    vmdks = dict((dev.deviceInfo.label, dev) for dev in devices if isinstance(dev, vim.vm.device.VirtualDisk))
+
     if dn:
         disk_numbers = dn.split(',')
         for n in disk_numbers:
             try:
                 disk_label = disk_prefix_label + str(n)
-                virtual_disk_device = None
-
-                # find the disk device
-                for dev in vm_obj.config.hardware.device:
-                    if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
-                        virtual_disk_device = dev
+                virtual_disk_device = vmdks.get(disk_label)
 
                 # if virtual disk is not found
                 if not virtual_disk_device:
                     raise RuntimeError("##Virtual {} could not be found".format(disk_label))
+                if not virtual_disk_device.vDiskId:
+                    raise RuntimeError("##The Hard Disk {} is not promoted to FCD".format(n))
 
-                list_vdiskid_ds = find_disk(content, vm_obj,
-                                            disk_label)  # Returned values are vdiskid, datastore, controllerKey and unitNumber
-
-                id_object = vim.vslm.ID()
-                id_object.id = list_vdiskid_ds[0]  # virtual disk identifier
-
-                ds_obj = get_obj(content, [vim.Datastore], list_vdiskid_ds[1])  # datastore object is returned
-
-                snapshot = content.vStorageObjectManager.RetrieveSnapshotInfo(id_object, ds_obj)
-
-                print("\n\n##The snapshots of FCD disk#%s are :" % n)
-                count = 1
-                for sn in snapshot.snapshots:
-                    print(
-                        colored("\t\t#%s -> description : %s, creation Time : %s , snapshot identifier : %s ", "green") % (
-                            count, sn.description, sn.createTime, sn.id.id))
-                    count = count + 1
-
+                print_fcd_snapshots(content, virtual_disk_device, "\n\n##The snapshots of FCD disk#%s are :" % n)
 
             except Exception as e:
-                print(colored("##Exception in viewing the snapshot : %s ", "red") % (e.msg))
+                print(colored("##Exception in viewing the snapshot : %s ", "red") % (resilience.fault_message(e)))
             print()
     else:
-        vmdks = []
         try:
-            # find the disk device
-            for dev in vm_obj.config.hardware.device:
-                if isinstance(dev, vim.vm.device.VirtualDisk):
-                    vmdks.append(dev)
+            for label, virtual_disk_device in vmdks.items():
+                if virtual_disk_device.vDiskId:
+                    print_fcd_snapshots(content, virtual_disk_device, "\n##The snapshots of FCD %s are :" % label)
 
-            for virtual_disk_device in vmdks:
-                id_object = virtual_disk_device.vDiskId  # virtual disk identifier
-                ds_obj = virtual_disk_device.backing.datastore  # datastore object is returned
+        except Exception as e:
+            print(colored("##Exception in viewing the snapshot : %s ", "red") % (resilience.fault_message(e)))
 
-                if id_object:
-                    snapshot = content.vStorageObjectManager.RetrieveSnapshotInfo(id_object, ds_obj)
 
-                    print("\n##The snapshots of FCD %s are :" % virtual_disk_device.deviceInfo.label)
-                    count = 1
-                    for sn in snapshot.snapshots:
-                        print(colored("\t\t#%s -> description : %s, creation Time : %s , snapshot identifier : %s ","green") % (count, sn.description, sn.createTime, sn.id.id))
-                        count = count + 1
+def inventory_datastore(vdisk_id):
+    """Name of the datastore of the FCD in the inventory file, None without one"""
+    inventory_file = invfile.active()
+    entry = inventory_file.vdisk(vdisk_id) if inventory_file else None
+    datastore = inventory_file.datastore(entry['datastore']) if entry else None
+    return datastore[0] if datastore else None
 
-        except Exception as e:
-            print(colored("##Exception in viewing the snapshot : %s ", "red") % (e.msg))
+
+def live_datastore(si, vdisk_id):
+    """Name of the datastore of the FCD from an inventory pass, None when no datastore has it"""
+    index = inventory.FcdIndex.build(si)
+    return index.datastore_name(index.fcds[vdisk_id]) if vdisk_id in index.fcds else None
 
 
 def view_vDisk_Snapshot(content, id, ds):
@@ -255,110 +288,309 @@ def view_vDisk_Snapshot(content, id, ds):
     print("\n")
 
 
+#Delete the Snapshot of a single disk, the exceptions are left to the caller
+def delete_disk_snapshot(si, content, vm_obj,  dn , snid, disk_prefix_label='Hard disk '):
+
+    disk_label = disk_prefix_label + str(dn)
+    virtual_disk_device = None
+
+    # find the disk device
+    for dev in vm_obj.config.hardware.device:
+        if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
+            virtual_disk_device = dev
+
+    # if virtual disk is not found
+    if not virtual_disk_device:
+        raise RuntimeError("##Virtual {} could not be found".format(disk_label))
+
+    list_vdiskid_ds = find_disk(content, vm_obj,
+                                disk_label)  # return is list with two values one is vdisk id and other is datastore name
+
+
+    id_object1 = vim.vslm.ID()
+    id_object1.id = list_vdiskid_ds[0]
+
+    id_object2 = vim.vslm.ID()
+    id_object2.id = snid
+
+    ds_obj = get_obj(content, [vim.Datastore], list_vdiskid_ds[1])
+
+    snapshot_task = content.vStorageObjectManager.DeleteSnapshot_Task(id_object1, ds_obj, id_object2)
+    resilience.wait_for_tasks(si,[snapshot_task])
+
+    print(colored("##Deleted the snapshot with snapshot id  %s. Task id : %s ","green")%(snid,snapshot_task))
+    audit.log('deleteSnapshot', task=snapshot_task, vDiskId=id_object1.id, snapshotId=snid,
+              datastore=list_vdiskid_ds[1], vm=vm_obj, label=disk_label)
+
+
 #Delete the Snapshot
 def delete_snapshot(si, content, vm_obj,  dn , snid, disk_prefix_label='Hard disk '):
-    try:
 
-        disk_label = disk_prefix_label + str(dn)
-        virtual_disk_device = None
+    for n in dn.split(','):
+        try:
+            delete_disk_snapshot(si, content, vm_obj, n, snid, disk_prefix_label)
 
-        # find the disk device
-        for dev in vm_obj.config.hardware.device:
-            if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
-                virtual_disk_device = dev
+        except Exception as e:
+            print(colored("##Exception in deleting the snapshot is : %s ","red")%(resilience.fault_message(e)))
 
-        # if virtual disk is not found
-        if not virtual_disk_device:
-            raise RuntimeError("##Virtual {} could not be found".format(disk_label))
 
-        list_vdiskid_ds = find_disk(content, vm_obj,
-                                    disk_label)  # return is list with two values one is vdisk id and other is datastore name
+#Revert the Snapshot of a single disk. The disk is always attached back, the exceptions are left to the caller
+def revert_disk_snapshot(si, content, vm_obj,  dn , snid, disk_prefix_label='Hard disk '):
 
+    disk_label = disk_prefix_label + str(dn)
+    virtual_disk_device = None
 
-        id_object1 = vim.vslm.ID()
-        id_object1.id = list_vdiskid_ds[0]
+    # find the disk device
+    for dev in vm_obj.config.hardware.device:
+        if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
+            virtual_disk_device = dev
 
-        id_object2 = vim.vslm.ID()
-        id_object2.id = snid
+    # if virtual disk is not found
+    if not virtual_disk_device:
+        raise RuntimeError("##Virtual {} could not be found".format(disk_label))
+
+    list_vdiskid_ds = find_disk(content, vm_obj,
+                                disk_label)  # return is list with two values one is vdisk id and other is datastore name
 
-        ds_obj = get_obj(content, [vim.Datastore], list_vdiskid_ds[1])
+    id_object1 = vim.vslm.ID()
+    id_object1.id = list_vdiskid_ds[0]
 
-        snapshot_task = content.vStorageObjectManager.DeleteSnapshot_Task(id_object1, ds_obj, id_object2)
-        tasks.wait_for_tasks(si,[snapshot_task])
+    id_object2 = vim.vslm.ID()
+    id_object2.id = snid
 
-        print(colored("##Deleted the snapshot with snapshot id  %s. Task id : %s ","green")%(snid,snapshot_task))
+    ds_obj = get_obj(content, [vim.Datastore], list_vdiskid_ds[1])
 
-    except Exception as e:
-        print(colored("##Exception in deleting the snapshot is : %s ","red")%(e.msg))
+
+    #Detaching the disk before revert as that's the design of FCD 6.7 atleast!!!!
+    #a failed detach raises here, the revert never runs on an attached disk
+    print(colored("##Detaching the disk %s before the revert.","green")%(disk_label))
+    detach_disk.detach_vdisk(si, vm_obj, list_vdiskid_ds[0])
+    print(colored("##Detaching is done and I have captured the virtual disk id, datastore name, controllerKey and unitNumber as %s, %s, %s and %s which I need for attaching the device back.","green")%(list_vdiskid_ds[0], list_vdiskid_ds[1], list_vdiskid_ds[2], list_vdiskid_ds[3]))
+
+    def attach_back():
+        print(colored("##Attaching the disk %s back","green")%(disk_label))
+        attach_disk.Attach_vmdk(si, content, vm_obj, list_vdiskid_ds[0] ,list_vdiskid_ds[1],list_vdiskid_ds[2] , list_vdiskid_ds[3])
+        print (colored("##The disk %s is attached back.","green")%(disk_label))
+
+    try:
+        #I am reverting with the FCD api
+        snapshot_task = content.vStorageObjectManager.RevertVStorageObject_Task(id_object1, ds_obj, id_object2)
+        resilience.wait_for_tasks(si,[snapshot_task])
+        print(colored("##Reverted to the snapshot with snapshot id  %s. Task id : %s ","green")%(snid,snapshot_task))
+        audit.log('revertVStorageObject', task=snapshot_task, vDiskId=id_object1.id, snapshotId=snid,
+                  datastore=list_vdiskid_ds[1], vm=vm_obj, label=disk_label)
+    except Exception:
+        ##Look, I am immediately attaching it back, even when the revert raised an exception.
+        ##The revert error is the one the caller gets, a failed attach is only printed
+        try:
+            attach_back()
+        except Exception as e:
+            print(colored("##Could not attach the disk %s back, it stays detached : %s","red")%(disk_label, resilience.fault_message(e)))
+        raise
+
+    attach_back()
+
+    print(colored("##Though the disk is attached back, the operation needs reboot as the snapshot is not an in-memory snapshot","green"))
 
 
 #Revert Snapshot
 def revert_snapshot(si, content, vm_obj,  dn , snid, disk_prefix_label='Hard disk '):
+
+    for n in dn.split(','):
+        try:
+            revert_disk_snapshot(si, content, vm_obj, n, snid, disk_prefix_label)
+
+        except Exception as e:
+            print(colored("##Exception in Reverting to the snapshot is : %s ","red")%(resilience.fault_message(e)))
+            print(colored("##Could not revert to snapshot in time instant because of %s exception, but attached the disk back again which was detached for revert operation","green")%(resilience.fault_message(e)))
+
+
+def disk_locations(si, vdisk_ids):
+    """ {vDiskId: {'datastore', 'vm', 'controllerKey', 'unitNumber'}} from the inventory file, or from one
+    inventory pass when the file is not in use, misses a disk or vCenter no longer agrees with it.
+    'vm' is None for unattached FCDs """
+
+    inventory_file = invfile.active()
+    if inventory_file:
+        entries = dict((vdisk_id, inventory_file.vdisk(vdisk_id)) for vdisk_id in vdisk_ids)
+        if all(entries.values()) and file_is_current(si, entries):
+            for entry in entries.values():
+                entry['datastore'] = inventory_file.datastore(entry['datastore'])[0]
+            return entries
+
+    index = inventory.FcdIndex.build(si)
+    locations = {}
+    for vdisk_id in vdisk_ids:
+        if vdisk_id not in index.fcds:
+            continue
+        disk = index.vm_of(vdisk_id) or {}
+        locations[vdisk_id] = {'datastore': index.datastore_name(index.fcds[vdisk_id]), 'vm': disk.get('vm'),
+                               'controllerKey': disk.get('controllerKey'), 'unitNumber': disk.get('unitNumber')}
+    return locations
+
+
+def file_is_current(si, entries):
+    """ Whether every FCD is still on the datastore and attached to the VM the inventory file says, the
+    file can be a day old. One RetrieveVStorageObjectAssociations call answers for all of them """
+
     try:
+        found = inventory.associations(si.content.vStorageObjectManager,
+                                       [(vdisk_id, vim.Datastore(entry['datastore'], si._stub))
+                                        for vdisk_id, entry in entries.items()])
+    except vmodl.MethodFault:
+        return False
+    for vdisk_id, entry in entries.items():
+        # an FCD not on the datastore of the file comes back with a fault and is missing here
+        if vdisk_id not in found:
+            return False
+        if [vm_id for vm_id, _ in found[vdisk_id]] != ([entry['vm']] if entry['vm'] else []):
+            return False
+    return True
+
+
+def revert_attached_vDisk(si, content, vdisk_id, location, snid):
+    """ The detach, revert and attach of an FCD attached to a VM, the exceptions are left to the caller.
+    When the revert fails the FCD is attached back and the revert error raised, a failed attach is printed """
+
+    vm_obj = vim.VirtualMachine(location['vm'], si._stub)
+    ds_obj = get_obj(content, [vim.Datastore], location['datastore'])
+
+    print(colored("##Detaching the FCD %s from VM %s before the revert.", "green") % (vdisk_id, vm_obj.name))
+    detach_disk.detach_vdisk(si, vm_obj, vdisk_id)
+
+    def attach_back():
+        attach_disk.Attach_vmdk(si, content, vm_obj, vdisk_id, location['datastore'], location['controllerKey'],
+                                location['unitNumber'])
 
-        disk_label = disk_prefix_label + str(dn)
-        virtual_disk_device = None
+    try:
+        snapshot_task = content.vStorageObjectManager.RevertVStorageObject_Task(vslm_id(vdisk_id), ds_obj,
+                                                                                vslm_id(snid))
+        resilience.wait_for_tasks(si, [snapshot_task])
+        audit.log('revertVStorageObject', task=snapshot_task, vDiskId=vdisk_id, snapshotId=snid,
+                  datastore=location['datastore'], vm=vm_obj)
+    except Exception:
+        try:
+            attach_back()
+        except Exception as e:
+            print(colored("##Could not attach the FCD %s back, it stays detached : %s", "red") % (
+                vdisk_id, resilience.fault_message(e)))
+        raise
 
-        # find the disk device
-        for dev in vm_obj.config.hardware.device:
-            if isinstance(dev, vim.vm.device.VirtualDisk) and dev.deviceInfo.label == disk_label:
-                virtual_disk_device = dev
+    attach_back()
 
-        # if virtual disk is not found
-        if not virtual_disk_device:
-            raise RuntimeError("##Virtual {} could not be found".format(disk_label))
 
-        list_vdiskid_ds = find_disk(content, vm_obj,
-                                    disk_label)  # return is list with two values one is vdisk id and other is datastore name
+def revert_vDisk_Snapshots(si, content, pairs):
+    """ Reverts FCDs by vDiskId. Unattached FCDs revert straight away, all their tasks run at once and no VM is
+    reconfigured, only FCDs attached to a VM are detached and attached back around their revert
 
-        id_object1 = vim.vslm.ID()
-        id_object1.id = list_vdiskid_ds[0]
+    :param pairs: [(vDiskId, snapshot id)]
+    """
 
-        id_object2 = vim.vslm.ID()
-        id_object2.id = snid
+    locations = disk_locations(si, [vdisk_id for vdisk_id, _ in pairs])
+    running = []
+    for vdisk_id, snid in pairs:
+        location = locations.get(vdisk_id)
+        if location is None:
+            print(colored("##FCD %s is not found on any accessible datastore", "red") % vdisk_id)
+        elif location['vm']:
+            try:
+                revert_attached_vDisk(si, content, vdisk_id, location, snid)
+                print(colored("##Reverted the FCD %s to the snapshot %s and attached it back", "green") % (vdisk_id, snid))
+            except Exception as e:
+                print(colored("##Exception in reverting the FCD %s : %s", "red") % (vdisk_id, resilience.fault_message(e)))
+        else:
+            try:
+                ds_obj = get_obj(content, [vim.Datastore], location['datastore'])
+                task = content.vStorageObjectManager.RevertVStorageObject_Task(vslm_id(vdisk_id), ds_obj,
+                                                                               vslm_id(snid))
+                running.append((vdisk_id, snid, location, task))
+            except Exception as e:
+                print(colored("##Exception in reverting the FCD %s : %s", "red") % (vdisk_id, resilience.fault_message(e)))
 
-        ds_obj = get_obj(content, [vim.Datastore], list_vdiskid_ds[1])
+    # the unattached reverts run side by side in vCenter, waiting for them one after the other costs nothing more
+    for vdisk_id, snid, location, task in running:
+        try:
+            resilience.wait_for_tasks(si, [task])
+            print(colored("##Reverted the FCD %s to the snapshot %s. Task id : %s", "green") % (vdisk_id, snid, task))
+            audit.log('revertVStorageObject', task=task, vDiskId=vdisk_id, snapshotId=snid,
+                      datastore=location['datastore'])
+        except Exception as e:
+            print(colored("##Exception in reverting the FCD %s : %s", "red") % (vdisk_id, resilience.fault_message(e)))
 
 
-        #Detaching the disk before revert as that's the design of FCD 6.7 atleast!!!!
-        print(colored("##Detaching the disk %s before the revert.","green")%(disk_label))
-        detach_disk.Detach_vmdk(si, content,vm_obj, dn)
-        print(colored("##Detaching is done and I have captured the virtual disk id, datastore name, controllerKey and unitNumber as %s, %s, %s and %s which I need for attaching the device back.","green")%(list_vdiskid_ds[0], list_vdiskid_ds[1], list_vdiskid_ds[2], list_vdiskid_ds[3]))
+WATCH_COLORS = {'present': None, 'created': 'green', 'added': 'green', 'promoted': 'green', 'success': 'green',
+                'removed': 'red', 'error': 'red', 'current': 'yellow', 'renamed': 'yellow', 'backing': 'yellow'}
 
 
-        #I am reverting with the FCD api
-        snapshot_task = content.vStorageObjectManager.RevertVStorageObject_Task(id_object1, ds_obj, id_object2)
-        tasks.wait_for_tasks(si,[snapshot_task])
-        print(colored("##Reverted to the snapshot with snapshot id  %s. Task id : %s ","green")%(snid,snapshot_task))
+#Print the snapshot changes of the VMs and their FCDs until interrupted
+def watch_snapshots(si, content, args):
+    vms = None
+    if args.vmname:
+        vms = [get_obj(content, [vim.VirtualMachine], name.strip()) for name in args.vmname.split(',')]
+        if not all(vms):
+            print("###VM {} is not found\n".format(args.vmname))
+            return
 
-        ##Look, I am immediately attaching it back...
-        print(colored("##Attaching the disk %s back","green")%(disk_label))
-        attach_disk.Attach_vmdk(si, content, vm_obj, list_vdiskid_ds[0] ,list_vdiskid_ds[1],list_vdiskid_ds[2] , list_vdiskid_ds[3])
-        print (colored("##The disk %s is attached back.","green")%(disk_label))
-        print(colored("##Though the disk is attached back, the operation needs reboot as the snapshot is not an in-memory snapshot","green"))
+    try:
+        for events in snapwatch.watch_snapshots(si, vms, args.max_wait):
+            for event in events:
+                if args.json:
+                    print(json.dumps(event, default=str))
+                    continue
+                if event['kind'] == 'fcd-task':
+                    text = "%s task %s %s" % (event['descriptionId'], event['task'], event['change'])
+                elif event['kind'] == 'disk':
+                    text = "%s %s (vDiskId %s, %s)" % (event['vm'], event['label'], event['vDiskId'],
+                                                        event['fileName'])
+                elif event['kind'] == 'fcd-snapshot' and event['change'] == 'error':
+                    text = "%s %s FCD %s snapshots could not be read : %s" % (
+                        event['vm'], event['label'], event['vDiskId'], event['error'])
+                elif event['kind'] == 'fcd-snapshot':
+                    text = "%s %s FCD %s snapshot %s, description : %s, creation Time : %s" % (
+                        event['vm'], event['label'], event['vDiskId'], event['id'], event['description'],
+                        event['createTime'])
+                else:
+                    text = "%s snapshot %s (%s), description : %s, creation Time : %s" % (
+                        event['vm'], event['name'], event['id'], event['description'], event['createTime'])
+                print(colored("###%-9s %-12s %s" % (event['change'], event['kind'], text),
+                              WATCH_COLORS.get(event['change'])))
+    except KeyboardInterrupt:
+        pass
 
-    except Exception as e:
-        print(colored("##Exception in Reverting to the snapshot is : %s ","red")%(e.msg))
 
-        ## I am attaching disk that is detached back, though snapshot revert process raised an exception
-        print(colored("##Attaching the disk %s back","green")%(disk_label))
-        attach_disk.Attach_vmdk(si, content, vm_obj, list_vdiskid_ds[0] ,list_vdiskid_ds[1],list_vdiskid_ds[2] , list_vdiskid_ds[3])
-        print (colored("##The disk %s is attached back.","green")%(disk_label))
-        print(colored("##Could not revert to snapshot in time instant because of %s exception, but attached the disk back again which was detached for revert operation","green")%(e.msg))
+def preflight_disks(si, vm_obj, args, op):
+    """ The disk numbers of -d the operation can run on, the problems of the others are printed first.
+    Hardware version, vDiskId, snapshot id and datastore space of all the disks are checked in one pass """
+
+    disk_numbers = [n.strip() for n in args.disk_number.split(',')]
+    steps = [{'id': n, 'op': op, 'vm': args.vmname, 'disk': n, 'snid': args.snid} for n in disk_numbers]
+    issues = preflight.check(si, steps, placement.policy(args), vms={args.vmname: vm_obj})
+    for n in disk_numbers:
+        for problem in issues.get(n, []):
+            print(colored("###Hard disk %s is skipped : %s", "red") % (n, problem))
+    return [n for n in disk_numbers if n not in issues]
 
 
 def main():
     args = get_args()
 
 
-    si = SmartConnectNoSSL(host=args.host,
-                           user=args.user,
-                           pwd=args.password,
-                           port=int(args.port))
-    atexit.register(Disconnect, si)
+    si = soapreplay.connect(args, lambda: SmartConnectNoSSL(host=args.host,
+                                                            user=args.user,
+                                                            pwd=args.password,
+                                                            port=int(args.port)))
+    resilience.install(si, args.user, args.password)
+    invfile.use(args.inventory, args.host, args.inventory_max_age)
+    audit.use(args.audit, args.host)
+    placement.configure(si, args, args.host)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
 
     content = si.RetrieveContent()
 
+    if args.operation == 'view' and args.watch:
+        watch_snapshots(si, content, args)
+        return
+
     if args.vmname:
         print("##Searching for VM %s" % (args.vmname))
         vm_obj = get_obj(content, [vim.VirtualMachine], args.vmname)
@@ -366,35 +598,56 @@ def main():
         if vm_obj:
             print("###Found VM %s\n" % args.vmname)
             if args.operation == 'create':
-                hw_version = (vm_obj.config.version).split('-')[1]
-                if int(hw_version) >= 13:
-                    if args.description == '':
-                        print(colored("###The snapshot needs description", "red"))
-                    else:
-                        if args.disk_number:
-                            create_snapshot(args.host, si, content, vm_obj, args.disk_number, args.description)
-                else:
-                    print(
-                        "###Taking snapshot on VM whoes hardware version is less than VMX-13 does not allow revert operation. Hence, better not to go with FCD level snapshot  here.")
+                if args.description == '':
+                    print(colored("###The snapshot needs description", "red"))
+                elif args.disk_number:
+                    disks = preflight_disks(si, vm_obj, args, 'snapshot')
+                    if disks:
+                        # the preflight read the snapshots and the datastores of the disks already
+                        create_snapshot(args.host, si, content, vm_obj, ','.join(disks), args.description,
+                                        checked=True)
 
             if args.operation == 'view':
-                view_snapshot(content, vm_obj, args.disk_number)
+                view_snapshot(si, content, vm_obj, args.disk_number)
                 print("\n\n")
 
-            if args.operation == 'delete':
-                if args.disk_number:
-                    delete_snapshot(si, content, vm_obj, args.disk_number, args.snid)
+            if args.operation == 'delete' and args.disk_number:
+                disks = preflight_disks(si, vm_obj, args, 'delete')
+                if disks:
+                    delete_snapshot(si, content, vm_obj, ','.join(disks), args.snid)
 
-            if args.operation == 'revert':
-                if args.disk_number:
-                    revert_snapshot(si, content, vm_obj, args.disk_number, args.snid)
+            if args.operation == 'revert' and args.disk_number:
+                disks = preflight_disks(si, vm_obj, args, 'revert')
+                if disks:
+                    revert_snapshot(si, content, vm_obj, ','.join(disks), args.snid)
 
         else:
             print("###VM {} is not found\n".format(args.vmname))
     else:
+        if args.operation == 'revert' and args.virtualDiskId and args.snid:
+            vdisk_ids = [value.strip() for value in args.virtualDiskId.split(',')]
+            snids = [value.strip() for value in args.snid.split(',')]
+            if len(vdisk_ids) != len(snids):
+                print(colored("###Give one snapshot id per vDiskId", "red"))
+                return
+            revert_vDisk_Snapshots(si, content, list(zip(vdisk_ids, snids)))
+            return
         if args.operation == 'view':
+            from_file = False
+            if args.virtualDiskId and not args.dataStore:
+                args.dataStore = inventory_datastore(args.virtualDiskId)
+                from_file = bool(args.dataStore)
             if args.virtualDiskId and args.dataStore:
-                view_vDisk_Snapshot(content,args.virtualDiskId, args.dataStore)
+                try:
+                    view_vDisk_Snapshot(content,args.virtualDiskId, args.dataStore)
+                except vim.fault.NotFound:
+                    if not from_file:
+                        raise
+                    # the FCD was moved since the inventory file was written
+                    args.dataStore = live_datastore(si, args.virtualDiskId)
+                    if not args.dataStore:
+                        raise
+                    view_vDisk_Snapshot(content,args.virtualDiskId, args.dataStore)
             else:
                 print("Please provide vDisk Id, DataStore or VM name")
         else:
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+#######################################################################################################
+#
+#
+#pyvmomi script to report name, path, guest, annotation, power state, IP and pending question of all
+#VMs below a folder, with the number of FCDs attached to each, as text, JSON lines or CSV. All VMs are
+#fetched with one paged PropertyCollector query.
+#
+#
+#######################################################################################################
+
+from __future__ import print_function
+
+import atexit
+import sys
+from tools import cli, resilience, transport, vm
+from pyVim.connect import SmartConnectNoSSL, Disconnect
+from termcolor import colored
+
+
+def get_args():
+    parser = cli.build_arg_parser()
+
+    parser.add_argument('-folder',
+                        help='Inventory path of the folder to report on, e.g. DC1/vm/prod. Default is all VMs')
+    parser.add_argument('-format', choices=['text', 'json', 'csv'], default='text',
+                        help='Output format')
+    parser.add_argument('-output',
+                        help='File to write the report to instead of stdout')
+    parser.add_argument('-no-fcds', dest='no_fcds', action='store_true',
+                        help='Skip the FCD counts, which need the device list of every VM')
+    parser.add_argument('-page-size', dest='page_size', type=int, default=500,
+                        help='VMs per PropertyCollector page')
+    transport.add_arguments(parser)
+
+    args = parser.parse_args()
+    return cli.prompt_for_password(args)
+
+
+def main():
+    args = get_args()
+
+    si = SmartConnectNoSSL(host=args.host,
+                           user=args.user,
+                           pwd=args.password,
+                           port=int(args.port))
+    atexit.register(Disconnect, si)
+    resilience.install(si, args.user, args.password)
+    transport.tune(si, compress=not args.no_compress, pool_size=args.http_pool)
+
+    root = None
+    if args.folder:
+        root = si.content.searchIndex.FindByInventoryPath(args.folder)
+        if root is None:
+            print(colored("##Folder %s not found" % args.folder, "red"))
+            return
+
+    records = vm.iter_vm_report(si, root, page_size=args.page_size, fcd_counts=not args.no_fcds)
+    if args.output:
+        with open(args.output, 'w') as out:
+            count = vm.write_vm_report(records, args.format, out)
+        print(colored("##Wrote %d VMs to %s" % (count, args.output), "green"))
+    else:
+        vm.write_vm_report(records, args.format, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()